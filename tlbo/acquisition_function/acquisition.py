@@ -1,7 +1,7 @@
 # encoding=utf8
 import abc
 import logging
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 from scipy.stats import norm
@@ -18,8 +18,13 @@ class AbstractAcquisitionFunction(object, metaclass=abc.ABCMeta):
     ----------
     model
     logger
+    chunk_size : int
+        Maximal number of points whose acquisition values are computed at once, which
+        bounds the memory of the model predictions. Can be changed with update().
     """
 
+    chunk_size = 10000
+
     def __str__(self):
         return type(self).__name__ + " (" + self.long_name + ")"
 
@@ -66,14 +71,38 @@ class AbstractAcquisitionFunction(object, metaclass=abc.ABCMeta):
         np.ndarray(N, 1)
             acquisition values for X
         """
-        X = convert_configurations_to_array(configurations)
+        return self.compute_array(convert_configurations_to_array(configurations))
+
+    def compute_array(self, X: np.ndarray, chunk_size: Optional[int] = None):
+        """Computes the acquisition value for configurations that are encoded already
+
+        Parameters
+        ----------
+        X : np.ndarray(N, D)
+            The configurations encoded as by convert_configurations_to_array.
+        chunk_size : int, optional
+            Maximal number of points computed at once, defaults to self.chunk_size.
+            None in both computes all points at once.
+
+        Returns
+        -------
+        np.ndarray(N, 1)
+            acquisition values for X, where NaN is replaced by the lowest float
+        """
         if len(X.shape) == 1:
             X = X[np.newaxis, :]
+        if chunk_size is None:
+            chunk_size = self.chunk_size
 
-        acq = self._compute(X)
+        if X.shape[0] == 0:
+            acq = np.empty((0, 1))
+        elif chunk_size is None or X.shape[0] <= chunk_size:
+            acq = self._compute(X)
+        else:
+            acq = np.concatenate([self._compute(X[i:i + chunk_size]) for i in range(0, X.shape[0], chunk_size)])
         if np.any(np.isnan(acq)):
             idx = np.where(np.isnan(acq))[0]
-            acq[idx, :] = -np.finfo(np.float).max
+            acq[idx, :] = -np.finfo(np.float64).max
         return acq
 
     @abc.abstractmethod
@@ -1,8 +1,9 @@
 # encoding=utf8
 import numpy as np
+from scipy.stats import norm
 
 from tlbo.model.base_epm import AbstractEPM as AbstractModel
-from tlbo.acquisition_function.acquisition import AbstractAcquisitionFunction, EI, PI
+from tlbo.acquisition_function.acquisition import AbstractAcquisitionFunction, EI
 
 
 class TAQ_EI(AbstractAcquisitionFunction):
@@ -11,7 +12,9 @@ class TAQ_EI(AbstractAcquisitionFunction):
                  model: AbstractModel,
                  source_models,
                  aggregate_method='taff',
-                 par: float=0.0):
+                 par: float=0.0,
+                 n_samples: int=100,
+                 rng: np.random.RandomState=None):
         """Constructor
 
         Parameters
@@ -19,9 +22,19 @@ class TAQ_EI(AbstractAcquisitionFunction):
         model : AbstractEPM
             A model that implements at least
                  - predict_marginalized_over_instances(X)
+        source_models : list
+            The fixed surrogates of the source problems.
+        aggregate_method : str, default='taff'
+            'taff' scores a source by the improvement over its eta, averaged over
+            n_samples draws from its predictive distribution; 'taff2' by the
+            probability of improvement.
         par : float, default=0.0
             Controls the balance between exploration and exploitation of the
             acquisition function.
+        n_samples : int, default=100
+            Number of draws per configuration in 'taff'.
+        rng : np.random.RandomState, optional
+            Draws the samples of 'taff'.
         """
 
         super(TAQ_EI, self).__init__(model)
@@ -32,19 +45,77 @@ class TAQ_EI(AbstractAcquisitionFunction):
         self.source_models = source_models
         self.source_etas = None
         self.model_weights = None
+        if aggregate_method not in ['taff', 'taff2']:
+            raise ValueError('Invalid method!')
         self.aggregate_method = aggregate_method
-        if self.aggregate_method == 'taff2':
-            self.pi_list = list()
-            for i in range(len(self.source_models)):
-                self.pi_list.append(PI(self.source_models[i]))
+        self.n_samples = n_samples
+        self.rng = np.random.RandomState(1) if rng is None else rng
+
+        # The source models and etas are fixed, so the source terms are cached
+        # per configuration row: row bytes -> row in the buffer.
+        self.source_cache_size = 100000
+        self._source_row_index = dict()
+        self._source_terms = np.empty((0, len(source_models)))
+
+    def update(self, **kwargs):
+        if 'source_etas' in kwargs:
+            self._source_row_index = dict()
+            self._source_terms = np.empty((0, len(self.source_models)))
+        super(TAQ_EI, self).update(**kwargs)
 
     def update_target_model(self, model, eta, num_data, model_weights):
         self.ei_acq.update(model=model, eta=eta, num_data=num_data)
         self.model_weights = model_weights
 
-        if self.aggregate_method == 'taff2':
-            for i in range(len(self.source_models)):
-                self.pi_list[i].update(eta=self.source_etas[i])
+    def _compute_source_terms(self, X: np.ndarray):
+        n, n_source_tasks = X.shape[0], len(self.source_models)
+        m, v = np.empty((n, n_source_tasks)), np.empty((n, n_source_tasks))
+        for i in range(n_source_tasks):
+            _m, _v = self.source_models[i].predict_marginalized_over_instances(X)
+            m[:, i], v[:, i] = _m.reshape(-1), _v.reshape(-1)
+        s = np.sqrt(v)
+        eta = np.asarray(self.source_etas, dtype=np.float64)
+
+        if self.aggregate_method == 'taff':
+            terms = np.empty((n, n_source_tasks))
+            for i in range(n_source_tasks):
+                y = self.rng.normal(m[:, i], s[:, i], size=(self.n_samples, n))
+                terms[:, i] = np.maximum(eta[i] - y, 0).mean(axis=0)
+            return terms
+        return norm.cdf((eta - m) / s)
+
+    def cache_source_terms(self, X: np.ndarray):
+        """Compute the source terms of a block of configurations, e.g., the candidate pool, and keep them."""
+        self.get_source_terms(X)
+
+    def get_source_terms(self, X: np.ndarray):
+        """Return the improvement terms of the source models as an [n_samples, K] array."""
+        if self.source_etas is None:
+            raise ValueError('No source etas specified.')
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        keys = [row.tobytes() for row in X]
+        idx = np.array([self._source_row_index.get(key, -1) for key in keys], dtype=np.int64)
+        miss = np.flatnonzero(idx < 0)
+        if miss.shape[0] == 0:
+            return self._source_terms[idx]
+
+        terms = np.empty((X.shape[0], len(self.source_models)))
+        hit = np.flatnonzero(idx >= 0)
+        terms[hit] = self._source_terms[idx[hit]]
+        terms[miss] = self._compute_source_terms(X[miss])
+
+        size = len(self._source_row_index)
+        free = self.source_cache_size - size
+        new_rows = list()
+        for i in miss:
+            if len(new_rows) >= free:
+                break
+            if keys[i] not in self._source_row_index:
+                self._source_row_index[keys[i]] = size + len(new_rows)
+                new_rows.append(i)
+        if new_rows:
+            self._source_terms = np.concatenate([self._source_terms, terms[new_rows]])
+        return terms
 
     def _compute(self, X: np.ndarray, **kwargs):
         """Computes the EI value and its derivatives.
@@ -70,16 +141,7 @@ class TAQ_EI(AbstractAcquisitionFunction):
         n_source_tasks = len(self.source_models)
         assert n_source_tasks + 1 == len(self.model_weights)
         acq_values = self.model_weights[-1] * self.ei_acq._compute(X)
-        for i in range(n_source_tasks):
-            if self.aggregate_method == 'taff':
-                m, v = self.source_models[i].predict_marginalized_over_instances(X)
-                s = np.sqrt(v)
-                eta_ = self.source_etas[i]
-                y_ = np.random.normal(m.flatten(), s.flatten())
-                par_acq = np.max(eta_ - y_, 0)
-                acq_values += self.model_weights[i] * par_acq.reshape(-1, 1)
-            elif self.aggregate_method == 'taff2':
-                acq_values += self.model_weights[i] * self.pi_list[i]._compute(X)
-            else:
-                raise ValueError('Invalid method!')
+        if n_source_tasks > 0:
+            weights = np.asarray(self.model_weights[:-1], dtype=np.float64)
+            acq_values += self.get_source_terms(X).dot(weights).reshape(-1, 1)
         return acq_values
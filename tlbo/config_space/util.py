@@ -1,8 +1,12 @@
-from typing import List
+from typing import List, Optional, Sequence
 
 import numpy as np
 
-from ConfigSpace import Configuration
+from ConfigSpace import Configuration, ConfigurationSpace
+from ConfigSpace.hyperparameters import OrdinalHyperparameter
+from ConfigSpace.conditions import AndConjunction, OrConjunction, EqualsCondition, NotEqualsCondition, \
+    LessThanCondition, GreaterThanCondition, InCondition
+from ConfigSpace.forbidden import ForbiddenAndConjunction, ForbiddenEqualsClause, ForbiddenInClause
 
 
 def convert_configurations_to_array(configs: List[Configuration]) -> np.ndarray:
@@ -20,3 +24,123 @@ def convert_configurations_to_array(configs: List[Configuration]) -> np.ndarray:
     np.ndarray
     """
     return np.array([config.get_array() for config in configs], dtype=np.float64)
+
+
+def _evaluate_condition(condition, X: np.ndarray) -> np.ndarray:
+    """Evaluate a condition on each row of X, where inactive values are NaN."""
+    if isinstance(condition, AndConjunction):
+        return np.logical_and.reduce([_evaluate_condition(c, X) for c in condition.components])
+    if isinstance(condition, OrConjunction):
+        return np.logical_or.reduce([_evaluate_condition(c, X) for c in condition.components])
+
+    value = X[:, condition.parent_vector_id]
+    active = ~np.isnan(value)
+    with np.errstate(invalid='ignore'):
+        if isinstance(condition, EqualsCondition):
+            return active & (value == condition.vector_value)
+        if isinstance(condition, NotEqualsCondition):
+            return active & (value != condition.vector_value)
+        if isinstance(condition, LessThanCondition):
+            return active & (value < condition.vector_value)
+        if isinstance(condition, GreaterThanCondition):
+            return active & (value > condition.vector_value)
+        if isinstance(condition, InCondition):
+            return active & np.isin(value, condition.vector_values)
+    return np.array([bool(active[i]) and condition._evaluate_vector(X[i]) for i in range(X.shape[0])], dtype=bool)
+
+
+def _is_forbidden(clause, X: np.ndarray) -> np.ndarray:
+    """Evaluate a forbidden clause on each row of X; clauses on inactive values do not apply."""
+    if isinstance(clause, ForbiddenAndConjunction):
+        return np.logical_and.reduce([_is_forbidden(c, X) for c in clause.components])
+    if isinstance(clause, ForbiddenEqualsClause):
+        return X[:, clause.vector_id] == clause.vector_value
+    if isinstance(clause, ForbiddenInClause):
+        return np.isin(X[:, clause.vector_id], list(clause.vector_values))
+    return np.array([clause.is_forbidden_vector(X[i], strict=False) for i in range(X.shape[0])], dtype=bool)
+
+
+def sample_configuration_array(config_space: ConfigurationSpace, size: int,
+                               rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+    """Sample configurations directly as an array in the encoding of ``Configuration.get_array()``.
+
+    Inactive hyperparameters are NaN, and forbidden rows are rejected and sampled
+    again. With the default rng of the configuration space, the rows are the ones
+    ``config_space.sample_configuration(size)`` would return.
+
+    Parameters
+    ----------
+    config_space : ConfigurationSpace
+    size : int
+        Number of configurations.
+    rng : np.random.RandomState, optional
+        Defaults to the random state of config_space.
+
+    Returns
+    -------
+    np.ndarray(size, D)
+    """
+    if rng is None:
+        rng = config_space.random
+    hyperparameters = config_space.get_hyperparameters()
+    conditions = [(config_space.get_idx_by_hyperparameter_name(hp.name), config_space.get_parent_conditions_of(hp.name))
+                  for hp in hyperparameters]
+    forbiddens = config_space.get_forbiddens()
+
+    accepted = []
+    n_accepted = 0
+    missing = size
+    n_rejected = 0
+    while n_accepted < size:
+        if missing != size:
+            missing = int(1.1 * missing)
+        X = np.empty((missing, len(hyperparameters)), dtype=np.float64)
+        for i, hp in enumerate(hyperparameters):
+            if isinstance(hp, OrdinalHyperparameter):
+                # OrdinalHyperparameter._sample only draws single values.
+                X[:, i] = rng.randint(0, hp.num_elements, size=missing)
+            else:
+                X[:, i] = hp._sample(rng, missing)
+        # The hyperparameters are in topological order, so the parents are resolved first.
+        for idx, parent_conditions in conditions:
+            if len(parent_conditions) > 0:
+                active = np.logical_and.reduce([_evaluate_condition(c, X) for c in parent_conditions])
+                X[~active, idx] = np.nan
+        if len(forbiddens) > 0:
+            forbidden = np.logical_or.reduce([_is_forbidden(clause, X) for clause in forbiddens])
+            n_rejected += int(np.sum(forbidden))
+            if n_rejected >= size * 100:
+                raise ValueError('Cannot sample valid configuration for %s' % config_space)
+            X = X[~forbidden]
+        accepted.append(X)
+        n_accepted += X.shape[0]
+        missing = size - n_accepted
+    return np.concatenate(accepted)[:size]
+
+
+class ConfigurationArray(Sequence):
+    """A sequence of configurations backed by their array, which creates each
+    Configuration only when it is accessed."""
+
+    def __init__(self, config_space: ConfigurationSpace, array: np.ndarray, origin: Optional[str] = None,
+                 configs: Optional[dict] = None):
+        self.config_space = config_space
+        self.array = array
+        self.origin = origin
+        # The configurations that exist already, by row.
+        self._configs = dict() if configs is None else dict(configs)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        config = self._configs.get(idx)
+        if config is None:
+            config = Configuration(self.config_space, vector=self.array[idx])
+            config.origin = self.origin
+            self._configs[idx] = config
+        return config
+
+    def __len__(self):
+        return self.array.shape[0]
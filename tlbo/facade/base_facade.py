@@ -1,8 +1,11 @@
 import abc
 import time
+import hashlib
+import multiprocessing
 import typing
 import numpy as np
 from typing import List
+from sklearn.model_selection import KFold
 
 from tlbo.model.util_funcs import get_types
 from tlbo.model.model_builder import build_model
@@ -10,6 +13,132 @@ from tlbo.utils.constants import VERY_SMALL_NUMBER, MAXINT
 from tlbo.config_space import ConfigurationSpace, Configuration
 from tlbo.config_space.util import convert_configurations_to_array
 from tlbo.utils.normalization import zero_mean_unit_var_normalization, zero_one_normalization
+from tlbo.utils.hpo_history import HPOHistory
+from tlbo.utils.scipy_solver import scipy_solve, simplex_solve
+
+
+def _build_source_surrogate(task):
+    """Train the surrogate on one source problem; run in worker processes."""
+    surrogate_type, config_space, seed, X, y, normalize = task
+    # Every source surrogate uses the same seed as in the serial path.
+    model = build_model(surrogate_type, config_space, np.random.RandomState(seed))
+
+    if normalize == 'standardize':
+        if (y == y[0]).all():
+            y[0] += 1e-4
+        y, _, _ = zero_mean_unit_var_normalization(y)
+    elif normalize == 'scale':
+        if (y == y[0]).all():
+            y[0] += 1e-4
+        y, _, _ = zero_one_normalization(y)
+        y = 2 * y - 1.
+    else:
+        raise ValueError('Invalid parameter in norm.')
+
+    model.train(X, y)
+    return model, np.min(y)
+
+
+def _get_source_data(hpo_evaluation_data, num_src_hpo_trial):
+    if isinstance(hpo_evaluation_data, HPOHistory):
+        # Read the encoded configurations without decoding them.
+        X = np.array(hpo_evaluation_data.config_array[:num_src_hpo_trial], dtype=np.float64)
+        y = np.array(hpo_evaluation_data.perfs[:num_src_hpo_trial], dtype=np.float64)
+        return X, y
+    _X, _y = list(), list()
+    for _config, _config_perf in hpo_evaluation_data.items():
+        _X.append(_config)
+        _y.append(_config_perf)
+    X = convert_configurations_to_array(_X)
+    y = np.array(_y, dtype=np.float64)
+    return X[:num_src_hpo_trial], y[:num_src_hpo_trial]
+
+
+def _build_single_surrogate(task):
+    """Train the surrogate on the target observations; run in worker processes."""
+    surrogate_type, config_space, seed, X, y, normalize = task
+    model = build_model(surrogate_type, config_space, np.random.RandomState(seed))
+    model.train(X, _normalize_target(y, normalize))
+    return model
+
+
+def _normalize_target(y, normalize):
+    # y may be a read-only view on the observation buffer.
+    if normalize == 'standardize':
+        if (y == y[0]).all():
+            y = y.copy()
+            y[0] += 1e-4
+        y, _, _ = zero_mean_unit_var_normalization(y)
+    elif normalize == 'scale':
+        if (y == y[0]).all():
+            y = y.copy()
+            y[0] += 1e-4
+        y, _, _ = zero_one_normalization(y)
+    else:
+        pass
+    return y
+
+
+def _map_tasks(func, tasks, n_jobs, verbose=False):
+    results = list()
+    if n_jobs > 1 and len(tasks) > 1:
+        # A pool per call is intended: it is used at most once per BO iteration, forking
+        # it costs ~30ms next to the model fits, and no idle workers outlive the call.
+        pool = multiprocessing.Pool(min(n_jobs, len(tasks)))
+        try:
+            # imap keeps the order of the tasks.
+            for result in pool.imap(func, tasks):
+                if verbose:
+                    print('.', end='')
+                results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            if verbose:
+                print('.', end='')
+            results.append(func(task))
+    return results
+
+
+def _get_data_digest(X, y):
+    digest = hashlib.md5(X.tobytes())
+    digest.update(y.tobytes())
+    return X.shape, digest.hexdigest()
+
+
+def _get_source_task_key(task):
+    surrogate_type, _, _, X, y, normalize = task
+    return (surrogate_type, normalize) + _get_data_digest(X, y)
+
+
+# Source surrogates shared by the facades: task key -> (model, eta).
+_shared_source_surrogates = None
+
+
+def share_source_surrogates(config_space: ConfigurationSpace, source_hpo_data: List, seed: int,
+                            normalize_list=('standardize', 'scale'), num_src_hpo_trial: int = 50,
+                            surrogate_type='rf', n_jobs: int = 1):
+    """Train the source surrogates once and share them with the facades built afterwards.
+
+    The facades reuse the shared surrogates instead of training them with
+    their own seeds, so all of them are trained with seed here. Processes
+    forked afterwards inherit the surrogates copy-on-write.
+    """
+    global _shared_source_surrogates
+    tasks = list()
+    for hpo_evaluation_data in source_hpo_data:
+        X, y = _get_source_data(hpo_evaluation_data, num_src_hpo_trial)
+        for normalize in normalize_list:
+            tasks.append((surrogate_type, config_space, seed, X, y.copy(), normalize))
+    keys = [_get_source_task_key(task) for task in tasks]
+    print('start to train %d shared base surrogates.' % len(tasks))
+    results = _map_tasks(_build_source_surrogate, tasks, n_jobs, verbose=True)
+    print()
+    if _shared_source_surrogates is None:
+        _shared_source_surrogates = dict()
+    _shared_source_surrogates.update(zip(keys, results))
 
 
 class BaseFacade(object):
@@ -19,7 +148,8 @@ class BaseFacade(object):
                  target_hp_configs: List = None,
                  history_dataset_features: List = None,
                  num_src_hpo_trial: int = 50,
-                 surrogate_type='rf'):
+                 surrogate_type='rf',
+                 n_jobs: int = 1):
         self.method_id = None
         self.config_space = config_space
         self.random_seed = seed
@@ -34,6 +164,8 @@ class BaseFacade(object):
         if history_dataset_features is not None:
             assert len(history_dataset_features) == self.K
         self.surrogate_type = surrogate_type
+        # The number of processes used to train the source surrogates.
+        self.n_jobs = n_jobs
 
         self.types, self.bounds = get_types(config_space)
         self.instance_features = None
@@ -46,6 +178,21 @@ class BaseFacade(object):
         self.meta_feature_imputer = None
 
         self.target_weight = []
+        # The surrogates trained in the last call of build_surrogates: task key -> model.
+        self._cached_surrogates = dict()
+        # Assign row i to cross validation fold i % k instead of contiguous blocks. A new
+        # observation then leaves the training data of its own fold unchanged, so that
+        # fold model is reused; the default keeps the weights of contiguous folds.
+        self.stable_cv_folds = False
+        # The solver of the simplex weights: 'slsqp' (scipy_solve), or 'eg' and 'pg' (simplex_solve).
+        self.weight_solver = 'slsqp'
+
+        # Source surrogates are fixed after construction, so their predictions
+        # are cached per configuration row: row bytes -> row in the buffers.
+        self.source_cache_size = 100000
+        self._source_row_index = dict()
+        self._source_mu = None
+        self._source_var = None
 
     @abc.abstractmethod
     def train(self, X: np.ndarray, y: np.ndarray):
@@ -59,53 +206,139 @@ class BaseFacade(object):
         print('start to train base surrogates.')
         start_time = time.time()
         self.source_surrogates = list()
+        tasks = list()
         for hpo_evaluation_data in self.source_hpo_data:
-            print('.', end='')
-            model = build_model(self.surrogate_type, self.config_space,
-                                np.random.RandomState(self.random_seed))
-            _X, _y = list(), list()
-            for _config, _config_perf in hpo_evaluation_data.items():
-                _X.append(_config)
-                _y.append(_config_perf)
-            X = convert_configurations_to_array(_X)
-            y = np.array(_y, dtype=np.float64)
-            X = X[:self.num_src_hpo_trial]
-            y = y[:self.num_src_hpo_trial]
-
-            if normalize == 'standardize':
-                if (y == y[0]).all():
-                    y[0] += 1e-4
-                y, _, _ = zero_mean_unit_var_normalization(y)
-            elif normalize == 'scale':
-                if (y == y[0]).all():
-                    y[0] += 1e-4
-                y, _, _ = zero_one_normalization(y)
-                y = 2 * y - 1.
-            else:
-                raise ValueError('Invalid parameter in norm.')
-
-            self.eta_list.append(np.min(y))
-            model.train(X, y)
+            X, y = _get_source_data(hpo_evaluation_data, self.num_src_hpo_trial)
+            tasks.append((self.surrogate_type, self.config_space, self.random_seed, X, y, normalize))
+
+        # Reuse the shared surrogates and train the missing ones.
+        results = [None] * len(tasks)
+        if _shared_source_surrogates is not None:
+            for idx, task in enumerate(tasks):
+                results[idx] = _shared_source_surrogates.get(_get_source_task_key(task))
+        missing_ids = [idx for idx, result in enumerate(results) if result is None]
+        for idx, result in zip(missing_ids, _map_tasks(_build_source_surrogate, [tasks[idx] for idx in missing_ids],
+                                                       self.n_jobs, verbose=True)):
+            results[idx] = result
+
+        for model, eta in results:
+            self.eta_list.append(eta)
             self.source_surrogates.append(model)
         print()
         print('Building base surrogates took %.3fs.' % (time.time() - start_time))
 
-    def build_single_surrogate(self, X: np.ndarray, y: np.array, normalize):
+    def _predict_sources_uncached(self, X: np.ndarray):
+        n = X.shape[0]
+        mu, var = np.empty((n, self.K)), np.empty((n, self.K))
+        for i in range(self.K):
+            _mu, _var = self.source_surrogates[i].predict(X)
+            mu[:, i] = _mu.reshape(-1)
+            var[:, i] = _var.reshape(-1)
+        return mu, var
+
+    def cache_source_predictions(self, X: np.ndarray):
+        """Predict a block of configurations with all source surrogates and keep the results."""
+        if self.source_surrogates is None or self.K == 0:
+            return
+        self.predict_sources(X)
+
+    def predict_sources(self, X: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Return the means and variances of the source surrogates as two [n_samples, K] arrays."""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        n = X.shape[0]
+        if self._source_mu is None:
+            self._source_mu, self._source_var = np.empty((0, self.K)), np.empty((0, self.K))
+        keys = [row.tobytes() for row in X]
+        idx = np.array([self._source_row_index.get(key, -1) for key in keys], dtype=np.int64)
+        miss = np.flatnonzero(idx < 0)
+        if miss.shape[0] == 0:
+            return self._source_mu[idx], self._source_var[idx]
+
+        mu, var = np.empty((n, self.K)), np.empty((n, self.K))
+        hit = np.flatnonzero(idx >= 0)
+        mu[hit], var[hit] = self._source_mu[idx[hit]], self._source_var[idx[hit]]
+        mu[miss], var[miss] = self._predict_sources_uncached(X[miss])
+
+        size = len(self._source_row_index)
+        free = self.source_cache_size - size
+        new_rows = list()
+        for i in miss:
+            if len(new_rows) >= free:
+                break
+            if keys[i] not in self._source_row_index:
+                self._source_row_index[keys[i]] = size + len(new_rows)
+                new_rows.append(i)
+        if new_rows:
+            self._source_mu = np.concatenate([self._source_mu, mu[new_rows]])
+            self._source_var = np.concatenate([self._source_var, var[new_rows]])
+        return mu, var
+
+    def batch_predict(self, X: np.ndarray):
+        """Return the mean predictions of the source surrogates as a [n_samples, K] array."""
+        mu, _ = self.predict_sources(X)
+        return mu
+
+    def build_single_surrogate(self, X: np.ndarray, y: np.array, normalize, model=None):
+        """Train a new target surrogate, or refit model with its current hyperparameters if given.
+
+        A GP model extends its Cholesky factor when X extends its training data.
+        """
         assert normalize in ['standardize', 'scale', 'none']
-        model = build_model(self.surrogate_type, self.config_space, np.random.RandomState(self.random_seed))
-        if normalize == 'standardize':
-            if (y == y[0]).all():
-                y[0] += 1e-4
-            y, _, _ = zero_mean_unit_var_normalization(y)
-        elif normalize == 'scale':
-            if (y == y[0]).all():
-                y[0] += 1e-4
-            y, _, _ = zero_one_normalization(y)
-        else:
-            pass
+        if model is None:
+            return _build_single_surrogate((self.surrogate_type, self.config_space, self.random_seed, X, y, normalize))
+        y = _normalize_target(y, normalize)
+        if hasattr(model, 'update'):
+            return model.update(X, y)
+        return model.train(X, y)
 
-        model.train(X, y)
-        return model
+    def build_surrogates(self, data_list: List, normalize):
+        """Train one surrogate per (X, y) pair in data_list, e.g., the folds of a cross validation.
+
+        The models are trained with n_jobs processes; a model trained on the
+        same data in the previous call is reused, which happens for the folds
+        a new observation does not enter (see stable_cv_folds).
+        """
+        assert normalize in ['standardize', 'scale', 'none']
+        tasks = [(self.surrogate_type, self.config_space, self.random_seed, X, y, normalize) for X, y in data_list]
+        keys = [(self.surrogate_type, self.random_seed, normalize) + _get_data_digest(X, y) for X, y in data_list]
+        models = [self._cached_surrogates.get(key) for key in keys]
+        missing_ids = [idx for idx, model in enumerate(models) if model is None]
+        for idx, model in zip(missing_ids, _map_tasks(_build_single_surrogate, [tasks[idx] for idx in missing_ids],
+                                                      self.n_jobs)):
+            models[idx] = model
+        # Only keep the models of the last call.
+        self._cached_surrogates = dict(zip(keys, models))
+        return models
+
+    def solve_weights(self, pred_y, true_y, x0=None, loss_type=3):
+        """Fit simplex weights of the columns of pred_y to true_y, warm-started from x0, e.g. the current weights.
+
+        x0 is renormalized to sum to one; the uniform weights are used if it is None or all zero.
+        """
+        if x0 is not None:
+            x0 = np.asarray(x0, dtype=np.float64).reshape(-1)
+            x0 = x0 / np.sum(x0) if np.sum(x0) > 0 else None
+        if self.weight_solver == 'slsqp':
+            return scipy_solve(pred_y, true_y, loss_type, debug=True, x0=x0)
+        return simplex_solve(pred_y, true_y, loss_type, debug=True, x0=x0, method=self.weight_solver)
+
+    def get_cv_folds(self, n: int, k_fold_num=5):
+        """Return the (train_idx, val_idx) pairs of a k-fold cross validation on n rows."""
+        if not self.stable_cv_folds:
+            return list(KFold(n_splits=k_fold_num).split(np.arange(n)))
+        fold_ids = np.arange(n) % k_fold_num
+        return [(np.flatnonzero(fold_ids != fold), np.flatnonzero(fold_ids == fold)) for fold in range(k_fold_num)]
+
+    def predict_target_surrogate_cv(self, X: np.ndarray, y: np.array, normalize='standardize', k_fold_num=5):
+        """Return the out-of-fold predictions of the target surrogate in the order of X."""
+        folds = self.get_cv_folds(X.shape[0], k_fold_num)
+        models = self.build_surrogates([(X[train_idx], y[train_idx]) for train_idx, _ in folds], normalize)
+        _mu, _var = np.empty(X.shape[0]), np.empty(X.shape[0])
+        for model, (_, val_idx) in zip(models, folds):
+            mu, var = model.predict(X[val_idx])
+            _mu[val_idx] = mu.flatten()
+            _var[val_idx] = var.flatten()
+        return _mu, _var
 
     def predict_marginalized_over_instances(self, X: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
         """Predict mean and variance marginalized over all instances.
@@ -145,51 +378,46 @@ class BaseFacade(object):
     def combine_predictions(self, X: np.array,
                             combination_method: str = 'idp_lc',
                             weight: np.array = None):
-        n, m = X.shape[0], len(self.w)
-        mu, var = np.zeros((n, 1)), np.zeros((n, 1))
+        n = X.shape[0]
         if weight is None:
             w = self.w
         else:
             w = weight
+        w = np.asarray(w, dtype=np.float64)
 
-        var_buf = np.zeros((n, m))
-        mu_buf = np.zeros((n, m))
-
-        target_var = None
-        # Predictions from source surrogates.
-        for i in range(0, self.K + 1):
-            if i == self.K:
-                if self.target_surrogate is not None:
-                    _mu, _var = self.target_surrogate.predict(X)
-                    target_var = _var
-                else:
-                    _mu, _var = np.zeros((n, 1)), np.zeros((n, 1))
-                    raise ValueError('Target surrogate is none.')
-            else:
-                _mu, _var = self.source_surrogates[i].predict(X)
-            mu += w[i] * _mu
-            var += w[i] * w[i] * _var
-
-            # compute the gaussian experts.
-            if combination_method == 'gpoe':
-                _mu, _var = _mu.flatten(), _var.flatten()
-                if (_var != 0).all():
-                    var_buf[:, i] = (1. / _var * w[i])
-                    mu_buf[:, i] = (1. / _var * _mu * w[i])
+        if self.target_surrogate is None:
+            raise ValueError('Target surrogate is none.')
+        target_mu, target_var = self.target_surrogate.predict(X)
+        target_mu, target_var = target_mu.reshape(-1), target_var.reshape(-1)
+        source_mu, source_var = self.predict_sources(X)
 
         if combination_method == 'no_var':
-            return mu, target_var
+            mu = source_mu @ w[:self.K] + w[self.K] * target_mu
+            return mu.reshape(-1, 1), target_var.reshape(-1, 1)
         elif combination_method == 'idp_lc':
-            return mu, var
-        elif combination_method == 'gpoe':
-            tmp = np.sum(var_buf, axis=1)
-            tmp[tmp == 0.] = 1e-5
-            var = 1. / tmp
-            mu = np.sum(mu_buf, axis=1) * var
+            mu = source_mu @ w[:self.K] + w[self.K] * target_mu
+            var = source_var @ np.square(w[:self.K]) + w[self.K] * w[self.K] * target_var
             return mu.reshape(-1, 1), var.reshape(-1, 1)
+        elif combination_method == 'gpoe':
+            return self.gpoe_fusion(source_mu, source_var, target_mu, target_var, w)
         else:
             raise ValueError('Invalid combination method %s.' % combination_method)
 
+    def gpoe_fusion(self, source_mu, source_var, target_mu, target_var, w):
+        """Combine the gaussian experts; experts with any zero variance are dropped."""
+        mu = np.c_[source_mu, target_mu]
+        var = np.c_[source_var, target_var]
+        valid = (var != 0).all(axis=0)
+        var_buf, mu_buf = np.zeros_like(var), np.zeros_like(mu)
+        var_buf[:, valid] = 1. / var[:, valid] * w[valid]
+        mu_buf[:, valid] = 1. / var[:, valid] * mu[:, valid] * w[valid]
+
+        tmp = np.sum(var_buf, axis=1)
+        tmp[tmp == 0.] = 1e-5
+        var = 1. / tmp
+        mu = np.sum(mu_buf, axis=1) * var
+        return mu.reshape(-1, 1), var.reshape(-1, 1)
+
     def scale_fit_meta_features(self, meta_features):
         from sklearn.preprocessing import MinMaxScaler, Imputer
         meta_features = np.array(meta_features)
@@ -1,16 +1,16 @@
 import numpy as np
-from sklearn.model_selection import KFold
 from tlbo.facade.base_facade import BaseFacade
-from tlbo.utils.scipy_solver import scipy_solve
+from tlbo.utils.ranking import pairwise_penalty_loss, generalization_penalty_loss
 
 _scale_method = 'standardize'
 
 
 class OBTL(BaseFacade):
     def __init__(self, config_space, source_hpo_data, target_hp_configs, seed,
-                 surrogate_type='rf', num_src_hpo_trial=50, fusion_method='idp_lc'):
+                 surrogate_type='rf', num_src_hpo_trial=50, fusion_method='idp_lc', n_jobs=1):
         super().__init__(config_space, source_hpo_data, seed, target_hp_configs,
-                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial)
+                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial,
+                         n_jobs=n_jobs)
         self.method_id = 'obtl'
         self.fusion_method = fusion_method
         self.build_source_surrogates(normalize=_scale_method)
@@ -24,16 +24,6 @@ class OBTL(BaseFacade):
         self.iteration_id = 0
         self.target_y_range = None
 
-    def batch_predict(self, X: np.ndarray):
-        pred_y = None
-        for i in range(0, self.K):
-            mu, _ = self.source_surrogates[i].predict(X)
-            if pred_y is not None:
-                pred_y = np.c_[pred_y, mu]
-            else:
-                pred_y = mu
-        return pred_y
-
     def train(self, X: np.ndarray, y: np.array):
         instance_num = X.shape[0]
         # Build the target surrogate.
@@ -64,51 +54,24 @@ class OBTL(BaseFacade):
         self.iteration_id += 1
 
     def learn_source_weights(self, pred_y, true_y):
-        x, status = scipy_solve(pred_y, true_y, 3, debug=True)
+        x, status = self.solve_weights(pred_y, true_y, x0=self.w[:self.K])
         if status:
             x[x < 1e-3] = 0.
             self.w[:self.K] = x
 
-    def predict_target_surrogate_cv(self, X, y):
-        k_fold_num = 5
-        _mu, _var = list(), list()
-
-        # Conduct K-fold cross validation.
-        kf = KFold(n_splits=k_fold_num)
-        idxs = list()
-        for train_idx, val_idx in kf.split(X):
-            idxs.extend(list(val_idx))
-            X_train, X_val, y_train, y_val = X[train_idx,:], X[val_idx,:], y[train_idx], y[val_idx]
-            model = self.build_single_surrogate(X_train, y_train, normalize=_scale_method)
-            mu, var = model.predict(X_val)
-            mu, var = mu.flatten(), var.flatten()
-            _mu.extend(list(mu))
-            _var.extend(list(var))
-        assert (np.array(idxs) == np.arange(X.shape[0])).all()
-        return np.asarray(_mu), np.asarray(_var)
-
     def calculate_weight_by_sampling(self, X, y):
-        surrogate_ids = list()
-        surrogate_preds = list()
-        for idx in range(self.K):
-            surrogate_ids.append(idx)
-            _mu, _var = self.source_surrogates[idx].predict(X)
-            surrogate_preds.append((_mu.flatten(), _var.flatten()))
-        target_surrogate_pred = self.predict_target_surrogate_cv(X, y)
+        surrogate_ids = list(range(self.K))
+        source_mu, source_var = self.predict_sources(X)
+        surrogate_preds = [(source_mu[:, idx], source_var[:, idx]) for idx in range(self.K)]
+        target_surrogate_pred = self.predict_target_surrogate_cv(X, y, normalize=_scale_method)
         surrogate_ids.append(self.K)
         surrogate_preds.append(target_surrogate_pred)
 
-        surrogate_idx = list()
         _K = len(surrogate_ids)
-
-        for _ in range(self.ensemble_size):
-            loss_list = list()
-            for i in range(_K):
-                _mu, _var = surrogate_preds[i]
-                y_pred = np.random.normal(_mu, _var)
-                loss_list.append(self.calculate_ranking_loss(y_pred, y))
-            argmin_idx = np.argmin(loss_list)
-            surrogate_idx.append(argmin_idx)
+        # Draw all samples up front, in the same order as sampling round by round.
+        samples = np.array([[np.random.normal(_mu, _var) for _mu, _var in surrogate_preds]
+                            for _ in range(self.ensemble_size)])
+        surrogate_idx = np.argmin(self.calculate_ranking_loss(samples, y), axis=1)
 
         _w = np.zeros(_K)
         for idx in surrogate_idx:
@@ -122,29 +85,10 @@ class OBTL(BaseFacade):
     def get_weights(self):
         return self.w
 
-    @staticmethod
-    def penalty_func(x1, x2, y1, y2):
-        if x1 < x2:
-            z = y2 - y1
-        else:
-            z = y1 - y2
-        z *= 10.
-        return np.log(1 + np.exp(-z))
-
     @staticmethod
     def calculate_ranking_loss(y_pred: np.array, y: np.array):
-        n = y_pred.shape[0]
-        ranking_loss = 0.
-        for i in range(n):
-            for j in range(i+1, n):
-                ranking_loss += OBTL.penalty_func(y[i], y[j], y_pred[i], y_pred[j])
-        return ranking_loss / (n * n)
+        return pairwise_penalty_loss(y_pred, y)
 
     @staticmethod
     def calculate_generalization_ranking_loss(y_pred: np.array, y: np.array, start_idx=0):
-        n = y_pred.shape[0]
-        ranking_loss = 0.
-        for i in range(start_idx, n):
-            for j in range(n):
-                ranking_loss += OBTL.penalty_func(y[i], y[j], y_pred[i], y_pred[j])
-        return ranking_loss
+        return generalization_penalty_loss(y_pred, y, start_idx)
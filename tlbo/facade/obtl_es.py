@@ -1,6 +1,7 @@
 import numpy as np
-from sklearn.model_selection import KFold
 from tlbo.facade.base_facade import BaseFacade
+from tlbo.utils.ranking import pairwise_penalty_loss, generalization_penalty_loss, \
+    greedy_ensemble_selection
 
 
 _scale_method = 'standardize'
@@ -8,9 +9,10 @@ _scale_method = 'standardize'
 
 class ES(BaseFacade):
     def __init__(self, config_space, source_hpo_data, target_hp_configs, seed,
-                 surrogate_type='rf', num_src_hpo_trial=50, fusion_method='idp_lc'):
+                 surrogate_type='rf', num_src_hpo_trial=50, fusion_method='idp_lc', n_jobs=1):
         super().__init__(config_space, source_hpo_data, seed, target_hp_configs,
-                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial)
+                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial,
+                         n_jobs=n_jobs)
         self.method_id = 'es'
         self.fusion_method = fusion_method
         self.build_source_surrogates(normalize=_scale_method)
@@ -24,32 +26,13 @@ class ES(BaseFacade):
         self.iteration_id = 0
         self.target_y_range = None
 
-    @staticmethod
-    def penalty_func(x1, x2, y1, y2):
-        if x1 < x2:
-            z = y2 - y1
-        else:
-            z = y1 - y2
-        z *= 10.
-        return np.log(1 + np.exp(-z))
-
     @staticmethod
     def calculate_ranking_loss(y_pred: np.array, y: np.array):
-        n = y_pred.shape[0]
-        ranking_loss = 0.
-        for i in range(n):
-            for j in range(i+1, n):
-                ranking_loss += ES.penalty_func(y[i], y[j], y_pred[i], y_pred[j])
-        return ranking_loss / (n * n)
+        return pairwise_penalty_loss(y_pred, y)
 
     @staticmethod
     def calculate_generalization_ranking_loss(y_pred: np.array, y: np.array, start_idx=0):
-        n = y_pred.shape[0]
-        ranking_loss = 0.
-        for i in range(start_idx, n):
-            for j in range(n):
-                ranking_loss += ES.penalty_func(y[i], y[j], y_pred[i], y_pred[j])
-        return ranking_loss
+        return generalization_penalty_loss(y_pred, y, start_idx)
 
     def train(self, X: np.ndarray, y: np.array):
         instance_num = X.shape[0]
@@ -58,26 +41,9 @@ class ES(BaseFacade):
         self.target_y_range = 0.5 * (np.max(y) - np.min(y))
         print('Target y range', self.target_y_range)
 
-        base_predictions = list()
-        surrogate_ensemble = list()
-        surrogate_idx = list()
-
-        for i in range(self.K):
-            mean, _ = self.source_surrogates[i].predict(X)
-            mean = mean.flatten()
-            base_predictions.append(mean)
-
-        for iter_id in range(self.ensemble_size):
-            loss_list = list()
-            for i in range(self.K):
-                if len(surrogate_ensemble) == 0:
-                    _predictions = base_predictions[i]
-                else:
-                    _predictions = np.mean(surrogate_ensemble + [base_predictions[i]], axis=0)
-                loss_list.append(self.calculate_ranking_loss(_predictions, y))
-            argmin_idx = np.argmin(loss_list)
-            surrogate_ensemble.append(base_predictions[argmin_idx])
-            surrogate_idx.append(argmin_idx)
+        source_mu, _ = self.predict_sources(X)
+        surrogate_idx = greedy_ensemble_selection(source_mu.T, y, self.ensemble_size,
+                                                  loss_func=self.calculate_ranking_loss)
 
         # Update base surrogates' weights.
         w_source = np.zeros(self.K)
@@ -107,48 +73,16 @@ class ES(BaseFacade):
         self.hist_ws.append(w)
         self.iteration_id += 1
 
-    def predict_target_surrogate_cv(self, X, y):
-        k_fold_num = 5
-        _mu, _var = list(), list()
-
-        # Conduct K-fold cross validation.
-        kf = KFold(n_splits=k_fold_num)
-        idxs = list()
-        for train_idx, val_idx in kf.split(X):
-            idxs.extend(list(val_idx))
-            X_train, X_val, y_train, y_val = X[train_idx,:], X[val_idx,:], y[train_idx], y[val_idx]
-            model = self.build_single_surrogate(X_train, y_train, normalize=_scale_method)
-            mu, var = model.predict(X_val)
-            mu, var = mu.flatten(), var.flatten()
-            _mu.extend(list(mu))
-            _var.extend(list(var))
-        assert (np.array(idxs) == np.arange(X.shape[0])).all()
-        return np.asarray(_mu), np.asarray(_var)
-
     def calculate_target_weight(self, X, y):
-        surrogate_ids = list()
-        surrogate_preds = list()
-        for idx in range(self.K):
-            surrogate_ids.append(idx)
-            _mu, _var = self.source_surrogates[idx].predict(X)
-            surrogate_preds.append((_mu.flatten(), _var.flatten()))
-        target_surrogate_pred = self.predict_target_surrogate_cv(X, y)
+        surrogate_ids = list(range(self.K))
+        source_mu, source_var = self.predict_sources(X)
+        surrogate_preds = [(source_mu[:, idx], source_var[:, idx]) for idx in range(self.K)]
+        target_surrogate_pred = self.predict_target_surrogate_cv(X, y, normalize=_scale_method)
         surrogate_ids.append(self.K)
         surrogate_preds.append(target_surrogate_pred)
         base_predictions = [item[0] for item in surrogate_preds]
-
-        _ensemble = list()
-        surrogate_idx = list()
-        _K = len(surrogate_ids)
-
-        for iter_id in range(self.ensemble_size):
-            loss_list = list()
-            for i in range(_K):
-                _predictions = np.mean(_ensemble + [base_predictions[i]], axis=0)
-                loss_list.append(self.calculate_ranking_loss(_predictions, y))
-            argmin_idx = np.argmin(loss_list)
-            _ensemble.append(base_predictions[argmin_idx])
-            surrogate_idx.append(argmin_idx)
+        surrogate_idx = greedy_ensemble_selection(np.array(base_predictions), y, self.ensemble_size,
+                                                  loss_func=self.calculate_ranking_loss)
 
         _w = np.zeros(len(base_predictions))
         for idx in surrogate_idx:
@@ -158,32 +92,18 @@ class ES(BaseFacade):
         return _w[-1]
 
     def calculate_weight_by_sampling(self, X, y):
-        surrogate_ids = list()
-        surrogate_preds = list()
-        for idx in range(self.K):
-            surrogate_ids.append(idx)
-            _mu, _var = self.source_surrogates[idx].predict(X)
-            surrogate_preds.append((_mu.flatten(), _var.flatten()))
-        target_surrogate_pred = self.predict_target_surrogate_cv(X, y)
+        surrogate_ids = list(range(self.K))
+        source_mu, source_var = self.predict_sources(X)
+        surrogate_preds = [(source_mu[:, idx], source_var[:, idx]) for idx in range(self.K)]
+        target_surrogate_pred = self.predict_target_surrogate_cv(X, y, normalize=_scale_method)
         surrogate_ids.append(self.K)
         surrogate_preds.append(target_surrogate_pred)
 
-        surrogate_idx = list()
         _K = len(surrogate_ids)
-        # kfold = KFold(n_splits=5)
-        # n_val = len(list(kfold.split(X))[-1][0])
-        # start_idx = X.shape[0] - n_val - 100
-        # start_idx = 0
-
-        for _ in range(self.ensemble_size):
-            loss_list = list()
-            for i in range(_K):
-                _mu, _var = surrogate_preds[i]
-                y_pred = np.random.normal(_mu, _var)
-                # loss_list.append(self.calculate_generalization_ranking_loss(y_pred, y, start_idx))
-                loss_list.append(self.calculate_ranking_loss(y_pred, y))
-            argmin_idx = np.argmin(loss_list)
-            surrogate_idx.append(argmin_idx)
+        # Draw all samples up front, in the same order as sampling round by round.
+        samples = np.array([[np.random.normal(_mu, _var) for _mu, _var in surrogate_preds]
+                            for _ in range(self.ensemble_size)])
+        surrogate_idx = np.argmin(self.calculate_ranking_loss(samples, y), axis=1)
 
         _w = np.zeros(_K)
         for idx in surrogate_idx:
@@ -203,11 +123,9 @@ class ES(BaseFacade):
         var *= (w[-1] * w[-1])
 
         # Base surrogate predictions with corresponding weights.
-        for i in range(0, self.K):
-            if w[i] > 0:
-                mu_t, var_t = self.source_surrogates[i].predict(X)
-                mu += (w[i] * mu_t)
-                var += (w[i] * w[i] * var_t)
+        source_mu, source_var = self.predict_sources(X)
+        mu += (source_mu @ w[:self.K]).reshape(-1, 1)
+        var += (source_var @ np.square(w[:self.K])).reshape(-1, 1)
         return mu, var
 
     def get_weights(self):
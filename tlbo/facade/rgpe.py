@@ -1,12 +1,14 @@
 import numpy as np
 from tlbo.facade.base_facade import BaseFacade
+from tlbo.utils.ranking import discordant_counts
 
 
 class RGPE(BaseFacade):
     def __init__(self, config_space, source_hpo_data, target_hp_configs, seed,
-                 surrogate_type='rf', num_src_hpo_trial=50, only_source=False):
+                 surrogate_type='rf', num_src_hpo_trial=50, only_source=False, n_jobs=1):
         super().__init__(config_space, source_hpo_data, seed, target_hp_configs,
-                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial)
+                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial,
+                         n_jobs=n_jobs)
         self.method_id = 'rgpe'
         self.only_source = only_source
         self.build_source_surrogates(normalize='standardize')
@@ -22,12 +24,12 @@ class RGPE(BaseFacade):
         self.iteration_id = 0
 
     def train(self, X: np.ndarray, y: np.array):
+        # The folds below perturb y in place.
+        y = y.copy()
         # Train the target surrogate and update the weight w.
-        mu_list, var_list = list(), list()
-        for id in range(self.K):
-            mu, var = self.source_surrogates[id].predict(X)
-            mu_list.append(mu)
-            var_list.append(var)
+        source_mu, source_var = self.predict_sources(X)
+        mu_list = [source_mu[:, id:id + 1] for id in range(self.K)]
+        var_list = [source_var[:, id:id + 1] for id in range(self.K)]
 
         # Build the target surrogate.
         self.target_surrogate = self.build_single_surrogate(X, y, normalize='standardize')
@@ -41,79 +43,56 @@ class RGPE(BaseFacade):
         # skip_target_surrogate = True
 
         if not skip_target_surrogate:
-            # Conduct leave-one-out evaluation.
             if instance_num < k_fold_num:
-                for i in range(instance_num):
-                    row_indexs = list(range(instance_num))
-                    del row_indexs[i]
-                    if (y[row_indexs] == y[row_indexs[0]]).all():
-                        y[row_indexs[0]] += 1e-4
-                    model = self.build_single_surrogate(X[row_indexs, :], y[row_indexs], normalize='standardize')
-                    mu, var = model.predict(X)
-                    cached_mu_list.append(mu)
-                    cached_var_list.append(var)
+                # Conduct leave-one-out evaluation.
+                fold_rows = [[i] for i in range(instance_num)]
+            elif self.stable_cv_folds:
+                fold_rows = [list(val_idx) for _, val_idx in self.get_cv_folds(instance_num, k_fold_num)]
             else:
                 # Conduct K-fold cross validation.
                 fold_num = instance_num // k_fold_num
-                for i in range(k_fold_num):
-                    row_indexs = list(range(instance_num))
-                    bound = (instance_num - i * fold_num) if i == (k_fold_num - 1) else fold_num
-                    for index in range(bound):
-                        del row_indexs[i * fold_num]
-
-                    if (y[row_indexs] == y[row_indexs[0]]).all():
-                        y[row_indexs[0]] += 1e-4
-
-                    model = self.build_single_surrogate(X[row_indexs, :], y[row_indexs], normalize='standardize')
-                    mu, var = model.predict(X)
-                    cached_mu_list.append(mu)
-                    cached_var_list.append(var)
-
-        argmin_list = [0] * (self.K + 1)
-        ranking_loss_caches = list()
+                fold_rows = [list(range(fold_num * fold, instance_num if fold == (k_fold_num - 1)
+                                        else (fold + 1) * fold_num)) for fold in range(k_fold_num)]
+
+            fold_data = list()
+            for rows in fold_rows:
+                row_indexs = sorted(set(range(instance_num)) - set(rows))
+                if (y[row_indexs] == y[row_indexs[0]]).all():
+                    y[row_indexs[0]] += 1e-4
+                fold_data.append((X[row_indexs, :], y[row_indexs]))
+
+            for model in self.build_surrogates(fold_data, normalize='standardize'):
+                mu, var = model.predict(X)
+                cached_mu_list.append(mu)
+                cached_var_list.append(var)
+
+        # Draw all samples up front, in the same order as sampling round by round.
+        source_samples, target_samples = list(), list()
         for _ in range(self.num_sample):
-            ranking_loss_list = list()
-            for id in range(self.K):
-                sampled_y = np.random.normal(mu_list[id], var_list[id])
-                rank_loss = 0
-                for i in range(len(y)):
-                    for j in range(len(y)):
-                        if (y[i] < y[j]) ^ (sampled_y[i] < sampled_y[j]):
-                            rank_loss += 1
-                ranking_loss_list.append(rank_loss)
-
-            # Compute ranking loss for target surrogate.
-            rank_loss = 0
+            source_samples.append([np.random.normal(mu_list[id], var_list[id]) for id in range(self.K)])
             if not skip_target_surrogate:
-                if instance_num < k_fold_num:
-                    for i in range(instance_num):
-                        sampled_y = np.random.normal(cached_mu_list[i], cached_var_list[i])
-                        for j in range(instance_num):
-                            if (y[i] < y[j]) ^ (sampled_y[i] < sampled_y[j]):
-                                rank_loss += 1
-                else:
-                    fold_num = instance_num // k_fold_num
-                    for fold in range(k_fold_num):
-                        sampled_y = np.random.normal(cached_mu_list[fold], cached_var_list[fold])
-                        bound = instance_num if fold == (k_fold_num - 1) else (fold + 1) * fold_num
-                        for i in range(fold_num * fold, bound):
-                            for j in range(instance_num):
-                                if (y[i] < y[j]) ^ (sampled_y[i] < sampled_y[j]):
-                                    rank_loss += 1
-            else:
-                rank_loss = instance_num * instance_num
-            ranking_loss_list.append(rank_loss)
-            ranking_loss_caches.append(ranking_loss_list)
+                target_samples.append([np.random.normal(cached_mu_list[fold], cached_var_list[fold])
+                                       for fold in range(len(cached_mu_list))])
+        source_samples = np.array(source_samples).reshape(self.num_sample, self.K, instance_num)
+
+        ranking_loss_caches = np.zeros((self.num_sample, self.K + 1), dtype=np.int64)
+        ranking_loss_caches[:, :self.K] = discordant_counts(source_samples, y)
+
+        # Compute ranking loss for target surrogate.
+        if not skip_target_surrogate:
+            target_samples = np.array(target_samples).reshape(self.num_sample, len(cached_mu_list), instance_num)
+            for fold, rows in enumerate(fold_rows):
+                ranking_loss_caches[:, -1] += discordant_counts(target_samples[:, fold], y, rows=rows)
+        else:
+            ranking_loss_caches[:, -1] = instance_num * instance_num
 
-            argmin_task = np.argmin(ranking_loss_list)
-            argmin_list[argmin_task] += 1
+        argmin_list = np.bincount(np.argmin(ranking_loss_caches, axis=1), minlength=self.K + 1)
 
         # Update the weights.
         for id in range(self.K + 1):
             self.w[id] = argmin_list[id] / self.num_sample
 
         # Set weight dilution flag.
-        ranking_loss_caches = np.array(ranking_loss_caches)
         threshold = sorted(ranking_loss_caches[:, -1])[int(self.num_sample * 0.95)]
         for id in range(self.K):
             median = sorted(ranking_loss_caches[:, id])[int(self.num_sample * 0.5)]
@@ -145,11 +124,10 @@ class RGPE(BaseFacade):
         var *= (self.w[-1] * self.w[-1])
 
         # Base surrogate predictions with corresponding weights.
-        for i in range(0, self.K):
-            if not self.ignored_flag[i]:
-                mu_t, var_t = self.source_surrogates[i].predict(X)
-                mu += self.w[i] * mu_t
-                var += self.w[i] * self.w[i] * var_t
+        w = np.where(self.ignored_flag, 0., self.w[:self.K])
+        source_mu, source_var = self.predict_sources(X)
+        mu += (source_mu @ w).reshape(-1, 1)
+        var += (source_var @ np.square(w)).reshape(-1, 1)
         return mu, var
 
     def get_weights(self):
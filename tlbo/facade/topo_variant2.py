@@ -1,16 +1,16 @@
 import numpy as np
 from sklearn.model_selection import KFold
 from tlbo.facade.base_facade import BaseFacade
-from tlbo.utils.scipy_solver import scipy_solve
 
 _scale_method = 'standardize'
 
 
 class TOPO(BaseFacade):
     def __init__(self, config_space, source_hpo_data, target_hp_configs, seed,
-                 surrogate_type='rf', num_src_hpo_trial=50, fusion_method='idp_lc'):
+                 surrogate_type='rf', num_src_hpo_trial=50, fusion_method='idp_lc', n_jobs=1):
         super().__init__(config_space, source_hpo_data, seed, target_hp_configs,
-                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial)
+                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial,
+                         n_jobs=n_jobs)
         self.method_id = 'topo'
         self.fusion_method = fusion_method
         self.build_source_surrogates(normalize=_scale_method)
@@ -23,34 +23,6 @@ class TOPO(BaseFacade):
         self.iteration_id = 0
         self.target_y_range = None
 
-    def batch_predict(self, X: np.ndarray):
-        pred_y = None
-        for i in range(0, self.K):
-            mu, _ = self.source_surrogates[i].predict(X)
-            if pred_y is not None:
-                pred_y = np.c_[pred_y, mu]
-            else:
-                pred_y = mu
-        return pred_y
-
-    def predict_target_surrogate_cv(self, X, y):
-        k_fold_num = 5
-        _mu, _var = list(), list()
-
-        # Conduct K-fold cross validation.
-        kf = KFold(n_splits=k_fold_num)
-        idxs = list()
-        for train_idx, val_idx in kf.split(X):
-            idxs.extend(list(val_idx))
-            X_train, X_val, y_train, y_val = X[train_idx,:], X[val_idx,:], y[train_idx], y[val_idx]
-            model = self.build_single_surrogate(X_train, y_train, normalize=_scale_method)
-            mu, var = model.predict(X_val)
-            mu, var = mu.flatten(), var.flatten()
-            _mu.extend(list(mu))
-            _var.extend(list(var))
-        assert (np.array(idxs) == np.arange(X.shape[0])).all()
-        return np.asarray(_mu), np.asarray(_var)
-
     def predict_source_surrogate_cv(self, X, y):
         k_fold_num = 5
         _mu = list()
@@ -90,7 +62,7 @@ class TOPO(BaseFacade):
 
         if instance_num >= self.min_num_y:
             _s_pred_y, _ = self.predict_source_surrogate_cv(X, y)
-            _t_pred_y, _ = self.predict_target_surrogate_cv(X, y)
+            _t_pred_y, _ = self.predict_target_surrogate_cv(X, y, normalize=_scale_method)
             _pred_y = np.c_[_t_pred_y.reshape((-1, 1)), _t_pred_y.reshape((-1, 1))]
             w_target = self.compute_target_weight(np.mat(_pred_y), np.mat(y).T)
             print(w_target)
@@ -109,13 +81,14 @@ class TOPO(BaseFacade):
         self.iteration_id += 1
 
     def learn_source_weights(self, pred_y, true_y):
-        x, status = scipy_solve(pred_y, true_y, 3, debug=True)
+        x, status = self.solve_weights(pred_y, true_y, x0=self.w[:self.K])
         if status:
             x[x < 1e-3] = 0.
         return status, x
 
     def compute_target_weight(self, pred_y, true_y):
-        x, status = scipy_solve(pred_y, true_y, 3, debug=True)
+        # The two columns are the target predictions, weighted like the target surrogate.
+        x, status = self.solve_weights(pred_y, true_y, x0=[1. - self.w[-1], self.w[-1]])
         if status:
             x[x < 1e-3] = 0.
             return x[-1]
@@ -1,16 +1,15 @@
 import numpy as np
-from sklearn.model_selection import KFold
 from tlbo.facade.base_facade import BaseFacade
-from tlbo.utils.scipy_solver import scipy_solve
 
 _scale_method = 'standardize'
 
 
 class TOPO_V3(BaseFacade):
     def __init__(self, config_space, source_hpo_data, target_hp_configs, seed,
-                 surrogate_type='rf', num_src_hpo_trial=50, fusion_method='idp_lc'):
+                 surrogate_type='rf', num_src_hpo_trial=50, fusion_method='idp_lc', n_jobs=1):
         super().__init__(config_space, source_hpo_data, seed, target_hp_configs,
-                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial)
+                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial,
+                         n_jobs=n_jobs)
         self.method_id = 'topo_2phase'
         self.fusion_method = fusion_method
         self.build_source_surrogates(normalize=_scale_method)
@@ -23,34 +22,6 @@ class TOPO_V3(BaseFacade):
         self.iteration_id = 0
         self.target_y_range = None
 
-    def batch_predict(self, X: np.ndarray):
-        pred_y = None
-        for i in range(0, self.K):
-            mu, _ = self.source_surrogates[i].predict(X)
-            if pred_y is not None:
-                pred_y = np.c_[pred_y, mu]
-            else:
-                pred_y = mu
-        return pred_y
-
-    def predict_target_surrogate_cv(self, X, y):
-        k_fold_num = 5
-        _mu, _var = list(), list()
-
-        # Conduct K-fold cross validation.
-        kf = KFold(n_splits=k_fold_num)
-        idxs = list()
-        for train_idx, val_idx in kf.split(X):
-            idxs.extend(list(val_idx))
-            X_train, X_val, y_train, y_val = X[train_idx,:], X[val_idx,:], y[train_idx], y[val_idx]
-            model = self.build_single_surrogate(X_train, y_train, normalize=_scale_method)
-            mu, var = model.predict(X_val)
-            mu, var = mu.flatten(), var.flatten()
-            _mu.extend(list(mu))
-            _var.extend(list(var))
-        assert (np.array(idxs) == np.arange(X.shape[0])).all()
-        return np.asarray(_mu), np.asarray(_var)
-
     def train(self, X: np.ndarray, y: np.array):
         instance_num = X.shape[0]
         # Build the target surrogate.
@@ -67,7 +38,7 @@ class TOPO_V3(BaseFacade):
                 self.w[:self.K] = x
         else:
             # Learn the weights of all base surrogates.
-            _pred_y, _ = self.predict_target_surrogate_cv(X, y)
+            _pred_y, _ = self.predict_target_surrogate_cv(X, y, normalize=_scale_method)
             _pred_y = np.c_[pred_y, _pred_y.reshape((-1, 1))]
             status, x = self.learn_weights(np.mat(_pred_y), np.mat(y).T)
             w_source, w_target = x[:-1], x[-1]
@@ -89,13 +60,13 @@ class TOPO_V3(BaseFacade):
         self.iteration_id += 1
 
     def learn_source_weights(self, pred_y, true_y):
-        x, status = scipy_solve(pred_y, true_y, 3, debug=True)
+        x, status = self.solve_weights(pred_y, true_y, x0=self.w[:self.K])
         if status:
             x[x < 1e-3] = 0.
         return status, x
 
     def learn_weights(self, pred_y, true_y):
-        x, status = scipy_solve(pred_y, true_y, 3, debug=True)
+        x, status = self.solve_weights(pred_y, true_y, x0=self.w)
         if status:
             x[x < 1e-3] = 0.
         else:
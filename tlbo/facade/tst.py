@@ -1,12 +1,15 @@
 import numpy as np
 from tlbo.facade.base_facade import BaseFacade
+from tlbo.utils.ranking import count_discordant_pairs
 
 
 class TST(BaseFacade):
     def __init__(self, config_space, source_hpo_data, target_hp_configs, seed,
-                 surrogate_type='rf', num_src_hpo_trial=50, use_metafeatures=False, metafeatures=None, only_source=False):
+                 surrogate_type='rf', num_src_hpo_trial=50, use_metafeatures=False, metafeatures=None, only_source=False,
+                 n_jobs=1):
         super().__init__(config_space, source_hpo_data, seed, target_hp_configs,
-                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial)
+                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial,
+                         n_jobs=n_jobs)
         self.method_id = 'tst'
         self.only_source = only_source
         self.build_source_surrogates(normalize='scale')
@@ -31,15 +34,12 @@ class TST(BaseFacade):
         self.target_surrogate = self.build_single_surrogate(X, y, normalize='scale')
 
         n_sample = X.shape[0]
+        if not self.use_metafeatures:
+            source_mu, _ = self.predict_sources(X)
         for _id in range(self.K):
             if not self.use_metafeatures:
-                mu, _ = self.source_surrogates[_id].predict(X)
-                discordant_paris, total_pairs = 0, 0
-                for i in range(n_sample):
-                    for j in range(i + 1, n_sample):
-                        if (y[i] < y[j]) ^ (mu[i] < mu[j]):
-                            discordant_paris += 1
-                        total_pairs += 1
+                discordant_paris = count_discordant_pairs(source_mu[:, _id], y)
+                total_pairs = n_sample * (n_sample - 1) // 2
                 tmp = discordant_paris / total_pairs / self.bandwidth
             else:
                 tmp = self.meta_dist[_id] / self.bandwidth
@@ -62,11 +62,9 @@ class TST(BaseFacade):
 
     def predict(self, X: np.array):
         mu, var = self.target_surrogate.predict(X)
-        denominator = 0.75
-        for i in range(0, self.K):
-            weight = self.w[i]
-            mu_t, _ = self.source_surrogates[i].predict(X)
-            mu += weight * mu_t
-            denominator += weight
-        mu /= denominator
+        # Kernel-weighted average of the target and source means.
+        w = np.asarray(self.w[:self.K], dtype=np.float64)
+        source_mu, _ = self.predict_sources(X)
+        mu += (source_mu @ w).reshape(-1, 1)
+        mu /= 0.75 + np.sum(w)
         return mu, var
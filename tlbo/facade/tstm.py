@@ -4,9 +4,10 @@ from tlbo.facade.base_facade import BaseFacade
 
 class TSTM(BaseFacade):
     def __init__(self, config_space, source_hpo_data, target_hp_configs, seed,
-                 surrogate_type='rf', num_src_hpo_trial=50, metafeatures=None):
+                 surrogate_type='rf', num_src_hpo_trial=50, metafeatures=None, n_jobs=1):
         super().__init__(config_space, source_hpo_data, seed, target_hp_configs,
-                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial)
+                         surrogate_type=surrogate_type, num_src_hpo_trial=num_src_hpo_trial,
+                         n_jobs=n_jobs)
         self.method_id = 'tst'
         self.build_source_surrogates(normalize='scale')
         # Weights for base surrogates and the target surrogate.
@@ -48,11 +49,9 @@ class TSTM(BaseFacade):
 
     def predict(self, X: np.array):
         mu, var = self.target_surrogate.predict(X)
-        denominator = 0.75
-        for i in range(0, self.K):
-            weight = self.w[i]
-            mu_t, _ = self.source_surrogates[i].predict(X)
-            mu += weight * mu_t
-            denominator += weight
-        mu /= denominator
+        # Kernel-weighted average of the target and source means.
+        w = np.asarray(self.w[:self.K], dtype=np.float64)
+        source_mu, _ = self.predict_sources(X)
+        mu += (source_mu @ w).reshape(-1, 1)
+        mu /= 0.75 + np.sum(w)
         return mu, var
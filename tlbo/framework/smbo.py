@@ -1,18 +1,16 @@
 import os
-import sys
 import abc
-import traceback
 import numpy as np
 from tlbo.model.util_funcs import get_rng, get_types
 from tlbo.acquisition_function.acquisition import EI
-from tlbo.utils.history_container import HistoryContainer
-from tlbo.utils.limit import time_limit, TimeoutException
+from tlbo.utils.history_container import HistoryContainer, EvaluationRegistry
+from tlbo.utils.evaluator import EvaluatorService, evaluate
 from tlbo.utils.logging_utils import setup_logger, get_logger
 from tlbo.model.model_builder import build_model
 from tlbo.optimizer.ei_optimization import InterleavedLocalAndRandomSearch, RandomSearch
 from tlbo.optimizer.random_configuration_chooser import ChooserProb
-from tlbo.config_space.util import convert_configurations_to_array
 from tlbo.utils.constants import MAXINT, SUCCESS, FAILDED, TIMEOUT
+from tlbo.config_space.util import convert_configurations_to_array
 
 
 class BasePipeline(object, metaclass=abc.ABCMeta):
@@ -54,7 +52,12 @@ class SMBO(BasePipeline):
                  initial_configurations=None,
                  initial_runs=3,
                  task_id=None,
-                 rng=None):
+                 rng=None,
+                 model_kwargs=None,
+                 batch_size=1,
+                 batch_strategy='kriging_believer',
+                 n_workers=None,
+                 memory_limit_per_trial=None):
         super().__init__(config_space, task_id, output_dir=logging_dir)
         self.logger = super()._get_logger(self.__class__.__name__)
         if rng is None:
@@ -68,19 +71,35 @@ class SMBO(BasePipeline):
         self.n_sls_iterations = 5
         self.sls_n_steps_plateau_walk = 10
         self.time_limit_per_trial = time_limit_per_trial
+        # The memory limit (in MB) makes the trials run in worker subprocesses, see EvaluatorService.
+        self.memory_limit_per_trial = memory_limit_per_trial
         self.default_obj_value = MAXINT
 
+        # batch_size > 1 proposes a batch per model fit and evaluates it with n_workers processes.
+        if batch_strategy not in ['kriging_believer', 'constant_liar']:
+            raise ValueError('Invalid batch strategy %s!' % batch_strategy)
+        self.batch_size = batch_size
+        self.batch_strategy = batch_strategy
+        self.n_workers = batch_size if n_workers is None else n_workers
+        self._evaluator = None
+
         self.configurations = list()
         self.failed_configurations = list()
         self.perfs = list()
+        self.registry = EvaluationRegistry()
+        # The number of observations the model was last trained on, and the number of fantasies it was updated with.
+        self.n_trained = -1
+        self._n_fantasies = 0
 
         # Initialize the basic component in BO.
         self.config_space.seed(rng.randint(MAXINT))
         self.objective_function = objective_function
 
+        # model_kwargs configures the GP, e.g., reoptimize_every > 1 updates the fit incrementally in between.
         self.model = build_model(model_type=model_type,
                                  config_space=config_space,
-                                 rng=self.rng)
+                                 rng=self.rng,
+                                 **(dict() if model_kwargs is None else model_kwargs))
         self.acquisition_function = EI(self.model)
         self.optimizer = InterleavedLocalAndRandomSearch(
             acquisition_function=self.acquisition_function,
@@ -96,59 +115,150 @@ class SMBO(BasePipeline):
         self.random_configuration_chooser = ChooserProb(prob=0.25, rng=rng)
 
     def run(self):
-        while self.iteration_id < self.max_iterations:
-            self.iterate()
+        try:
+            while self.iteration_id < self.max_iterations:
+                if self.batch_size > 1:
+                    self.iterate_batch()
+                else:
+                    self.iterate()
+        finally:
+            self.close()
+
+    def close(self):
+        """Shut down the evaluation workers."""
+        if self._evaluator is not None:
+            self._evaluator.close()
+            self._evaluator = None
+
+    def _get_evaluator(self):
+        if self._evaluator is None:
+            self._evaluator = EvaluatorService(self.objective_function,
+                                               n_workers=self.n_workers,
+                                               time_limit_per_trial=self.time_limit_per_trial,
+                                               memory_limit=self.memory_limit_per_trial)
+        return self._evaluator
 
     def iterate(self):
-        if len(self.configurations) == 0:
-            X = np.array([])
-        else:
-            X = convert_configurations_to_array(self.configurations)
-        Y = np.array(self.perfs, dtype=np.float64)
+        X = self.history_container.observations.X
+        Y = self.history_container.observations.y
         config = self.choose_next(X, Y)
 
-        trial_state = SUCCESS
-        trial_info = None
-
-        if config not in (self.configurations + self.failed_configurations):
+        if config not in self.registry:
             # Evaluate this configuration.
-            try:
-                with time_limit(self.time_limit_per_trial):
-                    perf = self.objective_function(config)
-            except Exception as e:
-                traceback.print_exc(file=sys.stdout)
-                perf = MAXINT
-                trial_info = str(e)
-                trial_state = FAILDED if not isinstance(e, TimeoutException) else TIMEOUT
-                self.logger.error(trial_info)
-
-            if trial_state == SUCCESS and perf < MAXINT:
-                if len(self.configurations) == 0:
-                    self.default_obj_value = perf
-
-                self.configurations.append(config)
-                self.perfs.append(perf)
-                self.history_container.add(config, perf)
+            if self.memory_limit_per_trial is None:
+                trial_state, perf, trial_info = evaluate(self.objective_function, config, self.time_limit_per_trial)
             else:
-                self.failed_configurations.append(config)
+                trial_state, perf, trial_info = self._get_evaluator().map([config])[0]
+            self._record(config, trial_state, perf, trial_info)
         else:
-            self.logger.debug('This configuration has been evaluated! Skip it.')
-            if config in self.configurations:
-                config_idx = self.configurations.index(config)
-                trial_state, perf = SUCCESS, self.perfs[config_idx]
-            else:
-                trial_state, perf = FAILDED, MAXINT
+            trial_state, perf, trial_info = self._lookup(config)
 
         self.iteration_id += 1
         self.logger.info(
             'Iteration-%d, objective improvement: %.4f' % (self.iteration_id, max(0, self.default_obj_value - perf)))
         return config, trial_state, perf, trial_info
 
-    def choose_next(self, X: np.ndarray, Y: np.ndarray):
+    def iterate_batch(self):
+        """Propose a batch of configurations per model fit and evaluate them in parallel.
+
+        Returns the (config, trial_state, perf, trial_info) tuple of each configuration in the batch.
+        """
+        X = self.history_container.observations.X
+        Y = self.history_container.observations.y
+        batch_size = min(self.batch_size, self.max_iterations - self.iteration_id)
+        configs = self.choose_next_batch(X, Y, batch_size)
+
+        new_configs = list()
+        for config in configs:
+            if config not in self.registry and config not in new_configs:
+                new_configs.append(config)
+        results = self._get_evaluator().map(new_configs)
+
+        # Ingest all results before the next fit.
+        results = dict(zip(new_configs, results))
+        trials = list()
+        for config in configs:
+            if config in results:
+                trial_state, perf, trial_info = results.pop(config)
+                self._record(config, trial_state, perf, trial_info)
+            else:
+                trial_state, perf, trial_info = self._lookup(config)
+
+            self.iteration_id += 1
+            self.logger.info('Iteration-%d, objective improvement: %.4f' % (
+                self.iteration_id, max(0, self.default_obj_value - perf)))
+            trials.append((config, trial_state, perf, trial_info))
+        return trials
+
+    def _record(self, config, trial_state, perf, trial_info):
+        if trial_info is not None:
+            self.logger.error(trial_info)
+        if trial_state == SUCCESS and perf < MAXINT:
+            if len(self.configurations) == 0:
+                self.default_obj_value = perf
+
+            self.registry.add_success(config, len(self.perfs))
+            self.configurations.append(config)
+            self.perfs.append(perf)
+            self.history_container.add(config, perf)
+        else:
+            self.registry.add_failure(config)
+            self.failed_configurations.append(config)
+
+    def _lookup(self, config):
+        self.logger.debug('This configuration has been evaluated! Skip it.')
+        if self.registry.is_evaluated(config):
+            config_idx = self.registry.get_perf_index(config)
+            return SUCCESS, self.perfs[config_idx], None
+        return FAILDED, MAXINT, None
+
+    def _fit_model(self, X: np.ndarray, Y: np.ndarray, n_fantasies=0):
+        """Fit the model on X and Y, whose last n_fantasies rows are fantasized observations.
+
+        The hyperparameters are fit on the real observations only, and the
+        fantasies are added with model.update() if the model supports it.
+        """
+        n_observed = X.shape[0] - n_fantasies
+        can_update = hasattr(self.model, 'update')
+        # Skip refitting when nothing was observed since the last fit.
+        if n_observed != self.n_trained:
+            if n_fantasies == 0 or not can_update:
+                self.model.train(X, Y)
+                self.n_trained, self._n_fantasies = n_observed, n_fantasies
+                return
+            self.model.train(X[:n_observed], Y[:n_observed])
+            self.n_trained, self._n_fantasies = n_observed, 0
+        if n_fantasies > 0 or self._n_fantasies > 0:
+            if can_update:
+                self.model.update(X, Y)
+            else:
+                self.model.train(X, Y)
+            self._n_fantasies = n_fantasies
+
+    def _fantasize(self, X: np.ndarray, Y: np.ndarray, configs, n_fantasies=0):
+        """Append fantasized observations of configs to X and Y, whose last n_fantasies rows are fantasies already.
+
+        A kriging believer takes the mean prediction of the model fit on X and Y, a constant liar the best value in Y.
+        """
+        X_new = convert_configurations_to_array(configs)
+        if self.batch_strategy == 'kriging_believer':
+            self._fit_model(X, Y, n_fantasies=n_fantasies)
+            Y_new, _ = self.model.predict_marginalized_over_instances(X_new)
+            Y_new = Y_new.reshape(-1)
+        else:
+            Y_new = np.full(X_new.shape[0], np.min(Y))
+        return np.vstack([X, X_new]), np.append(Y, Y_new)
+
+    def choose_next(self, X: np.ndarray, Y: np.ndarray, pending=()):
+        """Propose the next configuration.
+
+        pending are the configurations proposed but not evaluated yet; X and Y then end with their fantasized
+        observations (see _fantasize), and the configurations in pending are not proposed again.
+        """
         _config_num = X.shape[0]
         if _config_num < self.init_num:
             default_config = self.config_space.get_default_configuration()
-            if default_config not in (self.configurations + self.failed_configurations):
+            if default_config not in self.registry:
                 return default_config
             else:
                 return self._random_search.maximize(runhistory=self.history_container, num_points=1)[0]
@@ -156,9 +266,11 @@ class SMBO(BasePipeline):
         if self.random_configuration_chooser.check(self.iteration_id):
             return self.config_space.sample_configuration()
         else:
-            self.model.train(X, Y)
+            self._fit_model(X, Y, n_fantasies=len(pending))
 
             incumbent_value = self.history_container.get_incumbents()[0][1]
+            if len(pending) > 0:
+                incumbent_value = min(incumbent_value, np.min(Y))
 
             self.acquisition_function.update(model=self.model, eta=incumbent_value,
                                              num_data=len(self.history_container.data))
@@ -169,4 +281,33 @@ class SMBO(BasePipeline):
                 random_configuration_chooser=self.random_configuration_chooser
             )
 
-            return challengers.challengers[0]
+            # Skip the challengers that have been evaluated or proposed already.
+            config = self.registry.first_unevaluated(
+                challenger for challenger in challengers.challengers if challenger not in pending)
+            if config is None:
+                config = challengers.challengers[0]
+            return config
+
+    def choose_next_batch(self, X: np.ndarray, Y: np.ndarray, batch_size: int):
+        """Propose batch_size configurations for one round of parallel evaluations.
+
+        Each configuration is chosen after fantasizing the observations of the previous ones: a kriging
+        believer takes the mean prediction of the model, a constant liar the best observed value.
+        """
+        batch = list()
+        if X.shape[0] < self.init_num:
+            # The initial design does not use the model, so it fills the whole batch.
+            default_config = self.config_space.get_default_configuration()
+            if default_config not in self.registry:
+                batch.append(default_config)
+            while len(batch) < batch_size:
+                batch.append(self._random_search.maximize(runhistory=self.history_container, num_points=1)[0])
+            return batch
+
+        for _ in range(batch_size):
+            config = self.choose_next(X, Y, pending=batch)
+            batch.append(config)
+            if len(batch) == batch_size:
+                break
+            X, Y = self._fantasize(X, Y, [config], n_fantasies=len(batch) - 1)
+        return batch
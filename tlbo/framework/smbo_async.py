@@ -0,0 +1,64 @@
+from tlbo.framework.smbo import SMBO
+
+
+class SMBO_ASYNC(SMBO):
+    """SMBO that keeps n_workers evaluations running at all times.
+
+    Whenever a worker frees up, its result is recorded and a new configuration
+    is proposed on the observations plus the fantasized outcomes of the pending
+    configurations (see SMBO._fantasize), so the pending ones are not proposed again.
+    """
+    def __init__(self, objective_function, config_space, n_workers=4, **kwargs):
+        super().__init__(objective_function, config_space, n_workers=n_workers, **kwargs)
+        # The configurations under evaluation.
+        self.pending = list()
+
+    def run(self):
+        try:
+            while self.iteration_id < self.max_iterations:
+                self.iterate()
+        finally:
+            self.close()
+
+    def iterate(self):
+        """Fill the free workers, then wait for the next result and record it.
+
+        Returns the (config, trial_state, perf, trial_info) tuple of the finished evaluation.
+        """
+        evaluator = self._get_evaluator()
+        while len(self.pending) < self.n_workers \
+                and self.iteration_id + len(self.pending) < self.max_iterations:
+            config = self.choose_next_async()
+            if config in self.registry:
+                return self._finish(config, *self._lookup(config))
+            self.pending.append(config)
+            evaluator.submit(config)
+
+        config, (trial_state, perf, trial_info) = evaluator.wait()
+        self.pending.remove(config)
+        self._record(config, trial_state, perf, trial_info)
+        return self._finish(config, trial_state, perf, trial_info)
+
+    def _finish(self, config, trial_state, perf, trial_info):
+        self.iteration_id += 1
+        self.logger.info(
+            'Iteration-%d, objective improvement: %.4f' % (self.iteration_id, max(0, self.default_obj_value - perf)))
+        return config, trial_state, perf, trial_info
+
+    def choose_next_async(self):
+        X = self.history_container.observations.X
+        Y = self.history_container.observations.y
+        if X.shape[0] < self.init_num:
+            # Run the initial design until its results are in.
+            default_config = self.config_space.get_default_configuration()
+            if default_config not in self.registry and default_config not in self.pending:
+                return default_config
+            return self._random_search.maximize(runhistory=self.history_container, num_points=1)[0]
+
+        if len(self.pending) > 0:
+            X, Y = self._fantasize(X, Y, self.pending)
+        config = self.choose_next(X, Y, pending=self.pending)
+        if config in self.pending:
+            # A random or fallback proposal hit a pending configuration.
+            config = self.config_space.sample_configuration()
+        return config
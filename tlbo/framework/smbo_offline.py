@@ -9,6 +9,7 @@ from tlbo.optimizer.ei_offline_optimizer import OfflineSearch
 from tlbo.optimizer.random_configuration_chooser import ChooserProb
 from tlbo.config_space.util import convert_configurations_to_array
 from tlbo.utils.constants import MAXINT, SUCCESS, FAILDED
+from tlbo.utils.history_container import EvaluationRegistry
 from tlbo.utils.normalization import zero_mean_unit_var_normalization, zero_one_normalization
 from tlbo.acquisition_function.ta_acquisition import TAQ_EI
 from tlbo.framework.smbo import BasePipeline
@@ -52,6 +53,10 @@ class SMBO_OFFLINE(BasePipeline):
         self.configurations = list()
         self.failed_configurations = list()
         self.perfs = list()
+        # The ids of the configurations are their positions in the configuration list.
+        self.registry = EvaluationRegistry(self.configuration_list)
+        # The number of observations the surrogate was last trained on.
+        self.n_trained = -1
 
         if enable_init_design:
             self.initial_configurations = self.initial_design(initial_runs)
@@ -71,7 +76,8 @@ class SMBO_OFFLINE(BasePipeline):
             self.acquisition_function = EI(self.model)
         elif self.acq_func == 'taf':
             self.acquisition_function = TAQ_EI(self.model.target_surrogate,
-                                               self.model.source_surrogates)
+                                               self.model.source_surrogates,
+                                               rng=np.random.RandomState(self.random_seed))
             self.acquisition_function.update(source_etas=self.model.eta_list)
         else:
             raise ValueError('invalid acquisition function ~ %s.' % self.acq_func)
@@ -79,8 +85,13 @@ class SMBO_OFFLINE(BasePipeline):
         self.acq_optimizer = OfflineSearch(self.configuration_list,
                                            self.acquisition_function,
                                            config_space,
-                                           rng=np.random.RandomState(self.random_seed)
+                                           rng=np.random.RandomState(self.random_seed),
+                                           registry=self.registry
                                            )
+        # The source surrogates are fixed, so predict the whole candidate pool once.
+        self.model.cache_source_predictions(self.acq_optimizer.candidate_array)
+        if self.acq_func == 'taf':
+            self.acquisition_function.cache_source_terms(self.acq_optimizer.candidate_array)
         self.random_configuration_chooser = ChooserProb(
             prob=0.1,
             rng=np.random.RandomState(self.random_seed)
@@ -133,11 +144,8 @@ class SMBO_OFFLINE(BasePipeline):
         return initial_configs
 
     def iterate(self):
-        if len(self.configurations) == 0:
-            X = np.array([])
-        else:
-            X = convert_configurations_to_array(self.configurations)
-        Y = np.array(self.perfs, dtype=np.float64)
+        X = self.history_container.observations.X
+        Y = self.history_container.observations.y
         # start_time = time.time()
         config = self.choose_next(X, Y)
         # print('In %d-th iter, config selection took %.3fs' % (self.iteration_id, time.time() - start_time))
@@ -145,7 +153,7 @@ class SMBO_OFFLINE(BasePipeline):
         trial_state = SUCCESS
         trial_info = None
 
-        if config not in (self.configurations + self.failed_configurations):
+        if config not in self.registry:
             # Evaluate this configuration.
             perf = self.target_hpo_measurements[config]
             if perf == MAXINT:
@@ -157,15 +165,17 @@ class SMBO_OFFLINE(BasePipeline):
                 if len(self.configurations) == 0:
                     self.default_obj_value = perf
 
+                self.registry.add_success(config, len(self.perfs))
                 self.configurations.append(config)
                 self.perfs.append(perf)
                 self.history_container.add(config, perf)
             else:
+                self.registry.add_failure(config)
                 self.failed_configurations.append(config)
         else:
             self.logger.debug('This configuration has been evaluated! Skip it.')
-            if config in self.configurations:
-                config_idx = self.configurations.index(config)
+            if self.registry.is_evaluated(config):
+                config_idx = self.registry.get_perf_index(config)
                 trial_state, perf = SUCCESS, self.perfs[config_idx]
             else:
                 trial_state, perf = FAILDED, MAXINT
@@ -177,13 +187,15 @@ class SMBO_OFFLINE(BasePipeline):
 
     def sample_random_config(self, config_num=1):
         configs = list()
+        sampled_ids = set()
         sample_cnt = 0
         while len(configs) < config_num:
             sample_cnt += 1
             _idx = self.rng.randint(len(self.configuration_list))
             config = self.configuration_list[_idx]
-            if config not in (self.configurations + self.failed_configurations + configs):
+            if not self.registry.is_done(_idx) and _idx not in sampled_ids:
                 configs.append(config)
+                sampled_ids.add(_idx)
                 sample_cnt = 0
             else:
                 sample_cnt += 1
@@ -197,7 +209,7 @@ class SMBO_OFFLINE(BasePipeline):
         if _config_num < self.init_num:
             if self.initial_configurations is None:
                 default_config = self.config_space.get_default_configuration()
-                if default_config not in (self.configurations + self.failed_configurations):
+                if default_config not in self.registry:
                     config = default_config
                 else:
                     config = self.sample_random_config()[0]
@@ -208,15 +220,17 @@ class SMBO_OFFLINE(BasePipeline):
 
         if self.random_configuration_chooser.check(self.iteration_id):
             config = self.sample_random_config()[0]
-            if len(self.model.target_weight) == 0:
-                self.model.target_weight.append(0.)
-            else:
-                self.model.target_weight.append(self.model.target_weight[-1])
+            self.repeat_target_weight()
             return config
         else:
-            start_time = time.time()
-            self.model.train(X, Y)
-            print('Training surrogate model took %.3f' % (time.time() - start_time))
+            if X.shape[0] != self.n_trained:
+                start_time = time.time()
+                self.model.train(X, Y)
+                self.n_trained = X.shape[0]
+                print('Training surrogate model took %.3f' % (time.time() - start_time))
+            else:
+                # Nothing was observed since the last fit.
+                self.repeat_target_weight()
 
             incumbent_value = self.history_container.get_incumbents()[0][1]
             # if self.model.method_id == 'rgpe':
@@ -240,11 +254,17 @@ class SMBO_OFFLINE(BasePipeline):
                 num_points=1
             )
             print('optimizing acq func took', time.time() - start_time)
-            for _config in sorted_configs:
-                if _config not in (self.configurations + self.failed_configurations):
-                    return _config
+            _config = self.registry.first_unevaluated(sorted_configs)
+            if _config is not None:
+                return _config
             raise ValueError('The configuration in the SET (%d) is over' % len(self.configuration_list))
 
+    def repeat_target_weight(self):
+        if len(self.model.target_weight) == 0:
+            self.model.target_weight.append(0.)
+        else:
+            self.model.target_weight.append(self.model.target_weight[-1])
+
     def load_topk_configs(self, src_meta_features, tar_meta_feature, k=5, trial_num=50):
         dataset_array = self.scale_fit_meta_features(src_meta_features)
         tar_dataset_array = self.scale_transform_meta_features(tar_meta_feature)
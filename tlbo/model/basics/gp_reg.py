@@ -1,7 +1,31 @@
 import math
 import numpy as np
+from scipy.linalg import solve_triangular
 from tlbo.model.basics.se_kernel import SEKernel
 
+# The number of kernel entries computed at once in prediction.
+_CHUNK_SIZE = 1 << 22
+
+
+def predict_with_cholesky(kernel, X_train, L, alpha, X):
+    """Predict with the lower Cholesky factor L of the training kernel matrix and alpha = K^-1 y.
+
+    The test points are processed in blocks to bound the memory.
+    """
+    n = X_train.shape[0]
+    step = max(1, _CHUNK_SIZE // max(1, n))
+    res_mean, res_var = list(), list()
+    for start in range(0, X.shape[0], step):
+        X_block = X[start:start + step]
+        # Get the k* vectors of the block.
+        k_star = kernel.get_cross_kernel_matrix(X_block, X_train)
+        res_mean.append(np.dot(k_star, alpha))
+        v = solve_triangular(L, k_star.T, lower=True)
+        res_var.append(kernel.get_kernel_diag(X_block) - np.sum(v * v, axis=0))
+    if len(res_mean) == 0:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate(res_mean), np.concatenate(res_var)
+
 
 class GPR(object):
     def __init__(self, optimize=True):
@@ -16,24 +40,11 @@ class GPR(object):
             self.kernel.optimize_hp(X, y)
         K = self.kernel.get_kernel_matrix(X)
         self.L = np.linalg.cholesky(K)
-        t = np.linalg.solve(self.L, y)
-        self.alpha = np.linalg.solve(self.L.T, t)
+        t = solve_triangular(self.L, y, lower=True)
+        self.alpha = solve_triangular(self.L.T, t, lower=False)
 
     def predict(self, X):
-        res_mean, res_var = [], []
-        for x in X:
-            # Get k* vector.
-            k_star = list()
-            for i in range(self.X.shape[0]):
-                k_star.append(self.kernel.get_kernel_value(x, self.X[i]))
-            k_star = np.array(k_star)
-
-            f_mean = np.dot(k_star, self.alpha)
-            v = np.linalg.solve(self.L, k_star)
-            f_var = self.kernel.get_kernel_value(x, x) - np.dot(v, v)
-            res_mean.append(f_mean)
-            res_var.append(f_var)
-        return np.array(res_mean), np.array(res_var)
+        return predict_with_cholesky(self.kernel, self.X, self.L, self.alpha, X)
 
     def get_negative_log_likelihodd(self):
         log_determinant = 0.
@@ -2,6 +2,7 @@ import math
 import scipy
 import numpy as np
 from scipy import optimize
+from scipy.spatial.distance import cdist
 
 
 class SEKernel(object):
@@ -15,17 +16,9 @@ class SEKernel(object):
         else:
             sigma_f, sigma_l, sigma_y = theta
 
-        n = X.shape[0]
         diff_m = self.get_diff_matrix(X)
-        K = np.zeros((n, n))
-        for i in range(n):
-            for j in range(i, n):
-                if i == j:
-                    K[i][j] = sigma_f*sigma_f + sigma_y*sigma_y
-                else:
-                    value = sigma_f*sigma_f*(math.exp(-0.5*diff_m[i][j]/(sigma_l*sigma_l)))
-                    K[i][j] = value
-                    K[j][i] = value
+        K = sigma_f*sigma_f*np.exp(-0.5*diff_m/(sigma_l*sigma_l))
+        np.fill_diagonal(K, sigma_f*sigma_f + sigma_y*sigma_y)
         return K
 
     def get_kernel_value(self, x1, x2):
@@ -35,6 +28,17 @@ class SEKernel(object):
         else:
             return self.sigma_f*self.sigma_f*(math.exp(-0.5*l2_diff/(self.sigma_l*self.sigma_l)))
 
+    def get_cross_kernel_matrix(self, X1, X2):
+        """Return the matrix of get_kernel_value(X1[i], X2[j])."""
+        l2_diff = cdist(X1, X2)
+        K = self.sigma_f*self.sigma_f*np.exp(-0.5*l2_diff/(self.sigma_l*self.sigma_l))
+        K[l2_diff == 0] = self.sigma_f*self.sigma_f + self.sigma_y*self.sigma_y
+        return K
+
+    def get_kernel_diag(self, X):
+        """Return get_kernel_value(x, x) for the rows of X."""
+        return np.full(X.shape[0], self.sigma_f*self.sigma_f + self.sigma_y*self.sigma_y)
+
     def optimize_hp(self, X, y):
         diff_mat = self.get_diff_matrix(X)
 
@@ -117,10 +121,4 @@ class SEKernel(object):
                 raise ValueError("Could not find a valid hyperparameter configuration! Use initial configuration")
 
     def get_diff_matrix(self, X):
-        n = X.shape[0]
-        diff_matrix = np.zeros((n, n))
-        for i in range(n):
-            for j in range(i+1, n):
-                diff_matrix[i][j] = np.linalg.norm(X[i]-X[j], 2)
-                diff_matrix[j][i] = diff_matrix[i][j]
-        return diff_matrix
+        return cdist(X, X)
@@ -2,22 +2,19 @@ import math
 import scipy
 import numpy as np
 from scipy import optimize
+from scipy.spatial.distance import cdist
 
 
 class SENNKernel(object):
     def __init__(self, metafeatures, ratio, split, max_nearest_neighbor):
-        self.use_gradients = False
+        self.use_gradients = True
         self.sigma_f, self.sigma_l, self.sigma_y = 1, 1, 1e-3
         self.ratio = ratio
         self.max_nn = max_nearest_neighbor
         self.split_flag = split
         self.B = 30
         size = len(metafeatures)
-        dist_m = np.zeros((size, size))
-        for i in range(size):
-            for j in range(i+1, size):
-                dist_m[i][j] = np.linalg.norm(metafeatures[i]-metafeatures[j], 2)
-                dist_m[j][i] = dist_m[i][j]
+        dist_m = cdist(metafeatures, metafeatures)
 
         # Build nearest neighbor lookuptable.
         self.lookup = dict()
@@ -29,13 +26,7 @@ class SENNKernel(object):
                 self.lookup[id].add(str(metafeatures[index]))
 
     def get_kernel_matrix(self, X, theta=None):
-        n = X.shape[0]
-        K = np.zeros((n, n))
-        for i in range(n):
-            for j in range(i, n):
-                K[i][j] = self.get_kernel_value(X[i], X[j], theta=theta)
-                K[j][i] = K[i][j]
-        return K
+        return self.get_cross_kernel_matrix(X, X, theta=theta)
 
     def get_kernel_value(self, x1, x2, theta=None):
         if theta is None:
@@ -65,99 +56,86 @@ class SENNKernel(object):
         assert kernel_value >= 0
         return kernel_value
 
+    def get_cross_kernel_matrix(self, X1, X2, theta=None):
+        """Return the matrix of get_kernel_value(X1[i], X2[j])."""
+        if theta is None:
+            sigma_f, sigma_l, sigma_y = self.sigma_f, self.sigma_l, self.sigma_y
+        else:
+            sigma_f, sigma_l, sigma_y = theta
+        # Squared distances in the hyperparameter and meta-feature blocks.
+        sq_diff_p = cdist(X1[:, :self.split_flag], X2[:, :self.split_flag], 'sqeuclidean')
+        sq_diff_q = cdist(X1[:, self.split_flag:], X2[:, self.split_flag:], 'sqeuclidean')
+
+        k2 = 1 - np.sqrt(sq_diff_p + sq_diff_q) / self.B
+        assert (k2 > 0).all()
+
+        # the SQ kernel works on hyperparaemter space.
+        l2_diff = np.sqrt(sq_diff_p)
+        k1 = sigma_f*sigma_f*np.exp(-0.5*l2_diff/(sigma_l*sigma_l))
+        k1[l2_diff == 0] = sigma_f*sigma_f + sigma_y*sigma_y
+        K = (1-self.ratio)*k1 + self.ratio*k2
+        assert (K >= 0).all()
+        return K
+
+    def get_kernel_diag(self, X, theta=None):
+        """Return get_kernel_value(x, x) for the rows of X."""
+        if theta is None:
+            sigma_f, sigma_y = self.sigma_f, self.sigma_y
+        else:
+            sigma_f, _, sigma_y = theta
+        return np.full(X.shape[0], (1-self.ratio)*(sigma_f*sigma_f + sigma_y*sigma_y) + self.ratio*1.)
+
     def optimize_hp(self, X, y):
-        diff_mat = self.get_diff_matrix(X)
+        # The distances do not depend on the hyperparameters, so compute them once.
+        sq_diff_p = cdist(X[:, :self.split_flag], X[:, :self.split_flag], 'sqeuclidean')
+        sq_diff_q = cdist(X[:, self.split_flag:], X[:, self.split_flag:], 'sqeuclidean')
+        diff_mat = np.sqrt(sq_diff_p)
+        same_mat = (diff_mat == 0).astype(np.float64)
+        k2 = 1 - np.sqrt(sq_diff_p + sq_diff_q) / self.B
+        assert (k2 > 0).all()
+        n = X.shape[0]
 
-        def loglikelihood_f(x):
+        def loglikelihood_f_and_der(x, compute_der=True):
             print('='*5, x)
-            K = self.get_kernel_matrix(X, theta=x)
-            # print(K)
-            # print(np.linalg.eigvalsh(K))
-            # TODO: for debug.
+            exp_term = np.exp(-0.5*diff_mat/(x[1]*x[1]))
+            k1 = x[0]*x[0]*exp_term + x[2]*x[2]*same_mat
+            K = (1-self.ratio)*k1 + self.ratio*k2
             L = scipy.linalg.cholesky(K, lower=True)
-            # L = np.linalg.cholesky(K)
-            t = np.linalg.solve(L, y)
-            alpha = np.linalg.solve(L.T, t)
-
-            log_determinant = 0.
-            n = L.shape[0]
-            for i in range(n):
-                log_determinant += math.log(L[i][i])
-            log_prob = -0.5 * np.dot(y, alpha) - log_determinant - n / 2. * math.log(2 * math.pi)
-
-            # Turn it to minimization problem.
-            return -log_prob
+            t = scipy.linalg.solve_triangular(L, y, lower=True)
+            alpha = scipy.linalg.solve_triangular(L.T, t, lower=False)
 
-        def loglikelihood_f_der(x):
+            log_determinant = np.sum(np.log(np.diag(L)))
+            log_prob = -0.5 * np.dot(y, alpha) - log_determinant - n / 2. * math.log(2 * math.pi)
+            if not compute_der:
+                # Turn it to minimization problem.
+                return -log_prob
+
+            # d log_prob / d theta = 0.5 * trace((alpha * alpha^T - K^-1) * dK / d theta).
+            # Invert K from its Cholesky factor; dpotri only fills the lower triangle.
+            K_inv, _ = scipy.linalg.lapack.dpotri(L, lower=1)
+            K_inv = np.tril(K_inv) + np.tril(K_inv, -1).T
+            fix_term = np.outer(alpha, alpha) - K_inv
             der = np.zeros(len(x))
-            K = self.get_kernel_matrix(X, theta=x)
-            L = np.linalg.cholesky(K)
-            t = np.linalg.solve(L, y)
-            alpha = np.linalg.solve(L.T, t)
-
-            _, l, u = scipy.linalg.lu(K)
-            # fix_term = np.outer(alpha, alpha) - np.linalg.inv(K)
-            fix_term = np.outer(alpha, alpha) - np.dot(np.linalg.inv(u), np.linalg.inv(l))
-            n = K.shape[0]
-
-            # Common part.
-            def compute_der(der_m):
-                trace = 0.
-                for i in range(n):
-                    trace += np.dot(fix_term[i], der_m[:, i])
-                return 0.5*trace
-
-            # Compute the derivative of sigma_y.
-            tmp_m = np.zeros((n, n))
-            for i in range(n):
-                tmp_m[i][i] = 2*x[-1]
-            der[-1] = compute_der(tmp_m)
-
-            # compute the derivative of sigma_l.
-            tmp_m = np.zeros((n, n))
-            exp_term = np.zeros((n, n))
-            for i in range(n):
-                for j in range(i, n):
-                    exp_term[i][j] = math.exp(-0.5*diff_mat[i][j]/(x[1]*x[1]))
-                    exp_term[j][i] = exp_term[i][j]
-            for i in range(n):
-                for j in range(i, n):
-                    tmp_m[i][j] = x[0]*x[0]*exp_term[i][j]*diff_mat[i][j]/(x[1]*x[1]*x[1])
-                    tmp_m[j][i] = tmp_m[i][j]
-            der[1] = compute_der(tmp_m)
-
-            # compute the derivative of sigma_f.
-            tmp_m = np.zeros((n, n))
-            for i in range(n):
-                for j in range(i, n):
-                    tmp_m[i][j] = 2*x[0]*exp_term[i][j]
-                    tmp_m[j][i] = tmp_m[i][j]
-            der[0] = compute_der(tmp_m)
-            return -1*(1-self.ratio)*der
+            # The derivative matrices are symmetric, so the traces are element-wise sums.
+            der[0] = 0.5*np.sum(fix_term*(2*x[0]*exp_term))
+            der[1] = 0.5*np.sum(fix_term*(x[0]*x[0]*exp_term*diff_mat/(x[1]*x[1]*x[1])))
+            der[2] = 0.5*np.sum(fix_term*(2*x[2]*same_mat))
+            return -log_prob, -1*(1-self.ratio)*der
 
         p0 = np.array([1, 1, 1e-3])
-        if self.use_gradients:
-            theta, _, _ = optimize.minimize(loglikelihood_f, p0,
-                                            method="BFGS",
-                                            jac=loglikelihood_f_der)
-            self.sigma_f, self.sigma_l, self.sigma_y = theta
-        else:
-            try:
-                results = optimize.minimize(loglikelihood_f, p0, method='L-BFGS-B')
-                status = True if (results.x < 0).any() else False
-                if not results.success or status:
-                    self.sigma_f, self.sigma_l, self.sigma_y = p0
-                else:
-                    self.sigma_f, self.sigma_l, self.sigma_y = results.x
-            except ValueError:
-                raise ValueError("Could not find a valid hyperparameter configuration! Use initial configuration")
+        try:
+            if self.use_gradients:
+                results = optimize.minimize(loglikelihood_f_and_der, p0, method='L-BFGS-B', jac=True)
+            else:
+                results = optimize.minimize(loglikelihood_f_and_der, p0, args=(False,), method='L-BFGS-B')
+            status = True if (results.x < 0).any() else False
+            if not results.success or status:
+                self.sigma_f, self.sigma_l, self.sigma_y = p0
+            else:
+                self.sigma_f, self.sigma_l, self.sigma_y = results.x
+        except ValueError:
+            raise ValueError("Could not find a valid hyperparameter configuration! Use initial configuration")
 
     def get_diff_matrix(self, X):
         X_ = X[:, :self.split_flag]
-        n = X_.shape[0]
-        diff_matrix = np.zeros((n, n))
-        for i in range(n):
-            for j in range(i+1, n):
-                diff_matrix[i][j] = np.linalg.norm(X_[i]-X_[j], 2)
-                diff_matrix[j][i] = diff_matrix[i][j]
-        return diff_matrix
+        return cdist(X_, X_)
@@ -1,8 +1,10 @@
 import logging
 import typing
+import multiprocessing
 
 import numpy as np
 from scipy import optimize
+from scipy.linalg import cholesky, cho_solve, solve_triangular
 
 from ConfigSpace import ConfigurationSpace
 from tlbo.model.base_gp import BaseModel
@@ -14,6 +16,17 @@ from skopt.learning.gaussian_process import GaussianProcessRegressor
 
 logger = logging.getLogger(__name__)
 
+# Refit exactly when a new point adds less than this fraction of its prior variance,
+# since the extended Cholesky factor would lose precision.
+_UPDATE_TOL = 1e-10
+
+
+def _minimize_nll(task):
+    """Run one restart of the hyperparameter optimization; run in worker processes."""
+    model, start_point, log_bounds = task
+    theta, f_opt, _ = optimize.fmin_l_bfgs_b(model._nll, start_point, bounds=log_bounds)
+    return theta, f_opt
+
 
 class GaussianProcess(BaseModel):
     """
@@ -48,6 +61,17 @@ class GaussianProcess(BaseModel):
         Zero mean unit variance normalization of the output values
     n_opt_restart : int
         Number of restarts for GP hyperparameter optimization
+    n_jobs : int
+        Number of processes that run the restarts in parallel
+    warm_start_restarts : int
+        If set, the number of restarts once the optimum is stable, i.e., the optimization started
+        from the previous optimum was within warm_start_tol of the best restart in the last fit.
+        The previous optimum is always a start point.
+    warm_start_tol : float
+        Tolerance on the negative log likelihood for a stable optimum
+    reoptimize_every : int
+        Optimize the hyperparameters only once every reoptimize_every new observations and
+        refit the GP with the last hyperparameters otherwise
     instance_features : np.ndarray (I, K)
         Contains the K dimensional instance features of the I different instances
     pca_components : float
@@ -64,6 +88,10 @@ class GaussianProcess(BaseModel):
         kernel: Kernel,
         normalize_y: bool = True,
         n_opt_restarts: int = 10,
+        n_jobs: int = 1,
+        warm_start_restarts: typing.Optional[int] = None,
+        warm_start_tol: float = 1e-2,
+        reoptimize_every: int = 1,
         instance_features: typing.Optional[np.ndarray] = None,
         pca_components: typing.Optional[int] = None,
     ):
@@ -79,6 +107,14 @@ class GaussianProcess(BaseModel):
 
         self.normalize_y = normalize_y
         self.n_opt_restarts = n_opt_restarts
+        self.n_jobs = n_jobs
+        self.warm_start_restarts = warm_start_restarts
+        self.warm_start_tol = warm_start_tol
+        self.reoptimize_every = reoptimize_every
+        # Whether the restarts found no better optimum than the previous one in the last fit.
+        self._is_stable = False
+        # The number of observations in the last hyperparameter optimization.
+        self._n_optimized = None
 
         self.hypers = np.empty((0, ))
         self.is_trained = False
@@ -105,6 +141,11 @@ class GaussianProcess(BaseModel):
             the default hyperparameters of the kernel are used.
         """
 
+        if do_optimize and self.reoptimize_every > 1 and self._n_optimized is not None \
+                and X.shape[0] - self._n_optimized < self.reoptimize_every:
+            # Keep the last hyperparameters and extend the fit.
+            return self.update(X, y)
+
         X = self._impute_inactive(X)
         if self.normalize_y:
             y = self._normalize_y(y)
@@ -132,6 +173,7 @@ class GaussianProcess(BaseModel):
         if do_optimize:
             self._all_priors = self._get_all_priors(add_bound_priors=False)
             self.hypers = self._optimize()
+            self._n_optimized = X.shape[0]
             self.gp.kernel.theta = self.hypers
             self.gp.fit(X, y)
         else:
@@ -140,6 +182,69 @@ class GaussianProcess(BaseModel):
         self.is_trained = True
         return self
 
+    def update(self, X: np.ndarray, y: np.ndarray) -> 'GaussianProcess':
+        """
+        Refits the GP on X and y with the current hyperparameters.
+
+        If X extends the training data, the Cholesky factor, alpha and the
+        inverse kernel matrix are extended in O(N^2) per new point. Otherwise,
+        or if the extension is numerically unstable, the GP is refit exactly.
+
+        Parameters
+        ----------
+        X: np.ndarray (N, D)
+            Input data points, starting with the current training data.
+        y: np.ndarray (N,)
+            The corresponding target values.
+        """
+        if self.n_feats > 0:
+            raise ValueError('Updating the GP with instance features is not supported!')
+        if not self._extend_fit(X, y):
+            self._train(X, y, do_optimize=False)
+        return self
+
+    def _extend_fit(self, X: np.ndarray, y: np.ndarray) -> bool:
+        y = y.flatten() if len(y.shape) == 1 or y.shape[1] == 1 else None
+        if not self.is_trained or self.n_objectives_ != 1 or y is None:
+            return False
+        gp = self.gp
+        n = gp.X_train_.shape[0]
+        X = self._impute_inactive(X)
+        if X.shape[0] < n or not np.array_equal(X[:n], gp.X_train_):
+            return False
+
+        X_new = X[n:]
+        if X_new.shape[0] > 0:
+            # K = [[K_old, B], [B^T, C]] and L = [[L_old, 0], [L_21, L_22]].
+            B = gp.kernel_(gp.X_train_, X_new)
+            C = gp.kernel_(X_new)
+            C[np.diag_indices_from(C)] += gp.alpha
+            L_21 = solve_triangular(gp.L_, B, lower=True).T
+            try:
+                L_22 = cholesky(C - np.dot(L_21, L_21.T), lower=True)
+            except np.linalg.LinAlgError:
+                return False
+            if np.min(np.square(np.diag(L_22)) / np.diag(C)) < _UPDATE_TOL:
+                return False
+
+            # Block inverse with the Schur complement S = L_22 * L_22^T.
+            S_inv = cho_solve((L_22, True), np.eye(X_new.shape[0]))
+            K_inv_B = np.dot(gp.K_inv_, B)
+            K_inv_B_S_inv = np.dot(K_inv_B, S_inv)
+            gp.K_inv_ = np.block([[gp.K_inv_ + np.dot(K_inv_B_S_inv, K_inv_B.T), -K_inv_B_S_inv],
+                                  [-K_inv_B_S_inv.T, S_inv]])
+            gp.L_ = np.block([[gp.L_, np.zeros((n, X_new.shape[0]))], [L_21, L_22]])
+            gp.X_train_ = X
+
+        # The normalization changes with every new target value, so alpha is solved again.
+        if self.normalize_y:
+            y = self._normalize_y(y)
+        gp.y_train_ = y
+        gp.alpha_ = cho_solve((gp.L_, True), y)
+        gp.log_marginal_likelihood_value_ = -0.5 * np.dot(y, gp.alpha_) - np.sum(np.log(np.diag(gp.L_))) \
+            - 0.5 * y.shape[0] * np.log(2 * np.pi)
+        return True
+
     def _get_gp(self) -> GaussianProcessRegressor:
         return GaussianProcessRegressor(
             kernel=self.kernel,
@@ -201,7 +306,10 @@ class GaussianProcess(BaseModel):
 
         # Start optimization from the previous hyperparameter configuration
         p0 = [self.gp.kernel.theta]
-        if self.n_opt_restarts > 0:
+        n_opt_restarts = self.n_opt_restarts
+        if self.warm_start_restarts is not None and self._is_stable:
+            n_opt_restarts = min(n_opt_restarts, self.warm_start_restarts)
+        if n_opt_restarts > 0:
             dim_samples = []
 
             prior = None  # type: typing.Optional[typing.Union[typing.List[Prior], Prior]]
@@ -219,22 +327,34 @@ class GaussianProcess(BaseModel):
                         sample = self.rng.uniform(
                             low=hp_bound[0],
                             high=hp_bound[1],
-                            size=(self.n_opt_restarts,),
+                            size=(n_opt_restarts,),
                         )
                     except OverflowError:
                         raise ValueError('OverflowError while sampling from (%f, %f)' % (hp_bound[0], hp_bound[1]))
                     dim_samples.append(sample.flatten())
                 else:
-                    dim_samples.append(prior.sample_from_prior(self.n_opt_restarts).flatten())
+                    dim_samples.append(prior.sample_from_prior(n_opt_restarts).flatten())
             p0 += list(np.vstack(dim_samples).transpose())
 
+        if self.n_jobs > 1 and len(p0) > 1:
+            # L-BFGS-B in scipy is not thread-safe, so the restarts run in processes.
+            pool = multiprocessing.Pool(min(self.n_jobs, len(p0)))
+            try:
+                results = pool.map(_minimize_nll, [(self, start_point, log_bounds) for start_point in p0])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_minimize_nll((self, start_point, log_bounds)) for start_point in p0]
+
+        # Keep the first of the best optima, as in a serial run.
         theta_star = None
         f_opt_star = np.inf
-        for i, start_point in enumerate(p0):
-            theta, f_opt, _ = optimize.fmin_l_bfgs_b(self._nll, start_point, bounds=log_bounds)
+        for theta, f_opt in results:
             if f_opt < f_opt_star:
                 f_opt_star = f_opt
                 theta_star = theta
+        self._is_stable = results[0][1] - f_opt_star <= self.warm_start_tol
         return theta_star
 
     def _predict(self, X_test: np.ndarray,
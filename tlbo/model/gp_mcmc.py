@@ -2,20 +2,67 @@ from copy import deepcopy
 import logging
 import typing
 import warnings
+import multiprocessing
 
 import emcee
 import numpy as np
+from scipy.linalg import cho_solve, solve_triangular
 
 from ConfigSpace import ConfigurationSpace
 from tlbo.model.base_gp import BaseModel
-from tlbo.model.gp import GaussianProcess
 from tlbo.model.gp_base_prior import Prior
+from tlbo.utils.constants import VERY_SMALL_NUMBER
 
 from skopt.learning.gaussian_process.kernels import Kernel
 from skopt.learning.gaussian_process import GaussianProcessRegressor
 
 logger = logging.getLogger(__name__)
 
+# The model whose likelihood is evaluated in a worker process of the likelihood pool.
+_worker_model = None
+
+
+def _init_ll_worker(model):
+    global _worker_model
+    _worker_model = model
+
+
+def _ll_in_worker(thetas):
+    return _worker_model._ll_batch(thetas)
+
+
+def _cholesky_batch(K: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """Factorizes a stack of kernel matrices and returns the lower factors and which of them succeeded."""
+    try:
+        return np.linalg.cholesky(K), np.ones(K.shape[0], dtype=bool)
+    except np.linalg.LinAlgError:
+        # Factorize one by one to find the matrices that are not positive definite.
+        L = np.zeros_like(K)
+        success = np.zeros(K.shape[0], dtype=bool)
+        for i in range(K.shape[0]):
+            try:
+                L[i] = np.linalg.cholesky(K[i])
+                success[i] = True
+            except np.linalg.LinAlgError:
+                pass
+        return L, success
+
+
+def _split_rhat(chain: np.ndarray) -> np.ndarray:
+    """
+    Returns the split potential scale reduction factor of each dimension of a chain (n_steps, n_walkers, n_dims).
+
+    The walkers of an ensemble sampler are not independent chains, so the ensemble
+    in the first half of the chain is compared with the one in the second half.
+    """
+    n = chain.shape[0] // 2
+    halves = np.stack([chain[:n].reshape((-1, chain.shape[2])), chain[-n:].reshape((-1, chain.shape[2]))])
+    m = halves.shape[1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        within = halves.var(axis=1, ddof=1).mean(axis=0)
+        between = halves.mean(axis=1).var(axis=0, ddof=1)
+        return np.sqrt(((m - 1) / m * within + between) / within)
+
 
 class GaussianProcessMCMC(BaseModel):
 
@@ -32,6 +79,9 @@ class GaussianProcessMCMC(BaseModel):
         normalize_y: bool = True,
         mcmc_sampler: str = 'emcee',
         average_samples: bool = False,
+        max_rhat: typing.Optional[float] = None,
+        min_chain_length: int = 50,
+        n_jobs: int = 1,
         instance_features: typing.Optional[np.ndarray] = None,
         pca_components: typing.Optional[int] = None,
     ):
@@ -70,12 +120,22 @@ class GaussianProcessMCMC(BaseModel):
             The length of the MCMC chain. We start n_mcmc_walkers walker for
             chain_length steps and we use the last sample
             in the chain as a hyperparameter sample.
+            If max_rhat is set, this is the maximal length of the chain.
         burnin_steps : int
             The number of burnin steps before the actual MCMC sampling starts.
         normalize_y : bool
             Zero mean unit variance normalization of the output values
         mcmc_sampler : str
             Choose a self-tuning MCMC sampler. Can be either ``emcee`` or ``nuts``.
+        max_rhat : float
+            If set, the emcee chain is extended in steps of min_chain_length until the
+            split R-hat of all hyperparameters is below max_rhat, e.g., 1.05, instead of
+            running for chain_length steps. As the walkers start from the last samples,
+            this stops early unless the new data shifts the posterior.
+        min_chain_length : int
+            The minimal length of an adaptive chain and the number of steps between two convergence checks
+        n_jobs : int
+            Number of processes that evaluate the likelihood of the walkers in parallel
         instance_features : np.ndarray (I, K)
             Contains the K dimensional instance features
             of the I different instances
@@ -98,10 +158,17 @@ class GaussianProcessMCMC(BaseModel):
         self.chain_length = chain_length
         self.burned = False
         self.burnin_steps = burnin_steps
-        self.models = []  # type: typing.List[GaussianProcess]
+        # The kernels, Cholesky factors and alphas of the GPs for the hyperparameter samples.
+        self._kernels = []  # type: typing.List[Kernel]
+        self._L = np.empty((0, 0, 0))
+        self._alpha = np.empty((0, 0))
         self.normalize_y = normalize_y
         self.mcmc_sampler = mcmc_sampler
         self.average_samples = average_samples
+        self.max_rhat = max_rhat
+        self.min_chain_length = min_chain_length
+        self.n_jobs = n_jobs
+        self._pool = None
 
         self.is_trained = False
 
@@ -132,8 +199,7 @@ class GaussianProcessMCMC(BaseModel):
             # Scikit-learn uses a different "normalization" than we use in SMAC3. Scikit-learn normalizes the data to
             # have zero mean, while we normalize it to have zero mean unit variance. To make sure the scikit-learn GP
             # behaves the same when we use it directly or indirectly (through the gaussian_process.py file), we
-            # normalize the data here. Then, after the individual GPs are fit, we inject the statistics into them so
-            # they unnormalize the data at prediction time.
+            # normalize the data here. The predictions of the individual GPs are unnormalized in _predict.
             y = self._normalize_y(y)
 
         self.gp = self._get_gp()
@@ -148,40 +214,51 @@ class GaussianProcessMCMC(BaseModel):
             if self.mcmc_sampler == 'emcee':
                 sampler = emcee.EnsembleSampler(self.n_mcmc_walkers,
                                                 len(self.kernel.theta),
-                                                self._ll)
+                                                self._log_prob,
+                                                vectorize=True)
                 sampler.random_state = self.rng.get_state()
-                # Do a burn-in in the first iteration
-                if not self.burned:
-                    # Initialize the walkers by sampling from the prior
-                    dim_samples = []
-
-                    prior = None  # type: typing.Optional[typing.Union[typing.List[Prior], Prior]]
-                    for dim, prior in enumerate(self._all_priors):
-                        # Always sample from the first prior
-                        if isinstance(prior, list):
-                            if len(prior) == 0:
-                                prior = None
+                if self.n_jobs > 1:
+                    self._pool = multiprocessing.Pool(self.n_jobs, initializer=_init_ll_worker, initargs=(self,))
+                try:
+                    # Do a burn-in in the first iteration
+                    if not self.burned:
+                        # Initialize the walkers by sampling from the prior
+                        dim_samples = []
+
+                        prior = None  # type: typing.Optional[typing.Union[typing.List[Prior], Prior]]
+                        for dim, prior in enumerate(self._all_priors):
+                            # Always sample from the first prior
+                            if isinstance(prior, list):
+                                if len(prior) == 0:
+                                    prior = None
+                                else:
+                                    prior = prior[0]
+                            prior = typing.cast(typing.Optional[Prior], prior)
+                            if prior is None:
+                                raise NotImplementedError()
                             else:
-                                prior = prior[0]
-                        prior = typing.cast(typing.Optional[Prior], prior)
-                        if prior is None:
-                            raise NotImplementedError()
-                        else:
-                            dim_samples.append(prior.sample_from_prior(self.n_mcmc_walkers).flatten())
-                    self.p0 = np.vstack(dim_samples).transpose()
-
-                    # Run MCMC sampling
-                    with warnings.catch_warnings():
-                        warnings.filterwarnings('ignore', r'invalid value encountered in double_scalars.*')
-                        self.p0, _, _ = sampler.run_mcmc(self.p0,
-                                                         self.burnin_steps)
+                                dim_samples.append(prior.sample_from_prior(self.n_mcmc_walkers).flatten())
+                        self.p0 = np.vstack(dim_samples).transpose()
 
-                    self.burned = True
+                        # Run MCMC sampling
+                        with warnings.catch_warnings():
+                            warnings.filterwarnings('ignore', r'invalid value encountered in double_scalars.*')
+                            self.p0, _, _ = sampler.run_mcmc(self.p0,
+                                                             self.burnin_steps)
 
-                # Start sampling & save the current position, it will be the start point in the next iteration
-                with warnings.catch_warnings():
-                    warnings.filterwarnings('ignore', r'invalid value encountered in double_scalars.*')
-                    self.p0, _, _ = sampler.run_mcmc(self.p0, self.chain_length)
+                        self.burned = True
+
+                    # Start sampling & save the current position, it will be the start point in the next iteration
+                    with warnings.catch_warnings():
+                        warnings.filterwarnings('ignore', r'invalid value encountered in double_scalars.*')
+                        self.p0 = self._run_chain(sampler, self.p0)
+                finally:
+                    if self._pool is not None:
+                        self._pool.close()
+                        self._pool.join()
+                        self._pool = None
+                # Continue with the random state of the sampler in the next iteration.
+                self.rng.set_state(sampler.random_state)
 
                 # Take the last samples from each walker
                 self.hypers = sampler.get_chain()[-1]
@@ -228,54 +305,35 @@ class GaussianProcessMCMC(BaseModel):
             self.hypers = self.gp.kernel.theta
             self.hypers = [self.hypers]
 
-        self.models = []
-        for sample in self.hypers:
-
-            if (sample < -50).any():
-                sample[sample < -50] = -50
-            if (sample > 50).any():
-                sample[sample > 50] = 50
+        self._fit_samples(X, y, np.clip(self.hypers, -50, 50))
+        if self._L.shape[0] == 0:
+            # Fall back to the current hyperparameters of the kernel.
+            self._fit_samples(X, y, self.gp.kernel.theta[np.newaxis])
+            if self._L.shape[0] == 0:
+                raise np.linalg.LinAlgError('The kernel matrix is not positive definite.')
 
-            # Instantiate a GP for each hyperparameter configuration
-            kernel = deepcopy(self.kernel)
-            kernel.theta = sample
-            model = GaussianProcess(
-                configspace=self.configspace,
-                types=self.types,
-                bounds=self.bounds,
-                kernel=kernel,
-                normalize_y=False,
-                seed=self.rng.randint(low=0, high=10000),
-            )
-            try:
-                model._train(X, y, do_optimize=False)
-                self.models.append(model)
-            except np.linalg.LinAlgError:
-                pass
+        self.is_trained = True
+        return self
 
-        if len(self.models) == 0:
-            kernel = deepcopy(self.kernel)
-            kernel.theta = self.p0
-            model = GaussianProcess(
-                configspace=self.configspace,
-                types=self.types,
-                bounds=self.bounds,
-                kernel=kernel,
-                normalize_y=False,
-                seed=self.rng.randint(low=0, high=10000),
-            )
-            model._train(X, y, do_optimize=False)
-            self.models.append(model)
+    def update(self, X: np.ndarray, y: np.ndarray) -> 'GaussianProcessMCMC':
+        """
+        Refits the GPs of the current hyperparameter samples on X and y without sampling again.
 
+        Parameters
+        ----------
+        X: np.ndarray (N, D)
+            Input data points.
+        y: np.ndarray (N,)
+            The corresponding target values.
+        """
+        if not self.is_trained:
+            return self.train(X, y)
+        X = self._impute_inactive(X)
         if self.normalize_y:
-            # Inject the normalization statistics into the individual models. Setting normalize_y to True makes the
-            # individual GPs unnormalize the data at predict time.
-            for model in self.models:
-                model.normalize_y = True
-                model.mean_y_ = self.mean_y_
-                model.std_y_ = self.std_y_
-
-        self.is_trained = True
+            y = self._normalize_y(y)
+        self._fit_samples(X, y, self.hypers)
+        if self._L.shape[0] == 0:
+            raise np.linalg.LinAlgError('The kernel matrix is not positive definite.')
         return self
 
     def _get_gp(self) -> GaussianProcessRegressor:
@@ -288,45 +346,94 @@ class GaussianProcessMCMC(BaseModel):
             noise=None,
         )
 
-    def _ll(self, theta: np.ndarray) -> float:
+    def _run_chain(self, sampler: emcee.EnsembleSampler, p0: np.ndarray) -> np.ndarray:
+        """
+        Runs the chain from p0 and returns the last position of the walkers.
+
+        The chain runs for chain_length steps, or, if max_rhat is set, until
+        the walkers have converged or chain_length steps are reached.
+        """
+        if self.max_rhat is None:
+            p0, _, _ = sampler.run_mcmc(p0, self.chain_length)
+            return p0
+
+        start = sampler.iteration
+        n_steps = min(self.min_chain_length, self.chain_length)
+        p0, _, _ = sampler.run_mcmc(p0, n_steps)
+        while n_steps < self.chain_length:
+            rhat = _split_rhat(sampler.get_chain(discard=start))
+            if np.all(rhat < self.max_rhat):
+                break
+            steps = min(self.min_chain_length, self.chain_length - n_steps)
+            p0, _, _ = sampler.run_mcmc(None, steps)
+            n_steps += steps
+        logger.debug('Ran the MCMC chain for %d steps.' % n_steps)
+        return p0
+
+    def _fit_samples(self, X: np.ndarray, y: np.ndarray, samples: np.ndarray) -> None:
+        """Factorizes the kernel matrices of all hyperparameter samples at once, dropping the singular ones."""
+        kernels = []
+        for sample in samples:
+            # Instantiate a kernel for each hyperparameter configuration
+            kernel = deepcopy(self.kernel)
+            kernel.theta = sample
+            kernels.append(kernel)
+        L, success = _cholesky_batch(np.array([kernel(X) for kernel in kernels]))
+
+        self._kernels = [kernel for kernel, ok in zip(kernels, success) if ok]
+        self._L = L[success]
+        self._alpha = np.array([cho_solve((L_, True), y) for L_ in self._L]).reshape((len(self._kernels), -1))
+        self._X_train = X
+        self.hypers = np.array(samples)[success]
+
+    def _log_prob(self, thetas: np.ndarray) -> np.ndarray:
+        """Returns the log posterior of the walkers thetas, evaluated in the likelihood pool if there is one."""
+        self._n_ll_evals += thetas.shape[0]
+        if self._pool is None:
+            return self._ll_batch(thetas)
+        chunks = np.array_split(thetas, min(self.n_jobs, thetas.shape[0]))
+        return np.concatenate(self._pool.map(_ll_in_worker, chunks))
+
+    def _ll_batch(self, thetas: np.ndarray) -> np.ndarray:
         """
         Returns the marginal log likelihood (+ the prior) for
-        a hyperparameter configuration theta.
+        a batch of hyperparameter configurations.
 
         Parameters
         ----------
-        theta : np.ndarray(H)
-            Hyperparameter vector. Note that all hyperparameter are
+        thetas : np.ndarray(B, H)
+            Hyperparameter vectors. Note that all hyperparameter are
             on a log scale.
 
         Returns
         ----------
-        float
+        np.ndarray(B,)
             lnlikelihood + prior
         """
-        self._n_ll_evals += 1
-
         # Bound the hyperparameter space to keep things sane. Note all
         # hyperparameters live on a log scale
-        if (theta < -50).any():
-            theta[theta < -50] = -50
-        if (theta > 50).any():
-            theta[theta > 50] = 50
+        thetas = np.clip(thetas, -50, 50)
 
-        try:
-            lml = self.gp.log_marginal_likelihood(theta)
-        except ValueError:
-            return -np.inf
-
-        # Add prior
+        lnprob = np.zeros(thetas.shape[0])
         for dim, priors in enumerate(self._all_priors):
             for prior in priors:
-                lml += prior.lnprob(theta[dim])
-
-        if not np.isfinite(lml):
-            return -np.inf
-        else:
-            return lml
+                lnprob += [prior.lnprob(theta[dim]) for theta in thetas]
+
+        # The likelihood is only computed where the prior is positive.
+        idx = np.nonzero(np.isfinite(lnprob))[0]
+        if len(idx) > 0:
+            X, y = self.gp.X_train_, self.gp.y_train_
+            K = np.array([self.gp.kernel_.clone_with_theta(thetas[i])(X) for i in idx])
+            L, success = _cholesky_batch(K)
+            for i, L_, ok in zip(idx, L, success):
+                if not ok:
+                    lnprob[i] = -np.inf
+                    continue
+                v = solve_triangular(L_, y, lower=True)
+                lnprob[i] += -0.5 * np.sum(v * v) - np.sum(np.log(np.diag(L_))) - 0.5 * y.shape[0] * np.log(2 * np.pi)
+
+        lnprob[~np.isfinite(lnprob)] = -np.inf
+        return lnprob
 
     def _ll_w_grad(self, theta: np.ndarray) -> typing.Tuple[float, np.ndarray]:
         """
@@ -412,13 +519,17 @@ class GaussianProcessMCMC(BaseModel):
 
         X_test = self._impute_inactive(X_test)
 
-        mu = np.zeros([len(self.models), X_test.shape[0]])
-        var = np.zeros([len(self.models), X_test.shape[0]])
-        for i, model in enumerate(self.models):
-            mu_tmp, var_tmp = model.predict(X_test)
-            assert var_tmp is not None  # please mypy
-            mu[i] = mu_tmp.flatten()
-            var[i] = var_tmp.flatten()
+        mu = np.zeros([len(self._kernels), X_test.shape[0]])
+        var = np.zeros([len(self._kernels), X_test.shape[0]])
+        for i, kernel in enumerate(self._kernels):
+            K_trans = kernel(X_test, self._X_train)
+            mu[i] = K_trans.dot(self._alpha[i])
+            v = solve_triangular(self._L[i], K_trans.T, lower=True)
+            var[i] = kernel.diag(X_test) - np.einsum('ij,ij->j', v, v)
+        # Clip negative variances as the individual GPs do.
+        var = np.clip(var, VERY_SMALL_NUMBER, np.inf)
+        if self.normalize_y:
+            mu, var = self._untransform_y(mu, var)
 
         m = mu.mean(axis=0)
 
@@ -2,8 +2,10 @@ import math
 import scipy
 import logging
 import numpy as np
+from scipy.linalg import solve_triangular
 
 from tlbo.model.basics.se_nn_kernel import SENNKernel
+from tlbo.model.basics.gp_reg import predict_with_cholesky
 from tlbo.model.base_model import BaseModel
 logger = logging.getLogger(__name__)
 
@@ -23,25 +25,13 @@ class MKLGaussianProcess(BaseModel):
         self.L = scipy.linalg.cholesky(K, lower=True)
         print('Cholesky Decomposition finished')
         # self.L = np.linalg.cholesky(K)
-        t = np.linalg.solve(self.L, y)
-        self.alpha = np.linalg.solve(self.L.T, t)
+        t = solve_triangular(self.L, y, lower=True)
+        self.alpha = solve_triangular(self.L.T, t, lower=False)
 
     def predict(self, X):
         print(X.shape, self.X.shape)
-        res_mean, res_var = [], []
-        for x in X:
-            # Get k* vector.
-            k_star = list()
-            for i in range(self.X.shape[0]):
-                k_star.append(self.kernel.get_kernel_value(x, self.X[i]))
-            k_star = np.array(k_star)
-
-            f_mean = np.dot(k_star, self.alpha)
-            v = np.linalg.solve(self.L, k_star)
-            f_var = self.kernel.get_kernel_value(x, x) - np.dot(v, v)
-            res_mean.append(f_mean)
-            res_var.append(f_var)
-        return np.array(res_mean).reshape(-1, 1), np.array(res_var).reshape(-1, 1)
+        res_mean, res_var = predict_with_cholesky(self.kernel, self.X, self.L, self.alpha, X)
+        return res_mean.reshape(-1, 1), res_var.reshape(-1, 1)
 
     def get_negative_log_likelihodd(self):
         log_determinant = 0.
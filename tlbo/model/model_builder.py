@@ -8,7 +8,7 @@ from tlbo.model.gp_base_prior import HorseshoePrior, LognormalPrior
 from tlbo.model.gp_kernels import ConstantKernel, Matern, HammingKernel, WhiteKernel
 
 
-def build_model(model_type, config_space, rng):
+def build_model(model_type, config_space, rng, **gp_kwargs):
     types, bounds = get_types(config_space)
     if model_type == 'rf':
         model = RandomForestWithInstances(configspace=config_space,
@@ -19,16 +19,21 @@ def build_model(model_type, config_space, rng):
                                 config_space=config_space,
                                 types=types,
                                 bounds=bounds,
-                                rng=rng)
+                                rng=rng,
+                                **gp_kwargs)
     else:
         raise ValueError("Invalid model str %s!" % model_type)
 
     return model
 
 
-def create_gp_model(model_type, config_space, types, bounds, rng):
+def create_gp_model(model_type, config_space, types, bounds, rng, n_opt_restarts=10, n_jobs=1,
+                    warm_start_restarts=None, reoptimize_every=1, max_rhat=None):
     """
         Construct the Gaussian process model that is capable of dealing with categorical hyperparameters.
+
+        The remaining arguments configure the hyperparameter optimization of 'gp', see GaussianProcess,
+        and the sampling of 'gp_mcmc' (n_jobs and max_rhat), see GaussianProcessMCMC.
     """
     if rng is None:
         _, rng = get_rng(rng)
@@ -89,6 +94,8 @@ def create_gp_model(model_type, config_space, types, bounds, rng):
             chain_length=250,
             burnin_steps=250,
             normalize_y=True,
+            max_rhat=max_rhat,
+            n_jobs=n_jobs,
             seed=rng.randint(low=0, high=10000),
         )
     elif model_type == 'gp':
@@ -99,6 +106,10 @@ def create_gp_model(model_type, config_space, types, bounds, rng):
             kernel=kernel,
             normalize_y=True,
             seed=rng.randint(low=0, high=10000),
+            n_opt_restarts=n_opt_restarts,
+            n_jobs=n_jobs,
+            warm_start_restarts=warm_start_restarts,
+            reoptimize_every=reoptimize_every,
         )
     else:
         raise ValueError("Invalid model str %s!" % model_type)
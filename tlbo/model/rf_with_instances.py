@@ -1,4 +1,6 @@
+import json
 import typing
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from pyrfr import regression
@@ -47,6 +49,9 @@ class RandomForestWithInstances(BaseModel):
         max_num_nodes: int = 2**20,
         instance_features: typing.Optional[np.ndarray] = None,
         pca_components: typing.Optional[int] = None,
+        n_jobs: int = 1,
+        chunk_size: int = 4096,
+        min_batch_size: int = 1000,
     ) -> None:
         """
         Parameters
@@ -89,6 +94,14 @@ class RandomForestWithInstances(BaseModel):
         pca_components : float
             Number of components to keep when using PCA to reduce dimensionality of instance features. Requires to
             set n_feats (> pca_dims).
+        n_jobs : int
+            The number of threads that predict chunks of rows in parallel.
+        chunk_size : int
+            The number of rows the batched prediction processes at once.
+        min_batch_size : int
+            Exporting the forest for batched prediction costs about as much as
+            predicting this many rows with pyrfr; smaller inputs use pyrfr
+            unless the forest is already exported.
         """
         super().__init__(
             configspace=configspace,
@@ -102,26 +115,67 @@ class RandomForestWithInstances(BaseModel):
         self.log_y = log_y
         self.rng = regression.default_random_engine(seed)
 
-        self.rf_opts = regression.forest_opts()
-        self.rf_opts.num_trees = num_trees
-        self.rf_opts.do_bootstrapping = do_bootstrapping
-        max_features = 0 if ratio_features > 1.0 else \
-            max(1, int(len(types) * ratio_features))
-        self.rf_opts.tree_opts.max_features = max_features
-        self.rf_opts.tree_opts.min_samples_to_split = min_samples_split
-        self.rf_opts.tree_opts.min_samples_in_leaf = min_samples_leaf
-        self.rf_opts.tree_opts.max_depth = max_depth
-        self.rf_opts.tree_opts.epsilon_purity = eps_purity
-        self.rf_opts.tree_opts.max_num_nodes = max_num_nodes
-        self.rf_opts.compute_law_of_total_variance = False
-
         self.n_points_per_tree = n_points_per_tree
         self.rf = None  # type: regression.binary_rss_forest
+        # The trained forest exported into flat arrays; built lazily by _get_flat_forest().
+        self.flat_forest = None  # type: typing.Optional[typing.Dict[str, np.ndarray]]
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.min_batch_size = min_batch_size
+        # The data container of the last fit and the rows it holds; a refit on
+        # the same rows plus appended ones only adds the new rows.
+        self.data_container = None  # type: typing.Optional[regression.default_data_container]
+        self.container_X = None  # type: typing.Optional[np.ndarray]
+        self.container_y = None  # type: typing.Optional[np.ndarray]
 
         # This list well be read out by save_iteration() in the solver
         self.hypers = [num_trees, max_num_nodes, do_bootstrapping,
                        n_points_per_tree, ratio_features, min_samples_split,
                        min_samples_leaf, max_depth, eps_purity, self.seed]
+        self.rf_opts = self._get_rf_opts()
+
+    def _get_rf_opts(self) -> regression.forest_opts:
+        num_trees, max_num_nodes, do_bootstrapping, _, ratio_features, min_samples_split, \
+            min_samples_leaf, max_depth, eps_purity, _ = self.hypers
+
+        rf_opts = regression.forest_opts()
+        rf_opts.num_trees = num_trees
+        rf_opts.do_bootstrapping = do_bootstrapping
+        max_features = 0 if ratio_features > 1.0 else \
+            max(1, int(len(self.types) * ratio_features))
+        rf_opts.tree_opts.max_features = max_features
+        rf_opts.tree_opts.min_samples_to_split = min_samples_split
+        rf_opts.tree_opts.min_samples_in_leaf = min_samples_leaf
+        rf_opts.tree_opts.max_depth = max_depth
+        rf_opts.tree_opts.epsilon_purity = eps_purity
+        rf_opts.tree_opts.max_num_nodes = max_num_nodes
+        rf_opts.compute_law_of_total_variance = False
+        return rf_opts
+
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        # The pyrfr objects are SWIG proxies and cannot be pickled, so the
+        # forest is stored as its ascii representation.
+        state = self.__dict__.copy()
+        del state['rng']
+        del state['rf_opts']
+        state['flat_forest'] = None
+        state['data_container'], state['container_X'], state['container_y'] = None, None, None
+        state['num_data_points_per_tree'] = self.rf_opts.num_data_points_per_tree
+        state['rf'] = None if self.rf is None else self.rf.ascii_string_representation()
+        return state
+
+    def __setstate__(self, state: typing.Dict[str, typing.Any]) -> None:
+        num_data_points_per_tree = state.pop('num_data_points_per_tree')
+        rf_str = state.pop('rf')
+        self.__dict__.update(state)
+        self.rng = regression.default_random_engine(self.seed)
+        self.rf_opts = self._get_rf_opts()
+        self.rf_opts.num_data_points_per_tree = num_data_points_per_tree
+        self.rf = None
+        if rf_str is not None:
+            self.rf = regression.binary_rss_forest()
+            self.rf.options = self.rf_opts
+            self.rf.load_from_ascii_string(rf_str)
 
     def _train(self, X: np.ndarray, y: np.ndarray) -> 'RandomForestWithInstances':
         """Trains the random forest on X and y.
@@ -149,12 +203,16 @@ class RandomForestWithInstances(BaseModel):
         self.rf.options = self.rf_opts
         data = self._init_data_container(self.X, self.y)
         self.rf.fit(data, rng=self.rng)
+        self.flat_forest = None
         return self
 
     def _init_data_container(self, X: np.ndarray, y: np.ndarray) -> regression.default_data_container:
         """Fills a pyrfr default data container, s.t. the forest knows
         categoricals and bounds for continous data
 
+        The container of the previous fit is reused if X and y start with
+        its rows, so that only the appended rows are added.
+
         Parameters
         ----------
         X : np.ndarray [n_samples, n_features]
@@ -167,17 +225,31 @@ class RandomForestWithInstances(BaseModel):
         data : regression.default_data_container
             The filled data container that pyrfr can interpret
         """
-        # retrieve the types and the bounds from the ConfigSpace
-        data = regression.default_data_container(X.shape[1])
-
-        for i, (mn, mx) in enumerate(self.bounds):
-            if np.isnan(mx):
-                data.set_type_of_feature(i, mn)
-            else:
-                data.set_bounds_of_feature(i, mn, mx)
-
-        for row_X, row_y in zip(X, y):
-            data.add_data_point(row_X, row_y)
+        n_reused = 0
+        data = self.data_container
+        if data is not None and self.container_X.shape[1] == X.shape[1] and self.container_X.shape[0] <= X.shape[0]:
+            n_reused = self.container_X.shape[0]
+            if not (np.array_equal(self.container_X, X[:n_reused]) and
+                    np.array_equal(self.container_y, y[:n_reused])):
+                n_reused = 0
+
+        if n_reused == 0:
+            # retrieve the types and the bounds from the ConfigSpace
+            data = regression.default_data_container(X.shape[1])
+
+            for i, (mn, mx) in enumerate(self.bounds):
+                if np.isnan(mx):
+                    data.set_type_of_feature(i, mn)
+                else:
+                    data.set_bounds_of_feature(i, mn, mx)
+
+        # Converting whole blocks to lists is much cheaper than passing numpy rows to SWIG.
+        add_data_point = data.add_data_point
+        for row_X, row_y in zip(X[n_reused:].tolist(), y[n_reused:].tolist()):
+            add_data_point(row_X, row_y)
+
+        self.data_container = data
+        self.container_X, self.container_y = X, y
         return data
 
     def _predict(self, X: np.ndarray,
@@ -209,6 +281,11 @@ class RandomForestWithInstances(BaseModel):
 
         X = self._impute_inactive(X)
 
+        if self.flat_forest is not None or X.shape[0] >= self.min_batch_size:
+            flat_forest = self._get_flat_forest()
+            if flat_forest is not None:
+                return self._predict_batch(X, flat_forest)
+
         if self.log_y:
             all_preds = []
             third_dimension = 0
@@ -244,6 +321,117 @@ class RandomForestWithInstances(BaseModel):
 
         return means.reshape((-1, 1)), vars_.reshape((-1, 1))
 
+    def _get_flat_forest(self) -> typing.Optional[typing.Dict[str, np.ndarray]]:
+        """Export the trained pyrfr forest into flat numpy arrays.
+
+        All trees are stored back to back; ``roots`` holds the index of each
+        tree's root node. Leaves have the children ``-1``. Returns None if a
+        categorical split does not fit into a 64-bit mask, in which case the
+        predictions fall back to pyrfr.
+        """
+        if self.flat_forest is not None:
+            return self.flat_forest
+        if self.rf is None:
+            raise ValueError('The random forest is not trained yet.')
+
+        trees = json.loads(self.rf.ascii_string_representation())['value1']
+        roots, feature, threshold, children, cat_mask, leaf_mean, leaf_log_mean = [], [], [], [], [], [], []
+        for tree in trees:
+            offset = len(feature)
+            roots.append(offset)
+            for node in tree['value0']:
+                left, right = node['value3']['value0'], node['value3']['value1']
+                split = node['value5']
+                if left == 0 and right == 0:
+                    children.append((-1, -1))
+                else:
+                    children.append((left + offset, right + offset))
+                feature.append(split['value0'])
+                threshold.append(split['value1'])
+                mask = split['value2']
+                mask = int(mask['data'], 2) if mask['type'] == 2 else int(mask['data'])
+                if mask >= 2 ** 64:
+                    return None
+                cat_mask.append(mask)
+                # The leaf statistics store the (weighted) mean of the responses.
+                leaf_mean.append(node['value6']['value0'])
+                values = np.array(node['value0'], dtype=np.float64)
+                leaf_log_mean.append(np.log(np.mean(np.exp(values)) + VERY_SMALL_NUMBER)
+                                     if values.shape[0] > 0 else np.nan)
+
+        self.flat_forest = dict(
+            roots=np.array(roots, dtype=np.int64),
+            feature=np.array(feature, dtype=np.int64),
+            threshold=np.array(threshold, dtype=np.float64),
+            children=np.array(children, dtype=np.int64).reshape(-1, 2),
+            cat_mask=np.array(cat_mask, dtype=np.uint64),
+            leaf_mean=np.array(leaf_mean, dtype=np.float64),
+            leaf_log_mean=np.array(leaf_log_mean, dtype=np.float64),
+        )
+        return self.flat_forest
+
+    @staticmethod
+    def _apply_flat_forest(X: np.ndarray, flat_forest: typing.Dict[str, np.ndarray]) -> np.ndarray:
+        """Return the leaf reached in every tree, as an array [n_samples, num_trees]."""
+        feature, threshold = flat_forest['feature'], flat_forest['threshold']
+        children, cat_mask = flat_forest['children'], flat_forest['cat_mask']
+        rows = np.repeat(np.arange(X.shape[0]), flat_forest['roots'].shape[0])
+        nodes = np.tile(flat_forest['roots'], X.shape[0])
+
+        active = np.flatnonzero(children[nodes, 0] >= 0)
+        while active.shape[0] > 0:
+            _nodes = nodes[active]
+            x = X[rows[active], feature[_nodes]]
+            thr = threshold[_nodes]
+            go_right = ~(x <= thr)
+            # Categorical splits (NaN threshold) send the categories in the mask to the left.
+            is_cat = np.isnan(thr)
+            if is_cat.any():
+                cat = np.nan_to_num(x[is_cat], nan=64.).astype(np.int64)
+                in_range = (cat >= 0) & (cat < 64)
+                bit = np.zeros(cat.shape[0], dtype=np.uint64)
+                bit[in_range] = (cat_mask[_nodes[is_cat]][in_range] >> cat[in_range].astype(np.uint64)) \
+                    & np.uint64(1)
+                go_right[is_cat] = bit == 0
+            nodes[active] = children[_nodes, go_right.astype(np.int64)]
+            active = active[children[nodes[active], 0] >= 0]
+        return nodes.reshape(X.shape[0], -1)
+
+    def _predict_chunk(self, X: np.ndarray, flat_forest: typing.Dict[str, np.ndarray]) \
+            -> typing.Tuple[np.ndarray, np.ndarray]:
+        leaves = self._apply_flat_forest(X, flat_forest)
+        if self.log_y:
+            preds = flat_forest['leaf_log_mean'][leaves]
+            return preds.mean(axis=1), preds.var(axis=1)
+
+        # Running statistics over the trees in order, as in pyrfr's predict_mean_var.
+        preds = flat_forest['leaf_mean'][leaves]
+        avg, sdm = np.zeros(X.shape[0]), np.zeros(X.shape[0])
+        for tree_id in range(preds.shape[1]):
+            delta = preds[:, tree_id] - avg
+            avg += delta / (tree_id + 1)
+            sdm += delta * (preds[:, tree_id] - avg)
+        if preds.shape[1] > 1:
+            var = sdm / (preds.shape[1] - 1)
+        else:
+            var = np.zeros(X.shape[0])
+        return avg, var
+
+    def _predict_batch(self, X: np.ndarray, flat_forest: typing.Dict[str, np.ndarray]) \
+            -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Predict means and variances for all rows of X with the flat forest."""
+        chunks = [X[start:start + self.chunk_size] for start in range(0, X.shape[0], self.chunk_size)]
+        if self.n_jobs > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+                results = list(executor.map(lambda chunk: self._predict_chunk(chunk, flat_forest), chunks))
+        else:
+            results = [self._predict_chunk(chunk, flat_forest) for chunk in chunks]
+        if len(results) == 0:
+            return np.zeros((0, 1)), np.zeros((0, 1))
+        means = np.concatenate([item[0] for item in results])
+        vars_ = np.concatenate([item[1] for item in results])
+        return means.reshape((-1, 1)), vars_.reshape((-1, 1))
+
     def predict_marginalized_over_instances(self, X: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
         """Predict mean and variance marginalized over all instances.
 
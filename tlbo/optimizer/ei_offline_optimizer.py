@@ -3,19 +3,51 @@ import numpy as np
 
 from tlbo.acquisition_function.acquisition import AbstractAcquisitionFunction
 from tlbo.config_space import Configuration, ConfigurationSpace
-from tlbo.utils.history_container import HistoryContainer
+from tlbo.config_space.util import convert_configurations_to_array
+from tlbo.utils.history_container import HistoryContainer, EvaluationRegistry
 from tlbo.optimizer.ei_optimization import AcquisitionFunctionMaximizer
 
 
 class OfflineSearch(AcquisitionFunctionMaximizer):
+    """Maximize the acquisition function over a fixed pool of candidates.
+
+    The candidate pool is encoded into a float64 matrix once at construction,
+    and each call scores the rows that have not been evaluated yet and returns
+    the best ``num_points`` of them.
+
+    Parameters
+    ----------
+    configuration_list : list(Configuration)
+        The candidate pool.
+    acquisition_function : ~tlbo.acquisition_function.acquisition.AbstractAcquisitionFunction
+
+    config_space : ~tlbo.config_space.ConfigurationSpace
+
+    rng : np.random.RandomState or int, optional
+
+    registry : ~tlbo.utils.history_container.EvaluationRegistry, optional
+        Registry whose ids are the positions in ``configuration_list``; the
+        evaluated and failed rows are excluded from the search.
+    """
     def __init__(
             self,
             configuration_list: List[Configuration],
             acquisition_function: AbstractAcquisitionFunction,
             config_space: ConfigurationSpace,
-            rng: Union[bool, np.random.RandomState] = None):
+            rng: Union[bool, np.random.RandomState] = None,
+            registry: EvaluationRegistry = None):
         super().__init__(acquisition_function, config_space, rng)
         self.configuration_list = configuration_list
+        self.candidate_array = convert_configurations_to_array(configuration_list)
+        if registry is not None and len(registry) < len(configuration_list):
+            raise ValueError('The registry does not cover the configuration list.')
+        self.registry = registry
+
+    @property
+    def evaluated_mask(self):
+        if self.registry is None:
+            return np.zeros(len(self.configuration_list), dtype=bool)
+        return self.registry.done_mask[:len(self.configuration_list)]
 
     def _maximize(
             self,
@@ -23,7 +55,31 @@ class OfflineSearch(AcquisitionFunctionMaximizer):
             num_points: int,
             **kwargs
     ) -> List[Tuple[float, Configuration]]:
-        _configs = self.configuration_list
-        for i in range(len(_configs)):
-            _configs[i].origin = 'Offline Search (sorted)'
-        return self._sort_configs_by_acq_value(_configs)
+        n_candidates = len(self.configuration_list)
+        # Draw the tie-breaking keys for the whole pool, as the full sort did.
+        random = self.rng.rand(n_candidates)
+        candidate_ids = np.nonzero(~self.evaluated_mask)[0]
+        if candidate_ids.shape[0] == 0:
+            return []
+
+        acq_values = self.acquisition_function.compute_array(self.candidate_array[candidate_ids]).reshape(-1)
+        random = random[candidate_ids]
+
+        num_points = min(num_points, candidate_ids.shape[0])
+        if num_points < candidate_ids.shape[0]:
+            # Keep every candidate tied with the num_points-th best value, so that
+            # the random tie-break below sees the same set as a full sort would.
+            kth = candidate_ids.shape[0] - num_points
+            threshold = np.partition(acq_values, kth)[kth]
+            top = np.nonzero(acq_values >= threshold)[0]
+        else:
+            top = np.arange(candidate_ids.shape[0])
+        # Last column is primary sort key!
+        order = top[np.lexsort((random[top], acq_values[top]))[::-1][:num_points]]
+
+        configs_acq = list()
+        for idx in order:
+            config = self.configuration_list[candidate_ids[idx]]
+            config.origin = 'Offline Search (sorted)'
+            configs_acq.append((acq_values[idx], config))
+        return configs_acq
@@ -8,6 +8,8 @@ import numpy as np
 from tlbo.acquisition_function.acquisition import AbstractAcquisitionFunction
 from tlbo.config_space import get_one_exchange_neighbourhood, \
     Configuration, ConfigurationSpace
+from tlbo.config_space.util import convert_configurations_to_array, sample_configuration_array, \
+    ConfigurationArray
 from tlbo.optimizer.random_configuration_chooser import ChooserNoCoolDown
 from tlbo.utils.constants import MAXINT
 from tlbo.utils.history_container import HistoryContainer
@@ -119,7 +121,7 @@ class AcquisitionFunctionMaximizer(object, metaclass=abc.ABCMeta):
                 ordered by their acquisition function value
         """
 
-        acq_values = self.acquisition_function(configs)
+        acq_values = self.acquisition_function.compute_array(convert_configurations_to_array(configs))
 
         # From here
         # http://stackoverflow.com/questions/20197990/how-to-make-argsort-result-to-be-random-between-equal-values
@@ -150,6 +152,9 @@ class LocalSearch(AcquisitionFunctionMaximizer):
     n_steps_plateau_walk: int
         number of steps during a plateau walk before local search terminates
 
+    best_improvement: bool
+        Move to the best improving neighbor instead of the first one in the neighborhood
+
     """
 
     def __init__(
@@ -159,10 +164,12 @@ class LocalSearch(AcquisitionFunctionMaximizer):
             rng: Union[bool, np.random.RandomState] = None,
             max_steps: Optional[int] = None,
             n_steps_plateau_walk: int = 10,
+            best_improvement: bool = False,
     ):
         super().__init__(acquisition_function, config_space, rng)
         self.max_steps = max_steps
         self.n_steps_plateau_walk = n_steps_plateau_walk
+        self.best_improvement = best_improvement
 
     def _maximize(
             self,
@@ -198,14 +205,10 @@ class LocalSearch(AcquisitionFunctionMaximizer):
         init_points = self._get_initial_points(
             num_points, runhistory)
 
-        configs_acq = []
         # Start N local search from different random start points
-        for start_point in init_points:
-            acq_val, configuration = self._one_iter(
-                start_point, **kwargs)
-
+        configs_acq = self._batch_iter(init_points, **kwargs)
+        for _, configuration in configs_acq:
             configuration.origin = "Local Search"
-            configs_acq.append((acq_val, configuration))
 
         # shuffle for random tie-break
         self.rng.shuffle(configs_acq)
@@ -241,57 +244,75 @@ class LocalSearch(AcquisitionFunctionMaximizer):
             start_point: Configuration,
             **kwargs
     ) -> Tuple[float, Configuration]:
+        return self._batch_iter([start_point], **kwargs)[0]
+
+    def _batch_iter(
+            self,
+            start_points: List[Configuration],
+            **kwargs
+    ) -> List[Tuple[float, Configuration]]:
+        """Runs the local searches from all start points in lockstep.
 
-        incumbent = start_point
-        # Compute the acquisition value of the incumbent
-        acq_val_incumbent = self.acquisition_function([incumbent], **kwargs)[0]
+        In each step, the neighborhoods of all incumbents that still improve
+        are scored in one call of the acquisition function.
+        """
+        incumbents = list(start_points)
+        # Compute the acquisition value of the incumbents
+        acq_val_incumbents = list(self.acquisition_function.compute_array(
+            convert_configurations_to_array(incumbents)).flatten())
 
-        local_search_steps = 0
+        local_search_steps = [0] * len(incumbents)
         neighbors_looked_at = 0
         time_n = []
-        while True:
-
-            local_search_steps += 1
-            if local_search_steps % 1000 == 0:
-                self.logger.warning(
-                    "Local search took already %d iterations. Is it maybe "
-                    "stuck in a infinite loop?", local_search_steps
-                )
+        active = list(range(len(incumbents)))
+        while len(active) > 0:
 
-            # Get neighborhood of the current incumbent
+            # Get neighborhood of the current incumbents
             # by randomly drawing configurations
-            changed_inc = False
-
-            # Get one exchange neighborhood returns an iterator (in contrast of
-            # the previously returned list).
-            all_neighbors = get_one_exchange_neighbourhood(
-                incumbent, seed=self.rng.seed())
-
-            for neighbor in all_neighbors:
-                s_time = time.time()
-                acq_val = self.acquisition_function([neighbor], **kwargs)
-                neighbors_looked_at += 1
-                time_n.append(time.time() - s_time)
-
-                if acq_val > acq_val_incumbent:
-                    self.logger.debug("Switch to one of the neighbors")
-                    incumbent = neighbor
-                    acq_val_incumbent = acq_val
-                    changed_inc = True
-                    break
-
-            if (not changed_inc) or \
-                    (self.max_steps is not None and
-                     local_search_steps == self.max_steps):
-                self.logger.debug("Local search took %d steps and looked at %d "
-                                  "configurations. Computing the acquisition "
-                                  "value for one configuration took %f seconds"
-                                  " on average.",
-                                  local_search_steps, neighbors_looked_at,
-                                  np.mean(time_n))
-                break
-
-        return acq_val_incumbent, incumbent
+            neighborhoods = []
+            for i in active:
+                local_search_steps[i] += 1
+                if local_search_steps[i] % 1000 == 0:
+                    self.logger.warning(
+                        "Local search took already %d iterations. Is it maybe "
+                        "stuck in a infinite loop?", local_search_steps[i]
+                    )
+                neighborhoods.append(list(get_one_exchange_neighbourhood(
+                    incumbents[i], seed=self.rng.randint(MAXINT))))
+
+            all_neighbors = [neighbor for neighbors in neighborhoods for neighbor in neighbors]
+            s_time = time.time()
+            if len(all_neighbors) > 0:
+                acq_vals = self.acquisition_function.compute_array(
+                    convert_configurations_to_array(all_neighbors)).flatten()
+            neighbors_looked_at += len(all_neighbors)
+            time_n.append(time.time() - s_time)
+
+            next_active = []
+            offset = 0
+            for i, neighbors in zip(active, neighborhoods):
+                values = acq_vals[offset:offset + len(neighbors)] if len(neighbors) > 0 else np.empty(0)
+                offset += len(neighbors)
+                improving = np.nonzero(values > acq_val_incumbents[i])[0]
+                if len(improving) == 0:
+                    continue
+
+                # The neighborhood is in the order of the former one-by-one search.
+                idx = improving[np.argmax(values[improving])] if self.best_improvement else improving[0]
+                self.logger.debug("Switch to one of the neighbors")
+                incumbents[i] = neighbors[idx]
+                acq_val_incumbents[i] = values[idx]
+                if self.max_steps is None or local_search_steps[i] != self.max_steps:
+                    next_active.append(i)
+            active = next_active
+
+        self.logger.debug("Local search took %d steps and looked at %d "
+                          "configurations. Computing the acquisition "
+                          "values of one step took %f seconds on average.",
+                          max(local_search_steps, default=0), neighbors_looked_at,
+                          np.mean(time_n) if len(time_n) > 0 else 0.)
+
+        return list(zip(acq_val_incumbents, incumbents))
 
 
 class RandomSearch(AcquisitionFunctionMaximizer):
@@ -333,20 +354,32 @@ class RandomSearch(AcquisitionFunctionMaximizer):
             tuple(acqusition_value, :class:`litebo.config_space.Configuration`).
         """
 
-        if num_points > 1:
-            rand_configs = self.config_space.sample_configuration(
-                size=num_points)
-        else:
-            rand_configs = [self.config_space.sample_configuration(size=1)]
         if _sorted:
-            for i in range(len(rand_configs)):
-                rand_configs[i].origin = 'Random Search (sorted)'
-            return self._sort_configs_by_acq_value(rand_configs)
+            rand_array, acq_values = self._maximize_array(num_points)
+            rand_configs = ConfigurationArray(self.config_space, rand_array, origin='Random Search (sorted)')
+            return [(acq_values[i], rand_configs[i]) for i in range(len(rand_configs))]
         else:
-            for i in range(len(rand_configs)):
-                rand_configs[i].origin = 'Random Search'
+            rand_array = sample_configuration_array(self.config_space, num_points)
+            rand_configs = ConfigurationArray(self.config_space, rand_array, origin='Random Search')
             return [(0, rand_configs[i]) for i in range(len(rand_configs))]
 
+    def _maximize_array(self, num_points: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Samples num_points encoded configurations and sorts them by acquisition value.
+
+        Returns
+        -------
+        np.ndarray(N, D)
+            The sorted configurations
+        np.ndarray(N,)
+            Their acquisition values
+        """
+        rand_array = sample_configuration_array(self.config_space, num_points)
+        acq_values = self.acquisition_function.compute_array(rand_array).reshape(-1)
+        random = self.rng.rand(len(acq_values))
+        # Last column is primary sort key!
+        indices = np.lexsort((random, acq_values))[::-1]
+        return rand_array[indices], acq_values[indices]
+
 
 class InterleavedLocalAndRandomSearch(AcquisitionFunctionMaximizer):
     """Implements litebo's default acquisition function optimization.
@@ -373,6 +406,9 @@ class InterleavedLocalAndRandomSearch(AcquisitionFunctionMaximizer):
     n_sls_iterations: int
         [Local Search] number of local search iterations
 
+    best_improvement: bool
+        [LocalSearch] Move to the best improving neighbor instead of the first one
+
     """
     def __init__(
             self,
@@ -381,8 +417,8 @@ class InterleavedLocalAndRandomSearch(AcquisitionFunctionMaximizer):
             rng: Union[bool, np.random.RandomState] = None,
             max_steps: Optional[int] = None,
             n_steps_plateau_walk: int = 10,
-            n_sls_iterations: int = 10
-
+            n_sls_iterations: int = 10,
+            best_improvement: bool = False,
     ):
         super().__init__(acquisition_function, config_space, rng)
         self.random_search = RandomSearch(
@@ -395,7 +431,8 @@ class InterleavedLocalAndRandomSearch(AcquisitionFunctionMaximizer):
             config_space=config_space,
             rng=rng,
             max_steps=max_steps,
-            n_steps_plateau_walk=n_steps_plateau_walk
+            n_steps_plateau_walk=n_steps_plateau_walk,
+            best_improvement=best_improvement,
         )
         self.n_sls_iterations = n_sls_iterations
 
@@ -441,12 +478,9 @@ class InterleavedLocalAndRandomSearch(AcquisitionFunctionMaximizer):
             runhistory, self.n_sls_iterations, **kwargs
         )
 
-        # Get configurations sorted by EI
-        next_configs_by_random_search_sorted = self.random_search._maximize(
-            runhistory,
-            num_points - len(next_configs_by_local_search),
-            _sorted=True,
-        )
+        # Get configurations sorted by EI, as an array
+        rand_array, rand_acq_values = self.random_search._maximize_array(
+            num_points - len(next_configs_by_local_search))
 
         # Having the configurations from random search, sorted by their
         # acquisition function value is important for the first few iterations
@@ -454,16 +488,23 @@ class InterleavedLocalAndRandomSearch(AcquisitionFunctionMaximizer):
         # want to use only random configurations. Having them at the begging of
         # the list ensures this (even after adding the configurations by local
         # search, and then sorting them)
-        next_configs_by_acq_value = (
-                next_configs_by_random_search_sorted
-                + next_configs_by_local_search
+        local_search_configs = [_[1] for _ in next_configs_by_local_search]
+        acq_values = np.concatenate([rand_acq_values, [_[0] for _ in next_configs_by_local_search]])
+        order = np.argsort(-acq_values, kind='stable')
+        position = np.empty_like(order)
+        position[order] = np.arange(order.shape[0])
+        # Only the configurations that are looked at are created.
+        local_search_array = convert_configurations_to_array(local_search_configs).reshape((-1, rand_array.shape[1]))
+        next_configs_by_acq_value = ConfigurationArray(
+            self.config_space,
+            np.vstack([rand_array, local_search_array])[order],
+            origin='Random Search (sorted)',
+            configs={int(position[rand_array.shape[0] + i]): config for i, config in enumerate(local_search_configs)},
         )
-        next_configs_by_acq_value.sort(reverse=True, key=lambda x: x[0])
         self.logger.debug(
             "First 10 acq func (origin) values of selected configurations: %s",
-            str([[_[0], _[1].origin] for _ in next_configs_by_acq_value[:10]])
+            str([[acq_values[order[i]], next_configs_by_acq_value[i].origin] for i in range(min(10, len(order)))])
         )
-        next_configs_by_acq_value = [_[1] for _ in next_configs_by_acq_value]
 
         challengers = ChallengerList(next_configs_by_acq_value,
                                      self.config_space,
@@ -0,0 +1,225 @@
+import sys
+import time
+import atexit
+import weakref
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+import psutil
+from tlbo.utils.limit import time_limit, TimeoutException
+from tlbo.utils.constants import MAXINT, SUCCESS, FAILDED, TIMEOUT
+
+# The open services, closed at exit since their workers are not daemonic.
+_services = weakref.WeakSet()
+
+
+@atexit.register
+def _close_services():
+    for service in list(_services):
+        service.close()
+
+
+def evaluate(objective_function, config, time_limit_per_trial=None):
+    """Evaluate config under the time limit and return (trial_state, perf, trial_info).
+
+    The limit uses SIGALRM, so it only works in the main thread of a process.
+    """
+    try:
+        if time_limit_per_trial is None:
+            perf = objective_function(config)
+        else:
+            with time_limit(time_limit_per_trial):
+                perf = objective_function(config)
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        trial_state = FAILDED if not isinstance(e, TimeoutException) else TIMEOUT
+        return trial_state, MAXINT, str(e)
+    return SUCCESS, perf, None
+
+
+def _worker_loop(conn, objective_function, initializer, initargs, time_limit_per_trial):
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            config = conn.recv()
+        except EOFError:
+            break
+        if config is None:
+            break
+        conn.send(evaluate(objective_function, config, time_limit_per_trial))
+
+
+class _Worker(object):
+    def __init__(self, objective_function, initializer, initargs, time_limit_per_trial):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker_loop,
+            args=(child_conn, objective_function, initializer, initargs, time_limit_per_trial))
+        # Not daemonic, so the objective function may start processes of its own.
+        self.process.start()
+        child_conn.close()
+        self.config = None
+        self.start_time = None
+
+    @property
+    def busy(self):
+        return self.config is not None
+
+    def submit(self, config):
+        self.config = config
+        self.start_time = time.time()
+        self.conn.send(config)
+
+    def get_rss(self):
+        """Return the resident memory of the worker and its children in MB."""
+        try:
+            process = psutil.Process(self.process.pid)
+            rss = process.memory_info().rss
+            for child in process.children(recursive=True):
+                rss += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            return 0.
+        return rss / 1024. / 1024.
+
+    def kill(self):
+        try:
+            process = psutil.Process(self.process.pid)
+            for child in process.children(recursive=True):
+                child.kill()
+        except psutil.NoSuchProcess:
+            pass
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class EvaluatorService(object):
+    """Evaluate an objective function in long-lived worker subprocesses.
+
+    The workers are reused between trials, so data loaded by initializer(*initargs)
+    or cached by the objective function stays in memory. The objective function
+    runs under a SIGALRM time limit in the worker; a worker that exceeds the
+    time limit plus kill_grace seconds, or whose resident memory (including its
+    children) exceeds memory_limit MB, is killed and respawned. The results are
+    (trial_state, perf, trial_info) tuples, as in iterate() of SMBO: a trial that
+    is killed for its time is a TIMEOUT, any other failure is FAILDED. The workers
+    may start processes of their own; the services left open are closed at exit.
+
+    Parameters
+    ----------
+    objective_function : callable
+        Maps a configuration to its performance.
+    n_workers : int
+        The number of worker processes.
+    time_limit_per_trial : int, optional
+        Wall-clock limit of a trial in seconds.
+    memory_limit : float, optional
+        Resident memory limit of a trial in MB.
+    initializer : callable, optional
+        Called with initargs once when a worker starts, e.g., to load the dataset.
+    kill_grace : float
+        Seconds a trial may run over its time limit before its worker is killed.
+    poll_interval : float
+        Seconds between the checks of the limits.
+    """
+    def __init__(self, objective_function, n_workers=1, time_limit_per_trial=None, memory_limit=None,
+                 initializer=None, initargs=(), kill_grace=5, poll_interval=0.1):
+        if n_workers < 1:
+            raise ValueError('The number of workers must be positive, got %d.' % n_workers)
+        self.objective_function = objective_function
+        self.n_workers = n_workers
+        self.time_limit_per_trial = time_limit_per_trial
+        self.memory_limit = memory_limit
+        self.initializer = initializer
+        self.initargs = initargs
+        self.kill_grace = kill_grace
+        self.poll_interval = poll_interval
+        self.workers = [self._spawn() for _ in range(n_workers)]
+        _services.add(self)
+
+    def _spawn(self):
+        return _Worker(self.objective_function, self.initializer, self.initargs, self.time_limit_per_trial)
+
+    @property
+    def n_free(self):
+        return sum(not worker.busy for worker in self.workers)
+
+    @property
+    def n_pending(self):
+        return self.n_workers - self.n_free
+
+    def submit(self, config):
+        """Start evaluating config on a free worker."""
+        for worker in self.workers:
+            if not worker.busy:
+                worker.submit(config)
+                return
+        raise ValueError('All %d workers are busy.' % self.n_workers)
+
+    def wait(self):
+        """Block until a trial finishes and return (config, (trial_state, perf, trial_info))."""
+        if self.n_pending == 0:
+            raise ValueError('No trial is running.')
+        while True:
+            busy = [worker for worker in self.workers if worker.busy]
+            ready = wait([worker.conn for worker in busy], timeout=self.poll_interval)
+            for worker in busy:
+                if worker.conn in ready:
+                    try:
+                        result = worker.conn.recv()
+                    except EOFError:
+                        result = None
+                    if result is None:
+                        # The worker died, respawn it outside of the except block.
+                        worker.process.join()
+                        return self._replace(worker, FAILDED, 'The worker exited with code %s.'
+                                             % worker.process.exitcode)
+                    config, worker.config = worker.config, None
+                    return config, result
+
+            for worker in busy:
+                if self.time_limit_per_trial is not None \
+                        and time.time() - worker.start_time > self.time_limit_per_trial + self.kill_grace:
+                    return self._replace(worker, TIMEOUT, 'Timed out!')
+                if self.memory_limit is not None and worker.get_rss() > self.memory_limit:
+                    return self._replace(worker, FAILDED, 'Memory limit of %d MB exceeded!' % self.memory_limit)
+
+    def _replace(self, worker, trial_state, trial_info):
+        config = worker.config
+        worker.kill()
+        self.workers[self.workers.index(worker)] = self._spawn()
+        return config, (trial_state, MAXINT, trial_info)
+
+    def map(self, configs):
+        """Evaluate configs on all workers and return their results in order."""
+        results = [None] * len(configs)
+        queue = list(enumerate(configs))
+        positions = dict()
+        while queue or self.n_pending > 0:
+            while queue and self.n_free > 0:
+                idx, config = queue.pop(0)
+                positions.setdefault(id(config), list()).append(idx)
+                self.submit(config)
+            config, result = self.wait()
+            results[positions[id(config)].pop(0)] = result
+        return results
+
+    def close(self):
+        for worker in self.workers:
+            if worker.busy:
+                worker.kill()
+            else:
+                worker.stop()
+        self.workers = list()
@@ -1,4 +1,5 @@
 import collections
+import numpy as np
 from tlbo.config_space import Configuration
 from tlbo.utils.constants import MAXINT
 
@@ -7,6 +8,52 @@ Perf = collections.namedtuple(
     'perf', ['cost', 'time', 'status', 'additional_info'])
 
 
+class ObservationBuffer(object):
+    """Preallocated design matrix and targets that grow by doubling their capacity.
+
+    ``X`` and ``y`` are read-only views on the filled rows, so handing them to a
+    model costs nothing; rows are never rewritten once appended.
+    """
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.size = 0
+        self._X = None
+        self._y = None
+
+    def __len__(self):
+        return self.size
+
+    def append(self, x: np.ndarray, y: float):
+        x = np.asarray(x, dtype=np.float64).reshape(-1)
+        if self._X is None:
+            self._X = np.empty((self.capacity, x.shape[0]), dtype=np.float64)
+            self._y = np.empty(self.capacity, dtype=np.float64)
+        elif self.size == self._X.shape[0]:
+            X, y_ = self._X, self._y
+            self._X = np.empty((2 * X.shape[0], X.shape[1]), dtype=np.float64)
+            self._y = np.empty(2 * X.shape[0], dtype=np.float64)
+            self._X[:self.size], self._y[:self.size] = X, y_
+        self._X[self.size] = x
+        self._y[self.size] = y
+        self.size += 1
+
+    @property
+    def X(self):
+        if self._X is None:
+            return np.zeros((0, 0), dtype=np.float64)
+        X = self._X[:self.size]
+        X.flags.writeable = False
+        return X
+
+    @property
+    def y(self):
+        if self._y is None:
+            return np.zeros(0, dtype=np.float64)
+        y = self._y[:self.size]
+        y.flags.writeable = False
+        return y
+
+
 class HistoryContainer(object):
     def __init__(self, task_id):
         self.task_id = task_id
@@ -14,12 +61,15 @@ class HistoryContainer(object):
         self.config_counter = 0
         self.incumbent_value = MAXINT
         self.incumbents = list()
+        # Encoded observations in insertion order.
+        self.observations = ObservationBuffer()
 
     def add(self, config: Configuration, perf: Perf):
         if config in self.data:
             raise ValueError('Repeated configuration detected!')
         self.data[config] = perf
         self.config_counter += 1
+        self.observations.append(config.get_array(), perf)
 
         if len(self.incumbents) > 0:
             if perf < self.incumbent_value:
@@ -42,3 +92,95 @@ class HistoryContainer(object):
 
     def get_incumbents(self):
         return self.incumbents
+
+
+class EvaluationRegistry(object):
+    """Registry of evaluated and failed configurations keyed by integer ids.
+
+    The ids of the configurations in ``configuration_list`` are their positions
+    in that list, so the boolean masks line up with the offline candidate pool.
+    Configurations outside the list get a fresh id the first time they are seen.
+    Membership tests are a dict lookup plus a mask read instead of a linear scan.
+    """
+    def __init__(self, configuration_list=None):
+        self.config_ids = dict()
+        self.configurations = list()
+        self._evaluated = np.zeros(0, dtype=bool)
+        self._failed = np.zeros(0, dtype=bool)
+        # Position of each evaluated configuration in the list of observations.
+        self._perf_idx = np.zeros(0, dtype=np.int64)
+        if configuration_list is not None:
+            self._grow(len(configuration_list))
+            for config in configuration_list:
+                self.get_id(config)
+
+    def __len__(self):
+        return len(self.configurations)
+
+    def __contains__(self, config: Configuration):
+        """Whether the configuration has been evaluated or has failed."""
+        _id = self.config_ids.get(config)
+        return _id is not None and self.is_done(_id)
+
+    def _grow(self, capacity):
+        if capacity <= self._evaluated.shape[0]:
+            return
+        capacity = max(capacity, 2 * self._evaluated.shape[0])
+        size = self._evaluated.shape[0]
+        evaluated, failed = np.zeros(capacity, dtype=bool), np.zeros(capacity, dtype=bool)
+        perf_idx = np.full(capacity, -1, dtype=np.int64)
+        evaluated[:size], failed[:size], perf_idx[:size] = self._evaluated, self._failed, self._perf_idx
+        self._evaluated, self._failed, self._perf_idx = evaluated, failed, perf_idx
+
+    def get_id(self, config: Configuration):
+        _id = self.config_ids.get(config)
+        if _id is None:
+            _id = len(self.configurations)
+            self._grow(_id + 1)
+            self.config_ids[config] = _id
+            self.configurations.append(config)
+        return _id
+
+    def get_config(self, _id):
+        return self.configurations[_id]
+
+    def is_done(self, _id):
+        return bool(self._evaluated[_id] or self._failed[_id])
+
+    def is_evaluated(self, config: Configuration):
+        _id = self.config_ids.get(config)
+        return _id is not None and bool(self._evaluated[_id])
+
+    def add_success(self, config: Configuration, perf_idx):
+        _id = self.get_id(config)
+        self._evaluated[_id] = True
+        self._perf_idx[_id] = perf_idx
+        return _id
+
+    def add_failure(self, config: Configuration):
+        _id = self.get_id(config)
+        self._failed[_id] = True
+        return _id
+
+    def get_perf_index(self, config: Configuration):
+        """Position of an evaluated configuration in the list of observations."""
+        return int(self._perf_idx[self.config_ids[config]])
+
+    @property
+    def evaluated_mask(self):
+        return self._evaluated[:len(self.configurations)]
+
+    @property
+    def failed_mask(self):
+        return self._failed[:len(self.configurations)]
+
+    @property
+    def done_mask(self):
+        return self.evaluated_mask | self.failed_mask
+
+    def first_unevaluated(self, configs):
+        """Return the first configuration in ``configs`` that is neither evaluated nor failed."""
+        for config in configs:
+            if config not in self:
+                return config
+        return None
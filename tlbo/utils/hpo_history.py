@@ -0,0 +1,147 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from collections.abc import Mapping
+
+from tlbo.config_space import ConfigurationSpace, Configuration
+from tlbo.config_space import json as config_space_json
+
+HEADER_FILE = 'header.json'
+CONFIG_FILE = 'configs.npy'
+PERF_FILE = 'perfs.npy'
+
+
+def get_config_space_hash(config_space: ConfigurationSpace):
+    return hashlib.md5(config_space_json.write(config_space).encode('utf-8')).hexdigest()
+
+
+class HPOHistory(Mapping):
+    """A read-only ``Configuration -> perf`` mapping over encoded config vectors.
+
+    The configurations are decoded only when they are accessed;
+    config_array and perfs expose the raw arrays.
+    """
+
+    def __init__(self, config_array: np.ndarray, perfs: np.ndarray,
+                 config_space: ConfigurationSpace, header: dict = None):
+        if config_array.shape[0] != perfs.shape[0]:
+            raise ValueError('Got %d configurations but %d perfs!' % (config_array.shape[0], perfs.shape[0]))
+        self.config_array = config_array
+        self.perfs = perfs
+        self.config_space = config_space
+        self.header = dict() if header is None else header
+        self._configs = [None] * config_array.shape[0]
+        self._index = None
+
+    @classmethod
+    def load(cls, path, config_space: ConfigurationSpace, mmap_mode='r'):
+        with open(os.path.join(path, HEADER_FILE), 'r') as f:
+            header = json.load(f)
+        if header['config_space_hash'] != get_config_space_hash(config_space):
+            raise ValueError('The configuration space does not match the one of %s.' % path)
+        config_array = np.load(os.path.join(path, CONFIG_FILE), mmap_mode=mmap_mode)
+        perfs = np.load(os.path.join(path, PERF_FILE), mmap_mode=mmap_mode)
+        return cls(config_array, perfs, config_space, header)
+
+    def get_config(self, idx):
+        if self._configs[idx] is None:
+            self._configs[idx] = Configuration(self.config_space, vector=np.array(self.config_array[idx]))
+        return self._configs[idx]
+
+    def head(self, num):
+        """Return the first num evaluations, sharing the arrays."""
+        history = HPOHistory(self.config_array[:num], self.perfs[:num], self.config_space, self.header)
+        history._configs = self._configs[:num]
+        return history
+
+    def copy(self):
+        # The history is read-only, so a copy can share the arrays.
+        return self.head(len(self))
+
+    def __getitem__(self, config: Configuration):
+        if self._index is None:
+            self._index = dict()
+            for idx, row in enumerate(np.asarray(self.config_array, dtype=np.float64)):
+                self._index.setdefault(row.tobytes(), idx)
+        idx = self._index.get(np.asarray(config.get_array(), dtype=np.float64).tobytes())
+        if idx is None:
+            raise KeyError(config)
+        return float(self.perfs[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.get_config(idx)
+
+    def __len__(self):
+        return self.config_array.shape[0]
+
+    def values(self):
+        return self.perfs.tolist()
+
+    def items(self):
+        return list(zip(self.keys(), self.perfs.tolist()))
+
+
+def save_hpo_history(path, hpo_data, config_space: ConfigurationSpace, **header):
+    """Store a ``Configuration -> perf`` mapping as .npy arrays plus a JSON header in the folder path."""
+    path = os.path.normpath(path)
+    config_array = np.array([config.get_array() for config in hpo_data.keys()], dtype=np.float64)
+    perfs = np.array(list(hpo_data.values()), dtype=np.float64)
+    header = dict(header)
+    header.update(config_space_hash=get_config_space_hash(config_space),
+                  trial_num=config_array.shape[0], n_dims=config_array.shape[1])
+    # Write into a temporary folder next to path and move it into place at the end,
+    # so an interrupted conversion is not picked up by the readers.
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path) or '.', prefix='.%s.' % os.path.basename(path),
+                                suffix='.tmp')
+    try:
+        np.save(os.path.join(tmp_path, CONFIG_FILE), config_array)
+        np.save(os.path.join(tmp_path, PERF_FILE), perfs)
+        with open(os.path.join(tmp_path, HEADER_FILE), 'w') as f:
+            json.dump(header, f, indent=2)
+        if os.path.exists(path):
+            # os.replace cannot overwrite a non-empty folder, so move the old one aside first.
+            old_path = tempfile.mkdtemp(dir=os.path.dirname(path) or '.', prefix='.%s.' % os.path.basename(path),
+                                        suffix='.old')
+            os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def resolve_hpo_file(filename):
+    """Return the converted history for a .pkl file name if it exists, else the pickle, else None.
+
+    A .hpo folder only counts as converted once its header is written.
+    """
+    if filename.endswith('.hpo'):
+        return filename if os.path.exists(os.path.join(filename, HEADER_FILE)) else None
+    if filename.endswith('.pkl'):
+        converted = filename[:-len('.pkl')] + '.hpo'
+        if os.path.exists(os.path.join(converted, HEADER_FILE)):
+            return converted
+    if os.path.exists(filename):
+        return filename
+    return None
+
+
+def load_hpo_data(filename, config_space: ConfigurationSpace):
+    """Load a history either from a pickle or from a converted .hpo folder."""
+    if filename.endswith('.hpo'):
+        return HPOHistory.load(filename, config_space)
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def get_perfs(hpo_data):
+    if isinstance(hpo_data, HPOHistory):
+        return np.asarray(hpo_data.perfs)
+    return np.array(list(hpo_data.values()))
@@ -0,0 +1,158 @@
+import numpy as np
+
+# The number of pair entries evaluated at once in the broadcasted losses.
+_CHUNK_SIZE = 1 << 22
+# Above this size, discordant pairs are counted in O(n log n).
+_BROADCAST_THRESHOLD = 2048
+
+
+def _iter_chunks(n_rows, row_size):
+    step = max(1, _CHUNK_SIZE // max(1, row_size))
+    for start in range(0, n_rows, step):
+        yield start, min(n_rows, start + step)
+
+
+def _sequential_sum(values):
+    # np.cumsum accumulates left to right, so the result equals the scalar loop.
+    if values.shape[-1] == 0:
+        return np.zeros(values.shape[:-1])
+    return np.cumsum(values, axis=-1)[..., -1]
+
+
+def _penalty_loss(y_pred, y, rows, cols):
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    lead_shape = y_pred.shape[:-1]
+    y_pred = y_pred.reshape(-1, y_pred.shape[-1])
+    # penalty(x1, x2, y1, y2): z = y2 - y1 if x1 < x2 else y1 - y2.
+    sign = np.where(y[rows] < y[cols], 1., -1.)
+
+    loss = np.empty(y_pred.shape[0])
+    for start, end in _iter_chunks(y_pred.shape[0], rows.shape[0]):
+        z = (y_pred[start:end, cols] - y_pred[start:end, rows]) * sign
+        z *= 10.
+        loss[start:end] = _sequential_sum(np.log(1 + np.exp(-z)))
+    return loss.reshape(lead_shape)
+
+
+def pairwise_penalty_loss(y_pred: np.ndarray, y: np.ndarray):
+    """Logistic ranking loss over all pairs i < j, divided by n * n.
+
+    y_pred may have any leading shape, e.g. (S, K + 1, n) for S samples
+    of K + 1 models; the loss is returned with the leading shape.
+    """
+    y = np.asarray(y, dtype=np.float64).reshape(-1)
+    n = y.shape[0]
+    rows, cols = np.triu_indices(n, 1)
+    return _penalty_loss(y_pred, y, rows, cols) / (n * n)
+
+
+def generalization_penalty_loss(y_pred: np.ndarray, y: np.ndarray, start_idx=0):
+    """Logistic ranking loss over all pairs (i, j) with i >= start_idx."""
+    y = np.asarray(y, dtype=np.float64).reshape(-1)
+    n = y.shape[0]
+    rows, cols = np.divmod(np.arange(start_idx * n, n * n), n)
+    return _penalty_loss(y_pred, y, rows, cols)
+
+
+def discordant_counts(y_pred: np.ndarray, y: np.ndarray, rows=None):
+    """Count ordered pairs (i, j) with (y[i] < y[j]) ^ (y_pred[i] < y_pred[j]).
+
+    i runs over rows (all observations by default) and j over all
+    observations. y_pred may have any leading shape, e.g. (S, K + 1, n).
+    """
+    y = np.asarray(y).reshape(-1)
+    y_pred = np.asarray(y_pred)
+    lead_shape = y_pred.shape[:-1]
+    y_pred = y_pred.reshape(-1, y_pred.shape[-1])
+    if rows is None:
+        rows = np.arange(y.shape[0])
+    rows = np.asarray(rows, dtype=np.int64)
+    true_order = y[rows, None] < y[None, :]
+
+    counts = np.empty(y_pred.shape[0], dtype=np.int64)
+    for start, end in _iter_chunks(y_pred.shape[0], rows.shape[0] * y.shape[0]):
+        _pred = y_pred[start:end]
+        pred_order = _pred[:, rows, None] < _pred[:, None, :]
+        counts[start:end] = np.sum(pred_order ^ true_order, axis=(1, 2))
+    return counts.reshape(lead_shape)
+
+
+def _dominance_count(key1, key2):
+    """Count ordered pairs (i, j) with key1[i] < key1[j] and key2[i] < key2[j]."""
+    n = key1.shape[0]
+    ranks = np.unique(key2, return_inverse=True)[1].reshape(-1) + 1
+    tree = [0] * (np.max(ranks) + 1 if n > 0 else 1)
+    order = np.argsort(key1, kind='mergesort')
+    sorted_key1 = key1[order]
+
+    count, start = 0, 0
+    while start < n:
+        end = start
+        while end < n and sorted_key1[end] == sorted_key1[start]:
+            end += 1
+        # Query the whole group of equal key1 before inserting it.
+        for idx in order[start:end]:
+            pos = ranks[idx] - 1
+            while pos > 0:
+                count += tree[pos]
+                pos -= pos & -pos
+        for idx in order[start:end]:
+            pos = ranks[idx]
+            while pos < len(tree):
+                tree[pos] += 1
+                pos += pos & -pos
+        start = end
+    return count
+
+
+def _count_discordant_pairs_fast(y_pred, y):
+    n = y.shape[0]
+    index = np.arange(n)
+    y_rank = np.unique(y, return_inverse=True)[1].reshape(-1)
+    pred_rank = np.unique(y_pred, return_inverse=True)[1].reshape(-1)
+    # Pairs where both orders are strict and disagree.
+    count = _dominance_count(y_rank, -pred_rank)
+    # Pairs i < j with y[i] == y[j] and y_pred[i] < y_pred[j].
+    count += _dominance_count(y_rank * n + index, pred_rank) - _dominance_count(y_rank, pred_rank)
+    # Pairs i < j with y_pred[i] == y_pred[j] and y[i] < y[j].
+    count += _dominance_count(pred_rank * n + index, y_rank) - _dominance_count(pred_rank, y_rank)
+    return count
+
+
+def count_discordant_pairs(y_pred: np.ndarray, y: np.ndarray):
+    """Count pairs i < j with (y[i] < y[j]) ^ (y_pred[i] < y_pred[j]).
+
+    Small inputs are broadcasted; large ones use an exact O(n log n)
+    count that treats ties the same way.
+    """
+    y = np.asarray(y).reshape(-1)
+    y_pred = np.asarray(y_pred).reshape(-1)
+    n = y.shape[0]
+    if n > _BROADCAST_THRESHOLD:
+        return _count_discordant_pairs_fast(y_pred, y)
+    rows, cols = np.triu_indices(n, 1)
+    return int(np.sum((y[rows] < y[cols]) ^ (y_pred[rows] < y_pred[cols])))
+
+
+def greedy_ensemble_selection(base_predictions: np.ndarray, y: np.ndarray, ensemble_size: int,
+                              loss_func=pairwise_penalty_loss):
+    """Select ensemble members with replacement, minimizing the loss of the mean prediction.
+
+    base_predictions has shape (n_models, n); the ids of the selected
+    models are returned in order of selection.
+    """
+    base_predictions = np.asarray(base_predictions, dtype=np.float64)
+    running_sum = None
+    selected = list()
+    for size in range(ensemble_size):
+        if running_sum is None:
+            predictions = base_predictions
+        else:
+            predictions = (running_sum + base_predictions) / (size + 1)
+        argmin_idx = int(np.argmin(loss_func(predictions, y)))
+        if running_sum is None:
+            running_sum = base_predictions[argmin_idx].copy()
+        else:
+            running_sum = running_sum + base_predictions[argmin_idx]
+        selected.append(argmin_idx)
+    return selected
@@ -1,85 +1,106 @@
-import itertools
 import numpy as np
 from scipy.optimize import minimize
 
 
-def Loss_func(true_y, pred_y, func_id):
+def get_pairs(true_y):
+    """Return the index arrays (i, j) of all pairs with true_y[i] > true_y[j].
+
+    The pairs are ordered as in itertools.combinations over the observations.
+    """
+    true_y = np.asarray(true_y, dtype=np.float64).reshape(-1)
+    rows, cols = np.triu_indices(true_y.shape[0], 1)
+    greater = true_y[rows] > true_y[cols]
+    valid = greater | (true_y[rows] < true_y[cols])
+    first = np.where(greater, rows, cols)[valid]
+    second = np.where(greater, cols, rows)[valid]
+    return first, second
+
+
+def _sequential_sum(values):
+    # np.cumsum accumulates left to right like the per-pair loop.
+    return np.cumsum(values, axis=0)[-1]
+
+
+def Loss_func(true_y, pred_y, func_id, pairs=None):
     if func_id == 0:
         # Return the L2 loss.
         return 1./(true_y.shape[0])*np.linalg.norm(true_y-pred_y, 2)
 
     # Compute the rank loss for varied loss function.
-    true_y = np.array(true_y)[:, 0]
-    pred_y = np.array(pred_y)[:, 0]
-    comb = itertools.combinations(range(true_y.shape[0]), 2)
-    pairs = list()
-    # Compute the pairs.
-    for _, (i, j) in enumerate(comb):
-        if true_y[i] > true_y[j]:
-            pairs.append((i, j))
-        elif true_y[i] < true_y[j]:
-            pairs.append((j, i))
-    loss = 0.
-    pair_num = len(pairs)
+    if pairs is None:
+        pairs = get_pairs(true_y)
+    pred_y = np.asarray(pred_y, dtype=np.float64).reshape(-1)
+    first, second = pairs
+    pair_num = first.shape[0]
     if pair_num == 0:
         return 0.
-    for (i, j) in pairs:
-        if func_id == 1:
-            loss += max(pred_y[j] - pred_y[i], 0.)
-        elif func_id == 2:
-            loss += np.exp(pred_y[j] - pred_y[i])
-        elif func_id == 3:
-            loss += np.log(1 + np.exp(pred_y[j] - pred_y[i]))
-        elif func_id == 4:
-            z = 10 * (pred_y[j] - pred_y[i])
-            loss += np.log(1 + np.exp(z))
-        else:
-            raise ValueError('Invalid loss type!')
-    return loss/pair_num
-
-
-def Loss_der(true_y, A, x, func_id):
+    diff = pred_y[second] - pred_y[first]
+    if func_id == 1:
+        loss = np.maximum(diff, 0.)
+    elif func_id == 2:
+        loss = np.exp(diff)
+    elif func_id == 3:
+        loss = np.log(1 + np.exp(diff))
+    elif func_id == 4:
+        loss = np.log(1 + np.exp(10 * diff))
+    else:
+        raise ValueError('Invalid loss type!')
+    return _sequential_sum(loss)/pair_num
+
+
+def Loss_der(true_y, A, x, func_id, pairs=None):
     y_pred = A * np.mat(x).T
     if func_id == 0:
         # Return the derivative for L2 loss.
         return -2./(A.shape[0])*np.array(A.T*(true_y-y_pred))[:, 0]
 
-    true_y = np.array(true_y)[:, 0]
-    pred_y = np.array(y_pred)[:, 0]
-
-    comb = itertools.combinations(range(true_y.shape[0]), 2)
-    pairs = list()
-    # Compute the pairs.
-    for _, (i, j) in enumerate(comb):
-        if true_y[i] > true_y[j]:
-            pairs.append((i, j))
-        elif true_y[i] < true_y[j]:
-            pairs.append((j, i))
+    if pairs is None:
+        pairs = get_pairs(true_y)
+    A = np.asarray(A, dtype=np.float64)
+    pred_y = np.asarray(y_pred, dtype=np.float64).reshape(-1)
+    first, second = pairs
+
     # Calculate the derivatives.
-    grad = np.zeros(A.shape[1])
-    pair_num = len(pairs)
+    pair_num = first.shape[0]
     if pair_num == 0:
-        return grad
-    for (i, j) in pairs:
-        if func_id == 1:
-            if pred_y[j] > pred_y[i]:
-                grad += (A[j] - A[i]).A1
-        elif func_id == 2:
-            grad += np.exp(pred_y[j] - pred_y[i]) * (A[j] - A[i]).A1
-        elif func_id == 3:
-            e_z = np.exp(pred_y[j] - pred_y[i])
-            grad += e_z / (1 + e_z) * (A[j] - A[i]).A1
-        elif func_id == 4:
-            c = 10.
-            e_z = np.exp(c * (pred_y[j] - pred_y[i]))
-            grad += e_z / (1 + e_z) * (c * (A[j] - A[i])).A1
-        else:
-            raise ValueError('Invalid func id!')
-    return grad/pair_num
-
-
-def scipy_solve(A, b, loss_type, debug=False):
+        return np.zeros(A.shape[1])
+    diff = pred_y[second] - pred_y[first]
+    A_diff = A[second] - A[first]
+    if func_id == 1:
+        grad = A_diff * (diff > 0)[:, None]
+    elif func_id == 2:
+        grad = np.exp(diff)[:, None] * A_diff
+    elif func_id == 3:
+        e_z = np.exp(diff)
+        grad = (e_z / (1 + e_z))[:, None] * A_diff
+    elif func_id == 4:
+        c = 10.
+        e_z = np.exp(c * diff)
+        grad = (e_z / (1 + e_z))[:, None] * (c * A_diff)
+    else:
+        raise ValueError('Invalid func id!')
+    return _sequential_sum(grad)/pair_num
+
+
+def project_to_simplex(x):
+    """Euclidean projection of x onto the probability simplex."""
+    x = np.asarray(x, dtype=np.float64).reshape(-1)
+    u = np.sort(x)[::-1]
+    css = np.cumsum(u) - 1.
+    idx = np.arange(1, x.shape[0] + 1)
+    rho = np.nonzero(u - css / idx > 0)[0][-1]
+    theta = css[rho] / (rho + 1.)
+    return np.maximum(x - theta, 0.)
+
+
+def scipy_solve(A, b, loss_type, debug=False, x0=None):
+    """Minimize the loss of A * x against b over the probability simplex with SLSQP.
+
+    x0 warm-starts the solver, e.g. from the previous weights; it is
+    projected onto the simplex first. The default is the uniform vector.
+    """
     n, m = A.shape
+    pairs = None if loss_type == 0 else get_pairs(b)
 
     # Add constraints.
     ineq_cons = {'type': 'ineq',
@@ -89,14 +110,17 @@ def scipy_solve(A, b, loss_type, debug=False):
                  'fun': lambda x: np.array([sum(x) - 1]),
                  'jac': lambda x: np.array([1.]*len(x))}
 
-    x0 = np.array([1. / m] * m)
+    if x0 is None:
+        x0 = np.array([1. / m] * m)
+    else:
+        x0 = project_to_simplex(x0)
 
     def f(x):
         w = np.mat(x).T
-        return Loss_func(b, A*w, loss_type)
+        return Loss_func(b, A*w, loss_type, pairs=pairs)
 
     def f_der(x):
-        return Loss_der(b, A, x, loss_type)
+        return Loss_der(b, A, x, loss_type, pairs=pairs)
 
     res = minimize(f, x0, method='SLSQP', jac=f_der,
                    constraints=[eq_cons, ineq_cons],
@@ -113,3 +137,56 @@ def scipy_solve(A, b, loss_type, debug=False):
         loss = f(res.x)
         print('Ranking loss', loss)
     return res.x, status
+
+
+def simplex_solve(A, b, loss_type, debug=False, x0=None, method='eg',
+                  lr=1., max_iter=500, tol=1e-8):
+    """Minimize the loss of A * x against b over the probability simplex by first-order steps.
+
+    method is 'eg' (exponentiated gradient) or 'pg' (projected gradient
+    with backtracking). Returns the weights and a status like scipy_solve.
+    """
+    if method not in ['eg', 'pg']:
+        raise ValueError('Invalid method %s.' % method)
+    n, m = A.shape
+    A = np.mat(A)
+    pairs = None if loss_type == 0 else get_pairs(b)
+
+    def f(x):
+        return Loss_func(b, A * np.mat(x).T, loss_type, pairs=pairs)
+
+    def f_der(x):
+        return Loss_der(b, A, x, loss_type, pairs=pairs)
+
+    if x0 is None:
+        x = np.array([1. / m] * m)
+    else:
+        x = project_to_simplex(x0)
+        if method == 'eg':
+            # Multiplicative updates cannot revive zero weights.
+            x = project_to_simplex(x + 1e-3)
+    loss = f(x)
+    step = lr
+    for _ in range(max_iter):
+        grad = f_der(x)
+        # Backtrack until the loss does not increase.
+        while True:
+            if method == 'eg':
+                _x = x * np.exp(-step * (grad - np.max(grad)))
+                _x /= np.sum(_x)
+            else:
+                _x = project_to_simplex(x - step * grad)
+            _loss = f(_x)
+            if _loss <= loss or step < 1e-10:
+                break
+            step *= 0.5
+        converged = loss - _loss <= tol * max(1., abs(loss))
+        x, loss = _x, _loss
+        if converged:
+            break
+        step *= 2.
+
+    status = not np.isnan(x).any()
+    if debug:
+        print('Ranking loss', loss)
+    return x, status
@@ -0,0 +1,42 @@
+import os
+import re
+import sys
+import pickle
+import argparse
+
+sys.path.append(os.getcwd())
+from tlbo.config_space.space_instance import get_configspace_instance
+from tlbo.utils.hpo_history import save_hpo_history, HPOHistory, HEADER_FILE
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--algo_id', type=str, default='random_forest')
+parser.add_argument('--data_dir', type=str, default='data/hpo_data/')
+parser.add_argument('--overwrite', type=str, default='false')
+args = parser.parse_args()
+
+algo_id = args.algo_id
+data_dir = args.data_dir
+overwrite = args.overwrite
+pattern = '(.*)-(%s)-(random-)?(\d+)\.pkl$' % algo_id
+
+
+if __name__ == "__main__":
+    algo_name = 'liblinear_svc' if algo_id == 'linear' else algo_id
+    config_space = get_configspace_instance(algo_id=algo_name)
+    for _file in sorted(os.listdir(data_dir)):
+        result = re.search(pattern, _file, re.I)
+        if result is None:
+            continue
+        target_path = data_dir + _file[:-len('.pkl')] + '.hpo'
+        if overwrite != 'true' and os.path.exists(os.path.join(target_path, HEADER_FILE)):
+            print('Skip %s: already converted.' % _file)
+            continue
+        with open(data_dir + _file, 'rb') as f:
+            data = pickle.load(f)
+        save_hpo_history(target_path, data, config_space, algo=algo_id, dataset=result.group(1))
+
+        # Check the converted history against the pickle.
+        history = HPOHistory.load(target_path, config_space)
+        assert list(history.keys()) == list(data.keys())
+        assert history.values() == list(data.values())
+        print('Converted %s: %d configurations.' % (_file, len(history)))
@@ -1,10 +1,13 @@
+import gc
 import os
 import re
 import sys
 import time
 import pickle
 import argparse
+import tempfile
 import numpy as np
+from multiprocessing import Pool
 
 sys.path.append(os.getcwd())
 from tlbo.framework.smbo_offline import SMBO_OFFLINE
@@ -22,7 +25,9 @@ from tlbo.facade.mklgp import MKLGP
 from tlbo.facade.topo_variant1 import OBTLV
 from tlbo.facade.topo_variant2 import TOPO
 from tlbo.facade.topo_variant3 import TOPO_V3
+from tlbo.facade.base_facade import share_source_surrogates
 from tlbo.config_space.space_instance import get_configspace_instance
+from tlbo.utils.hpo_history import resolve_hpo_file, load_hpo_data, get_perfs
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--task_id', type=str, default='main')
@@ -40,6 +45,10 @@ parser.add_argument('--num_source_problem', type=int, default=-1)
 parser.add_argument('--num_target_data', type=int, default=10000)
 parser.add_argument('--num_random_data', type=int, default=20000)
 parser.add_argument('--save_weight', type=str, default='false')
+parser.add_argument('--n_jobs', type=int, default=1)
+parser.add_argument('--rerun', type=str, default='false')
+# Train the source surrogates once before forking; they use --seed instead of the seed of each target.
+parser.add_argument('--prefork', type=str, default='false')
 args = parser.parse_args()
 algo_id = args.algo_id
 exp_id = args.exp_id
@@ -55,6 +64,9 @@ seed = args.seed
 run_num = args.run_num
 test_mode = args.test_mode
 save_weight = args.save_weight
+n_jobs = args.n_jobs
+rerun = args.rerun
+prefork = args.prefork
 baselines = args.methods.split(',')
 
 data_dir = 'data/hpo_data/'
@@ -68,23 +80,26 @@ else:
 
 algorithms = ['lightgbm', 'random_forest', 'linear', 'adaboost', 'lda', 'extra_trees']
 algo_str = '|'.join(algorithms)
-pattern = '(.*)-(%s)-(\d+).pkl' % algo_str
+pattern = '(.*)-(%s)-(\d+)\.(pkl|hpo)$' % algo_str
 
 
 def load_hpo_history():
     source_hpo_ids, source_hpo_data = list(), list()
     random_hpo_data = list()
+    config_space = get_configspace_instance(algo_id='liblinear_svc' if algo_id == 'linear' else algo_id)
     for _file in sorted(os.listdir(data_dir)):
-        if _file.endswith('.pkl') and _file.find(algo_id) != -1:
+        if _file.find(algo_id) != -1:
             result = re.search(pattern, _file, re.I)
             if result is None:
                 continue
+            # Prefer the converted history to the pickle.
+            if resolve_hpo_file(data_dir + _file) != data_dir + _file:
+                continue
             dataset_id, algo_name, total_trial_num = result.group(1), result.group(2), result.group(3)
             if int(total_trial_num) != n_target_data:
                 continue
-            with open(data_dir + _file, 'rb') as f:
-                data = pickle.load(f)
-                perfs = np.array(list(data.values()))
+            data = load_hpo_data(data_dir + _file, config_space)
+            perfs = get_perfs(data)
             p_max, p_min = np.max(perfs), np.min(perfs)
             if p_max == p_min:
                 continue
@@ -92,7 +107,7 @@ def load_hpo_history():
                 continue
             if test_mode == 'random':
                 _file = data_dir + '%s-%s-random-%d.pkl' % (dataset_id, algo_id, num_random_data)
-                if not os.path.exists(_file):
+                if resolve_hpo_file(_file) is None:
                     continue
             source_hpo_ids.append(dataset_id)
             source_hpo_data.append(data)
@@ -102,15 +117,14 @@ def load_hpo_history():
     # Load random hpo data to test the transfer performance.
     if test_mode == 'random':
         for id, hpo_id in enumerate(source_hpo_ids):
-            _file = data_dir + '%s-%s-random-%d.pkl' % (hpo_id, algo_id, num_random_data)
-            with open(_file, 'rb') as f:
-                data = pickle.load(f)
-                perfs = np.array(list(data.values()))
-                p_max, p_min = np.max(perfs), np.min(perfs)
-                if p_max == p_min:
-                    print('The same perfs found in the %d-th problem' % id)
-                    data = source_hpo_data[id].copy()
-                random_hpo_data.append(data)
+            _file = resolve_hpo_file(data_dir + '%s-%s-random-%d.pkl' % (hpo_id, algo_id, num_random_data))
+            data = load_hpo_data(_file, config_space)
+            perfs = get_perfs(data)
+            p_max, p_min = np.max(perfs), np.min(perfs)
+            if p_max == p_min:
+                print('The same perfs found in the %d-th problem' % id)
+                data = source_hpo_data[id].copy()
+            random_hpo_data.append(data)
 
     print('Load meta-features for each dataset.')
     meta_features = list()
@@ -125,6 +139,169 @@ def load_hpo_history():
     return source_hpo_ids, source_hpo_data, random_hpo_data, meta_features
 
 
+def get_surrogate_class(mth):
+    if mth == 'rgpe':
+        surrogate_class = RGPE
+    elif mth == 'notl':
+        surrogate_class = NoTL
+    elif mth == 'es':
+        surrogate_class = ES
+    elif mth == 'obtl':
+        surrogate_class = OBTL
+    elif mth == 'obtlv':
+        surrogate_class = OBTLV
+    elif mth == 'tst':
+        surrogate_class = TST
+    elif mth == 'pogpe':
+        surrogate_class = POGPE
+    elif mth == 'sgpr':
+        surrogate_class = SGPR
+    elif mth == 'scot':
+        surrogate_class = SCoT
+    elif mth == 'mklgp':
+        surrogate_class = MKLGP
+    elif mth == 'rs':
+        surrogate_class = RandomSearch
+    elif mth == 'tstm':
+        surrogate_class = TSTM
+    elif mth == 'topo':
+        surrogate_class = OBTLV
+    elif mth == 'topo_v3':
+        surrogate_class = TOPO_V3
+    else:
+        raise ValueError('Invalid baseline name - %s.' % mth)
+    return surrogate_class
+
+
+def get_run_name(mth):
+    name = '%s_%s_%d_%d_%s_%s' % (mth, algo_id, n_src_data, trial_num, surrogate_type, task_id)
+    if prefork == 'true':
+        # The shared source surrogates change the results, so keep them apart.
+        name += '_prefork'
+    return name
+
+
+def get_job_file(mth, id):
+    # One file per (method, algo_id, target problem, seed) cell. The folder also carries the
+    # initial design and the target data size, so a resumed run never reuses cells of other settings.
+    job_dir = '%s_init%d_target%d' % (get_run_name(mth), args.init_num, n_target_data)
+    return exp_dir + 'jobs/%s/%d-%s-%d.pkl' % (job_dir, id, hpo_ids[id], seeds[id])
+
+
+def dump_atomically(data, filename):
+    # Write to a temporary file in the same folder and rename it, so readers never see partial results.
+    dirname = os.path.dirname(filename)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(data, f)
+        os.replace(tmp_file, filename)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def run_job(job):
+    mth, id = job
+    print('=' * 20)
+    print('[%s-%s] Evaluate %d-th problem - %s.' % (algo_id, mth, id + 1, hpo_ids[id]))
+    start_time = time.time()
+
+    # Generate the source and target hpo data.
+    source_hpo_data, dataset_meta_features = list(), list()
+    if test_mode == 'bo':
+        target_hpo_data = hpo_data[id]
+    else:
+        target_hpo_data = random_test_data[id]
+    for _id, data in enumerate(hpo_data):
+        if _id != id:
+            source_hpo_data.append(data)
+            dataset_meta_features.append(meta_features[_id])
+
+    # Random seed.
+    seed = seeds[id]
+    # Select a subset of source problems to transfer.
+    rng = np.random.RandomState(seed)
+    shuffled_ids = np.arange(len(source_hpo_data))
+    rng.shuffle(shuffled_ids)
+    source_hpo_data = [source_hpo_data[id] for id in shuffled_ids[:num_source_problem]]
+    dataset_meta_features = [dataset_meta_features[id] for id in shuffled_ids[:num_source_problem]]
+    # Add the meta-features in the target problem.
+    dataset_meta_features.append(meta_features[id])
+
+    surrogate_class = get_surrogate_class(mth)
+    if mth not in ['mklgp', 'scot', 'tstm']:
+        surrogate = surrogate_class(config_space, source_hpo_data, target_hpo_data, seed,
+                                    surrogate_type=surrogate_type,
+                                    num_src_hpo_trial=n_src_data)
+    else:
+        surrogate = surrogate_class(config_space, source_hpo_data, target_hpo_data, seed,
+                                    surrogate_type=surrogate_type,
+                                    num_src_hpo_trial=n_src_data, metafeatures=dataset_meta_features)
+
+    smbo = SMBO_OFFLINE(target_hpo_data, config_space, surrogate,
+                        random_seed=seed, max_runs=trial_num,
+                        source_hpo_data=source_hpo_data,
+                        num_src_hpo_trial=n_src_data,
+                        surrogate_type=surrogate_type,
+                        enable_init_design=enable_init_design,
+                        initial_runs=init_num,
+                        acq_func='ei')
+
+    result = list()
+    rnd_target_perfs = [_perf for (_, _perf) in list(random_test_data[id].items())]
+    rnd_ymax, rnd_ymin = np.max(rnd_target_perfs), np.min(rnd_target_perfs)
+
+    for _iter_id in range(trial_num):
+        if surrogate.method_id == 'rs':
+            _perfs = rnd_target_perfs[:(_iter_id + 1)]
+            y_inc = np.min(_perfs)
+            adtm = (y_inc - rnd_ymin) / (rnd_ymax - rnd_ymin)
+            result.append([adtm, y_inc, 0.1])
+        else:
+            config, _, perf, _ = smbo.iterate()
+            time_taken = time.time() - start_time
+            adtm, y_inc = smbo.get_adtm(), smbo.get_inc_y()
+            result.append([adtm, y_inc, time_taken])
+    print('In %d-th problem: %s' % (id, hpo_ids[id]), 'adtm, y_inc', result[-1])
+    print('min/max', smbo.y_min, smbo.y_max)
+    print('mean,std', np.mean(smbo.ys), np.std(smbo.ys))
+    if hasattr(surrogate, 'hist_ws'):
+        weights = np.array(surrogate.hist_ws)
+        trans = lambda x: ','.join([('%.2f' % item) for item in x])
+        weight_str = '\n'.join([trans(item) for item in weights])
+        print(weight_str)
+        print('Weight stats.')
+        print(trans(np.mean(weights, axis=0)))
+        source_ids = [item[0] for item in enumerate(list(np.mean(weights, axis=0))) if item[1] >= 1e-2]
+        print('Source problems used', source_ids)
+
+    dump_atomically({'result': result, 'target_weight': surrogate.target_weight}, get_job_file(mth, id))
+    return job
+
+
+def merge_job_results():
+    target_weights = []
+    for mth in baselines:
+        exp_results = list()
+        for id in range(run_num):
+            with open(get_job_file(mth, id), 'rb') as f:
+                job_result = pickle.load(f)
+            exp_results.append(job_result['result'])
+            target_weights.append(job_result['target_weight'])
+
+        # The merged results keep the layout of the former on-the-fly saving.
+        if run_num == len(hpo_ids):
+            mth_file = '%s.pkl' % get_run_name(mth)
+            dump_atomically([np.array(exp_results), np.mean(exp_results, axis=0)], exp_dir + mth_file)
+
+            if save_weight == 'true':
+                mth_file = 'w_%s.pkl' % get_run_name(mth)
+                dump_atomically(list(target_weights), exp_dir + mth_file)
+
+
 if __name__ == "__main__":
     hpo_ids, hpo_data, random_test_data, meta_features = load_hpo_history()
     algo_name = 'liblinear_svc' if algo_id == 'linear' else algo_id
@@ -141,126 +318,32 @@ if __name__ == "__main__":
     if not os.path.exists(exp_dir):
         os.makedirs(exp_dir)
 
-    target_weights = []
-
+    # Expand the experiment into independent jobs and skip the finished ones.
+    jobs = list()
     for mth in baselines:
-        exp_results = list()
+        get_surrogate_class(mth)
         for id in range(run_num):
-            print('=' * 20)
-            print('[%s-%s] Evaluate %d-th problem - %s.' % (algo_id, mth, id + 1, hpo_ids[id]))
-            start_time = time.time()
-
-            # Generate the source and target hpo data.
-            source_hpo_data, dataset_meta_features = list(), list()
-            if test_mode == 'bo':
-                target_hpo_data = hpo_data[id]
-            else:
-                target_hpo_data = random_test_data[id]
-            for _id, data in enumerate(hpo_data):
-                if _id != id:
-                    source_hpo_data.append(data)
-                    dataset_meta_features.append(meta_features[_id])
-
-            # Random seed.
-            seed = seeds[id]
-            # Select a subset of source problems to transfer.
-            rng = np.random.RandomState(seed)
-            shuffled_ids = np.arange(len(source_hpo_data))
-            rng.shuffle(shuffled_ids)
-            source_hpo_data = [source_hpo_data[id] for id in shuffled_ids[:num_source_problem]]
-            dataset_meta_features = [dataset_meta_features[id] for id in shuffled_ids[:num_source_problem]]
-            # Add the meta-features in the target problem.
-            dataset_meta_features.append(meta_features[id])
-
-            if mth == 'rgpe':
-                surrogate_class = RGPE
-            elif mth == 'notl':
-                surrogate_class = NoTL
-            elif mth == 'es':
-                surrogate_class = ES
-            elif mth == 'obtl':
-                surrogate_class = OBTL
-            elif mth == 'obtlv':
-                surrogate_class = OBTLV
-            elif mth == 'tst':
-                surrogate_class = TST
-            elif mth == 'pogpe':
-                surrogate_class = POGPE
-            elif mth == 'sgpr':
-                surrogate_class = SGPR
-            elif mth == 'scot':
-                surrogate_class = SCoT
-            elif mth == 'mklgp':
-                surrogate_class = MKLGP
-            elif mth == 'rs':
-                surrogate_class = RandomSearch
-            elif mth == 'tstm':
-                surrogate_class = TSTM
-            elif mth == 'topo':
-                surrogate_class = OBTLV
-            elif mth == 'topo_v3':
-                surrogate_class = TOPO_V3
-            else:
-                raise ValueError('Invalid baseline name - %s.' % mth)
-            if mth not in ['mklgp', 'scot', 'tstm']:
-                surrogate = surrogate_class(config_space, source_hpo_data, target_hpo_data, seed,
-                                            surrogate_type=surrogate_type,
-                                            num_src_hpo_trial=n_src_data)
-            else:
-                surrogate = surrogate_class(config_space, source_hpo_data, target_hpo_data, seed,
-                                            surrogate_type=surrogate_type,
-                                            num_src_hpo_trial=n_src_data, metafeatures=dataset_meta_features)
-
-            smbo = SMBO_OFFLINE(target_hpo_data, config_space, surrogate,
-                                random_seed=seed, max_runs=trial_num,
-                                source_hpo_data=source_hpo_data,
-                                num_src_hpo_trial=n_src_data,
-                                surrogate_type=surrogate_type,
-                                enable_init_design=enable_init_design,
-                                initial_runs=init_num,
-                                acq_func='ei')
-
-            result = list()
-            rnd_target_perfs = [_perf for (_, _perf) in list(random_test_data[id].items())]
-            rnd_ymax, rnd_ymin = np.max(rnd_target_perfs), np.min(rnd_target_perfs)
-
-            for _iter_id in range(trial_num):
-                if surrogate.method_id == 'rs':
-                    _perfs = rnd_target_perfs[:(_iter_id + 1)]
-                    y_inc = np.min(_perfs)
-                    adtm = (y_inc - rnd_ymin) / (rnd_ymax - rnd_ymin)
-                    result.append([adtm, y_inc, 0.1])
-                else:
-                    config, _, perf, _ = smbo.iterate()
-                    time_taken = time.time() - start_time
-                    adtm, y_inc = smbo.get_adtm(), smbo.get_inc_y()
-                    result.append([adtm, y_inc, time_taken])
-            exp_results.append(result)
-            print('In %d-th problem: %s' % (id, hpo_ids[id]), 'adtm, y_inc', result[-1])
-            print('min/max', smbo.y_min, smbo.y_max)
-            print('mean,std', np.mean(smbo.ys), np.std(smbo.ys))
-            if hasattr(surrogate, 'hist_ws'):
-                weights = np.array(surrogate.hist_ws)
-                trans = lambda x: ','.join([('%.2f' % item) for item in x])
-                weight_str = '\n'.join([trans(item) for item in weights])
-                print(weight_str)
-                print('Weight stats.')
-                print(trans(np.mean(weights, axis=0)))
-                source_ids = [item[0] for item in enumerate(list(np.mean(weights, axis=0))) if item[1] >= 1e-2]
-                print('Source problems used', source_ids)
-
-            target_weights.append(surrogate.target_weight)
-
-            # Save the running results on the fly with overwriting.
-            if run_num == len(hpo_ids):
-                mth_file = '%s_%s_%d_%d_%s_%s.pkl' % (mth, algo_id, n_src_data, trial_num, surrogate_type, task_id)
-                with open(exp_dir + mth_file, 'wb') as f:
-                    data = [np.array(exp_results), np.mean(exp_results, axis=0)]
-                    pickle.dump(data, f)
-
-                if save_weight == 'true':
-                    mth_file = 'w_%s_%s_%d_%d_%s_%s.pkl' % (
-                        mth, algo_id, n_src_data, trial_num, surrogate_type, task_id)
-                    with open(exp_dir + mth_file, 'wb') as f:
-                        data = target_weights
-                        pickle.dump(data, f)
+            if rerun == 'true' or not os.path.exists(get_job_file(mth, id)):
+                jobs.append((mth, id))
+    print('%d of %d jobs to run.' % (len(jobs), len(baselines) * run_num))
+
+    if prefork == 'true' and len(jobs) > 0:
+        share_source_surrogates(config_space, hpo_data, seed, num_src_hpo_trial=n_src_data,
+                                surrogate_type=surrogate_type, n_jobs=n_jobs)
+        # Keep the garbage collector from touching, and thus copying, the inherited objects.
+        gc.freeze()
+
+    if n_jobs > 1 and len(jobs) > 1:
+        # The workers are forked and share the loaded hpo data and surrogates.
+        pool = Pool(min(n_jobs, len(jobs)))
+        try:
+            for mth, id in pool.imap_unordered(run_job, jobs):
+                print('Finished job: %s - %d-th problem.' % (mth, id + 1))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            run_job(job)
+
+    merge_job_results()
@@ -22,6 +22,7 @@ from tlbo.facade.scot import SCoT
 from tlbo.facade.mklgp import MKLGP
 from tlbo.facade.topo_variant1 import OBTLV
 from tlbo.config_space.space_instance import get_configspace_instance
+from tlbo.utils.hpo_history import HPOHistory, resolve_hpo_file, load_hpo_data, get_perfs
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--task_id', type=str, default='main')
@@ -73,23 +74,26 @@ else:
 
 algorithms = ['lightgbm', 'random_forest', 'linear', 'adaboost', 'lda', 'extra_trees']
 algo_str = '|'.join(algorithms)
-pattern = '(.*)-(%s)-(\d+).pkl' % algo_str
+pattern = '(.*)-(%s)-(\d+)\.(pkl|hpo)$' % algo_str
 
 
 def load_hpo_history():
     source_hpo_ids, source_hpo_data = list(), list()
     random_hpo_data = list()
+    config_space = get_configspace_instance(algo_id='liblinear_svc' if algo_id == 'linear' else algo_id)
     for _file in sorted(os.listdir(data_dir)):
-        if _file.endswith('.pkl') and _file.find(algo_id) != -1:
+        if _file.find(algo_id) != -1:
             result = re.search(pattern, _file, re.I)
             if result is None:
                 continue
+            # Prefer the converted history to the pickle.
+            if resolve_hpo_file(data_dir + _file) != data_dir + _file:
+                continue
             dataset_id, algo_name, total_trial_num = result.group(1), result.group(2), result.group(3)
             if int(total_trial_num) != n_target_data:
                 continue
-            with open(data_dir + _file, 'rb') as f:
-                data = pickle.load(f)
-                perfs = np.array(list(data.values()))
+            data = load_hpo_data(data_dir + _file, config_space)
+            perfs = get_perfs(data)
             p_max, p_min = np.max(perfs), np.min(perfs)
             if p_max == p_min:
                 continue
@@ -97,7 +101,7 @@ def load_hpo_history():
                 continue
             if test_mode == 'random':
                 _file = data_dir + '%s-%s-random-%d.pkl' % (dataset_id, algo_id, num_random_data)
-                if not os.path.exists(_file):
+                if resolve_hpo_file(_file) is None:
                     continue
             source_hpo_ids.append(dataset_id)
             source_hpo_data.append(data)
@@ -107,15 +111,14 @@ def load_hpo_history():
     # Load random hpo data to test the transfer performance.
     if test_mode == 'random':
         for id, hpo_id in enumerate(source_hpo_ids):
-            _file = data_dir + '%s-%s-random-%d.pkl' % (hpo_id, algo_id, num_random_data)
-            with open(_file, 'rb') as f:
-                data = pickle.load(f)
-                perfs = np.array(list(data.values()))
-                p_max, p_min = np.max(perfs), np.min(perfs)
-                if p_max == p_min:
-                    print('The same perfs found in the %d-th problem' % id)
-                    data = source_hpo_data[id].copy()
-                random_hpo_data.append(data)
+            _file = resolve_hpo_file(data_dir + '%s-%s-random-%d.pkl' % (hpo_id, algo_id, num_random_data))
+            data = load_hpo_data(_file, config_space)
+            perfs = get_perfs(data)
+            p_max, p_min = np.max(perfs), np.min(perfs)
+            if p_max == p_min:
+                print('The same perfs found in the %d-th problem' % id)
+                data = source_hpo_data[id].copy()
+            random_hpo_data.append(data)
 
     print('Load meta-features for each dataset.')
     meta_features = list()
@@ -131,6 +134,8 @@ def load_hpo_history():
 
 
 def fetch_subset(data, num):
+    if isinstance(data, HPOHistory):
+        return data.head(num)
     keys, values = list(data.keys())[:num], list(data.values())[:num]
     return OrderedDict(zip(keys, values))
 
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.getcwd())
+from tlbo.model.model_builder import build_model
+from tlbo.config_space.space_instance import get_configspace_instance
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--algo_id', type=str, default='random_forest')
+parser.add_argument('--n_list', type=str, default='100,500,1000,2000,5000,10000')
+parser.add_argument('--rep_num', type=int, default=3)
+parser.add_argument('--seed', type=int, default=42)
+args = parser.parse_args()
+
+algo_id = args.algo_id
+n_list = [int(item) for item in args.n_list.split(',')]
+rep_num = args.rep_num
+seed = args.seed
+
+
+def add_rows_one_by_one(model, X, y):
+    # The container construction before the bulk loading.
+    for row_X, row_y in zip(X, y):
+        model.data_container.add_data_point(row_X, row_y)
+
+
+if __name__ == "__main__":
+    config_space = get_configspace_instance(algo_id)
+    config_space.seed(seed)
+    rng = np.random.RandomState(seed)
+    print('%6s | %10s | %10s | %10s | %14s' % ('n', 'container', 'rows 1-by-1', 'fit', 'refit (+1 row)'))
+    for n in n_list:
+        X = np.array([config.get_array() for config in config_space.sample_configuration(n + 1)])
+        y = rng.rand(n + 1)
+        results = np.zeros(4)
+        for _ in range(rep_num):
+            model = build_model('rf', config_space, np.random.RandomState(seed))
+            _X = model._impute_inactive(X)
+
+            start_time = time.time()
+            model._init_data_container(_X[:n], y[:n])
+            results[0] += time.time() - start_time
+
+            model.data_container = None
+            model._init_data_container(_X[:0], y[:0])
+            start_time = time.time()
+            add_rows_one_by_one(model, _X[:n], y[:n])
+            results[1] += time.time() - start_time
+
+            model.data_container = None
+            start_time = time.time()
+            model.train(X[:n], y[:n])
+            results[2] += time.time() - start_time
+
+            start_time = time.time()
+            model.train(X, y)
+            results[3] += time.time() - start_time
+        results /= rep_num
+        print('%6d | %9.4fs | %9.4fs | %9.4fs | %13.4fs' % (n, *results))
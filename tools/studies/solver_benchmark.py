@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.getcwd())
+from tlbo.utils.scipy_solver import scipy_solve, simplex_solve, Loss_func
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_list', type=str, default='10,25,50,75,100')
+parser.add_argument('--k_list', type=str, default='5,10,20,30')
+parser.add_argument('--loss_type', type=int, default=3)
+parser.add_argument('--rep_num', type=int, default=3)
+parser.add_argument('--seed', type=int, default=42)
+args = parser.parse_args()
+
+n_list = [int(item) for item in args.n_list.split(',')]
+k_list = [int(item) for item in args.k_list.split(',')]
+loss_type = args.loss_type
+rep_num = args.rep_num
+rng = np.random.RandomState(args.seed)
+
+
+def make_problem(n, k):
+    # Source predictions are noisy copies of the target performance.
+    y = rng.rand(n)
+    A = y[:, None] + rng.randn(n, k) * rng.uniform(0.05, 1., size=k)
+    return np.mat(A), np.mat(y).T
+
+
+def time_solver(solver, A, b, **kwargs):
+    start_time = time.time()
+    x, _ = solver(A, b, loss_type, **kwargs)
+    return time.time() - start_time, Loss_func(b, A * np.mat(x).T, loss_type)
+
+
+if __name__ == "__main__":
+    print('%5s %5s | %20s | %20s | %20s | %20s' % ('n', 'K', 'slsqp', 'slsqp (warm start)', 'eg', 'pg'))
+    for n in n_list:
+        for k in k_list:
+            results = np.zeros((4, 2))
+            for _ in range(rep_num):
+                A, b = make_problem(n, k)
+                results[0] += time_solver(scipy_solve, A, b)
+                x0, _ = scipy_solve(A[:-5], b[:-5], loss_type)
+                results[1] += time_solver(scipy_solve, A, b, x0=x0)
+                results[2] += time_solver(simplex_solve, A, b, method='eg')
+                results[3] += time_solver(simplex_solve, A, b, method='pg')
+            results /= rep_num
+            print('%5d %5d | %s' % (n, k, ' | '.join(['%8.4fs loss=%.4f' % tuple(item) for item in results])))